@@ -1,4 +0,0 @@
-#!/usr/bin/env bash
-
-docker stop $(docker ps -a -q)
-docker rm $(docker ps -a -q)
\ No newline at end of file
@@ -0,0 +1,424 @@
+"""
+End-to-end benchmark of run_deployment against the fake Docker Engine.
+
+Every scenario deploys a synthetic stack of N components: a database
+component and N - 1 application components which build an image, run
+setup, database and server steps and are probed for readiness, all through
+the same code paths as the real components. Repositories are cloned from a
+local origin, so no network and no Docker daemon are needed.
+
+Each stack is deployed twice, 'cold' (empty engine and state) and 'warm'
+(everything deployed already), and then torn down ('down'), in separate
+processes with their own config.py. Reported are wall time, number of
+Engine API calls and peak RSS of the process.
+
+    python benchmarks/bench_deployment.py --sizes 1,5,10,25
+    python benchmarks/bench_deployment.py --latency exec=0.05 --json out.json
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# seconds per Engine API operation, roughly a local daemon with cached layers
+DEFAULT_LATENCIES = {
+    'pull': 0.2,
+    'build': 0.3,
+    'create': 0.03,
+    'start': 0.08,
+    'exec': 0.02,
+    'inspect': 0.002,
+    'stop': 0.5,  # shutdown of a process on SIGTERM
+}
+
+DATABASE_IMAGE = 'bench/mysql:5.7'
+DOCKERFILE = 'sso_local_Dockerfile'
+# application i depends on application i - 1 inside chains of this length
+DEPENDENCY_CHAIN = 4
+
+SETUP_COMMANDS = [
+    'cd /app;',
+    'python3 -m venv dist/env;',
+    'source dist/env/bin/activate;',
+    'pip install -r requirements.txt;',
+]
+PREPARE_COMMANDS = ['cd /app;', 'app-mgm check;']
+DB_COMMANDS = ['cd /app;', 'app-mgm migrate;', 'app-mgm loaddata initial;']
+STATIC_COMMANDS = ['cd /app;', 'app-mgm collectstatic;']
+SERVER_COMMANDS = ['cd /app;', 'app-server start;']
+
+
+def component_keys(size):
+    return ['MYSQL'] + [
+        str.format('BENCH_APP_{}', i) for i in range(1, size)]
+
+
+def make_config(work_dir, size, origin, replicas=1):
+    """ Settings of the benchmark stack in the format of config_default """
+    home = os.path.join(work_dir, 'home')
+    settings = {
+        'HOME_DEPLOYMENT_DIR': home,
+        'DEPLOYER_STATE_DIR': os.path.join(home, '.deployer'),
+        'GIT_REPOSITORIES': {},
+        'GIT_SYNC': {
+            'WORKERS': 4,
+            'CLONE_MODE': 'full',
+            'DEPTH': 1,
+            'UPDATE_STRATEGY': 'reset',
+            'MIRROR_DIR': os.path.join(work_dir, 'mirrors'),
+        },
+        'IMAGES': {'PULL_WORKERS': 4, 'CHECK_REMOTE': False},
+        'DB_SNAPSHOTS': {'ENABLED': True},
+        'PACKAGE_CACHES': {
+            'VOLUMES': {
+                'pip': 'bench_pip_cache',
+                'npm': 'bench_npm_cache',
+                'bower': 'bench_bower_cache'
+            },
+            'MAX_SIZE_MB': 4096
+        },
+        'LOGS': {
+            'DIR': os.path.join(home, '.deployer', 'logs'),
+            'FLUSH_INTERVAL': 0.2,
+            'MAX_TERMINAL_LINES': 200,
+            'TAIL_LINES': 30
+        },
+        'DOCKER_ENGINE': {'ASYNC_EXEC': True},
+        'LOAD_BALANCER': {
+            'IMAGE_NAME': 'nginx:1.25-alpine',
+            'ADDRESSES_PER_COMPONENT': 8
+        },
+        'STACKS': {
+            'REGISTRY': os.path.join(work_dir, 'stacks.json'),
+            'HOME_DIR': os.path.join(work_dir, 'stacks'),
+            'MAX_STACKS': 50,
+            'PORT_STEP': 100
+        },
+        'TEARDOWN': {'STOP_TIMEOUT': 3, 'WORKERS': 16, 'KEEP_SNAPSHOTS': 2},
+        'STEPS': {'WORKERS': 4},
+        'CHANGE_PLANNER': {'ENABLED': True},
+        'EVENTS': {'ENABLED': True},
+        'DOCKER_NETWORK': {
+            'NETWORK_NAME': 'bench_network',
+            'SUBNET': '172.30.0.0/16',
+            'GATEWAY': '172.30.255.254'
+        },
+        'CONTAINERS': {},
+    }
+
+    for index, key in enumerate(component_keys(size)):
+        name = key.lower()
+        settings['CONTAINERS'][key] = {
+            'DOCKER_PORT': 3306 if key == 'MYSQL' else 8000,
+            'LOCAL_PORT': 20000 + index,
+            'CONTAINER_NAME': str.format('bench_{}', name),
+            'IMAGE_NAME': DATABASE_IMAGE if key == 'MYSQL' else 'custom',
+            'NETWORK': {
+                'IPV4_ADDRESS': str.format(
+                    '172.30.{}.{}', index // 250, index % 250 + 2),
+                'HOSTNAME': [str.format('{}host', name.replace('_', ''))]
+            },
+            'MYSQL_ROOT_PASSWORD': 'root',
+            'WAIT_FOR_START_TIMEOUT': 60
+        }
+        if key != 'MYSQL':
+            settings['CONTAINERS'][key]['REPLICAS'] = replicas
+            settings['GIT_REPOSITORIES'][name] = {
+                'branch': 'master',
+                'url': origin,
+                'local_dir': os.path.join(home, name)
+            }
+
+    with open(os.path.join(work_dir, 'config.py'), mode='w') as f:
+        f.write('# generated by benchmarks/bench_deployment.py\n')
+        for name, value in settings.items():
+            f.write(str.format('{} = {!r}\n', name, value))
+
+
+def make_origin(path):
+    """ Local repository the application repositories are cloned from """
+    import git
+
+    repo = git.Repo.init(path, initial_branch='master')
+    files = {
+        'requirements.txt': 'django==1.11\n',
+        'migrations/0001_initial.py': '# initial migration\n',
+        'fixtures/initial.json': '[]\n',
+        'static/app.css': 'body {}\n',
+        'app.py': 'DEBUG = True\n',
+    }
+    for rel_path, content in files.items():
+        full_path = os.path.join(path, rel_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, mode='w') as f:
+            f.write(content)
+    repo.index.add(list(files))
+    repo.index.commit('Initial commit')
+    return path
+
+
+def change_origin(path):
+    """ Commit touching code and static files, deployed by the 'change' run """
+    import git
+
+    repo = git.Repo(path)
+    for rel_path, content in (
+            ('app.py', 'DEBUG = False\n'),
+            ('static/app.css', 'body { margin: 0; }\n')):
+        with open(os.path.join(path, rel_path), mode='w') as f:
+            f.write(content)
+    repo.index.add(['app.py', 'static/app.css'])
+    repo.index.commit('Change code and static files')
+
+
+def bench_components(**component_options):
+    """ Components factory for run_deployment """
+    from components.deploy_components import (
+        DeploymentComponent, client
+    )
+    from components.probes import ExecProbe
+    from components.steps import BOOT_SCOPE, Pipeline, Step
+    from config import CONTAINERS, DOCKER_NETWORK, GIT_REPOSITORIES
+
+    def networking_config(component):
+        settings = CONTAINERS[component.config_key]
+        return client.api.create_networking_config({
+            DOCKER_NETWORK['NETWORK_NAME']: client.api.create_endpoint_config(
+                ipv4_address=settings['NETWORK']['IPV4_ADDRESS'],
+                aliases=settings['NETWORK']['HOSTNAME']
+            )
+        })
+
+    class BenchDatabase(DeploymentComponent):
+        config_key = 'MYSQL'
+
+        def readiness_probe(self):
+            return ExecProbe(client, self.container_name, 'mysqladmin ping')
+
+        def create(self):
+            self.create_and_start_container(
+                image=self.image_name,
+                ports=[self.docker_port],
+                host_config=client.api.create_host_config(port_bindings={
+                    self.docker_port: self.localhost_port
+                }),
+                networking_config=networking_config(self)
+            )
+
+    class BenchApp(DeploymentComponent):
+        setup_manifests = ('requirements.txt',)
+        package_caches = ('pip',)
+        database_inputs = ('migrations/*.py', 'fixtures/*')
+
+        def __init__(self, config_key, depends_on, **kwargs):
+            self.config_key = config_key
+            self.depends_on = depends_on
+            self.repository = config_key.lower()
+            self.databases = (self.repository,)
+            super().__init__(**kwargs)
+
+        def readiness_probe(self):
+            return ExecProbe(client, self.container_name, 'app-mgm ping')
+
+        def pipeline(self):
+            return Pipeline([
+                Step('check', PREPARE_COMMANDS, inputs=('requirements.txt',)),
+                Step('databases', action=lambda: self.run_database_steps(
+                    [('db', DB_COMMANDS)]), requires=('check',),
+                    inputs=self.database_inputs),
+                Step('collectstatic', STATIC_COMMANDS, requires=('check',),
+                     inputs=('static/*',)),
+                Step('server', SERVER_COMMANDS, detach=True,
+                     requires=('databases', 'collectstatic'),
+                     scope=BOOT_SCOPE)
+            ])
+
+        def create(self):
+            image_tag = self.build_image_from_dockerfile(DOCKERFILE)
+            self.create_and_start_container(
+                setup_commands=SETUP_COMMANDS,
+                image=image_tag,
+                ports=[self.docker_port],
+                host_config=client.api.create_host_config(
+                    port_bindings={self.docker_port: self.localhost_port},
+                    binds={
+                        GIT_REPOSITORIES[self.repository]['local_dir']: {
+                            'bind': '/app',
+                            'mode': 'rw',
+                        }
+                    }
+                ),
+                networking_config=networking_config(self)
+            )
+            self.run_setup(SETUP_COMMANDS)
+            self.run_pipeline(self.pipeline())
+            self.deploy_replicas('server', SERVER_COMMANDS)
+
+    keys = [k for k in CONTAINERS if k != 'MYSQL']
+    components = []
+    for key in ['MYSQL'] + keys:
+        settings = CONTAINERS[key]
+        options = dict(
+            component_options,
+            container_name=settings['CONTAINER_NAME'],
+            image_name=settings['IMAGE_NAME'],
+            docker_port=settings['DOCKER_PORT'],
+            localhost_port=settings['LOCAL_PORT']
+        )
+        if key == 'MYSQL':
+            components.append(BenchDatabase(**options))
+            continue
+
+        index = keys.index(key)
+        depends_on = ('MYSQL',)
+        if index % DEPENDENCY_CHAIN:
+            depends_on += (keys[index - 1],)
+        options['image_name'] = settings['CONTAINER_NAME']
+        components.append(BenchApp(key, depends_on, **options))
+    return components
+
+
+def run_worker(result_path, run):
+    """
+    Deploys ('cold', 'warm' and 'change' runs) or tears down ('down') the
+    stack of config.py on sys.path, writes measurements
+    """
+    started = time.perf_counter()
+    if run == 'down':
+        from components.teardown import teardown
+        teardown('default', images=True)
+    else:
+        from components.deploy_operations import run_deployment
+        run_deployment(components=bench_components)
+    elapsed = time.perf_counter() - started
+
+    with open(result_path, mode='w') as f:
+        json.dump({
+            'seconds': elapsed,
+            # kilobytes on Linux
+            'peak_rss_mb': resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        }, f)
+
+
+def run_scenario(size, latencies, replicas=1, keep=False):
+    from fake_engine import FakeDockerEngine
+
+    work_dir = tempfile.mkdtemp(prefix=str.format('bench-{}-', size))
+    results = []
+    try:
+        origin = make_origin(os.path.join(work_dir, 'origin'))
+        make_config(work_dir, size, origin, replicas)
+        engine = FakeDockerEngine(
+            os.path.join(work_dir, 'docker.sock'), latencies=latencies,
+            images=[DATABASE_IMAGE, 'centos:7'])
+
+        env = dict(
+            os.environ,
+            DOCKER_HOST=engine.base_url,
+            PYTHONPATH=os.pathsep.join(filter(None, [
+                work_dir, REPO_DIR, BENCH_DIR,
+                os.environ.get('PYTHONPATH')])))
+
+        with engine:
+            for run in ('cold', 'warm', 'change', 'down'):
+                if run == 'change':
+                    change_origin(origin)
+                calls_before = sum(engine.calls.values())
+                result_path = os.path.join(work_dir, run + '.json')
+                log_path = os.path.join(work_dir, run + '.log')
+                with open(log_path, mode='w') as log:
+                    process = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__),
+                         '--worker', result_path, '--run', run],
+                        cwd=REPO_DIR, env=env, stdout=log,
+                        stderr=subprocess.STDOUT)
+                if process.returncode != 0:
+                    with open(log_path, mode='r') as log:
+                        raise RuntimeError(str.format(
+                            '{} run with {} components failed:\n{}',
+                            run, size, log.read()[-4000:]))
+
+                with open(result_path, mode='r') as f:
+                    result = json.load(f)
+                result.update(
+                    components=size, run=run,
+                    api_calls=sum(engine.calls.values()) - calls_before)
+                results.append(result)
+            results[-1]['calls_by_endpoint'] = dict(engine.calls)
+    finally:
+        if keep:
+            print(str.format('Work directory kept: {}', work_dir))
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark deployment against the fake Docker Engine.')
+    parser.add_argument(
+        '--sizes', default='1,5,10,25',
+        help='comma separated numbers of components in the stack')
+    parser.add_argument(
+        '--latency', action='append', default=[], metavar='OP=SECONDS',
+        help=str.format(
+            'latency of an operation, one of {}',
+            ', '.join(sorted(DEFAULT_LATENCIES))))
+    parser.add_argument(
+        '--no-latency', action='store_true',
+        help='measure only the overhead of the deployer itself')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument(
+        '--replicas', type=int, default=1,
+        help='replicas of every application component')
+    parser.add_argument(
+        '--keep', action='store_true',
+        help='keep work directories with configs, logs and traces')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        return run_worker(args.worker, args.run)
+
+    latencies = {} if args.no_latency else dict(DEFAULT_LATENCIES)
+    for item in args.latency:
+        operation, _, seconds = item.partition('=')
+        if operation not in DEFAULT_LATENCIES:
+            raise SystemExit(str.format('Unknown operation: {}', operation))
+        latencies[operation] = float(seconds)
+
+    sys.path.insert(0, BENCH_DIR)
+    results = []
+    print(str.format(
+        '{:>10}  {:<6}  {:>9}  {:>9}  {:>12}',
+        'components', 'run', 'seconds', 'API calls', 'peak RSS MB'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for result in run_scenario(
+                size, latencies, replicas=args.replicas, keep=args.keep):
+            results.append(result)
+            print(str.format(
+                '{:>10}  {:<6}  {:>9.2f}  {:>9}  {:>12.1f}',
+                result['components'], result['run'], result['seconds'],
+                result['api_calls'], result['peak_rss_mb']))
+
+    if args.json:
+        with open(args.json, mode='w') as f:
+            json.dump({'latencies': latencies, 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,884 @@
+"""
+Fake Docker Engine API server on a unix socket.
+
+Implements the part of the Engine API used by the deployer, with
+configurable latencies of operations and scripted exec output, so the
+orchestration code can be exercised and benchmarked without a daemon,
+a registry or network access.
+"""
+import collections
+import hashlib
+import http.server
+import itertools
+import json
+import os
+import re
+import socketserver
+import struct
+import threading
+import time
+import urllib.parse
+
+DEFAULT_LATENCIES = {
+    'pull': 0.0,
+    'build': 0.0,
+    'create': 0.0,
+    'start': 0.0,
+    'exec': 0.0,
+    'inspect': 0.0,
+    'stop': 0.0,
+}
+
+API_VERSION = '1.41'
+
+
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime())
+
+
+def _new_id(*parts):
+    seed = '\0'.join(str(p) for p in parts) + str(time.time()) + \
+        str(next(_counter))
+    return hashlib.sha256(seed.encode()).hexdigest()
+
+
+_counter = itertools.count()
+
+
+def _normalize_image(name):
+    if name.startswith('sha256:') or '@' in name:
+        return name
+    last = name.rsplit('/', 1)[-1]
+    return name if ':' in last else name + ':latest'
+
+
+class ExecRule(object):
+    """ Output and exit code of exec commands matching 'pattern' """
+
+    def __init__(self, pattern, output='', exit_code=0, duration=None):
+        self.pattern = re.compile(pattern)
+        self.output = output
+        self.exit_code = exit_code
+        self.duration = duration
+
+
+class EngineState(object):
+    def __init__(self, latencies=None, exec_rules=None, images=()):
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.exec_rules = list(exec_rules or [])
+        self.lock = threading.RLock()
+        self.calls = collections.Counter()
+        self.images = {}  # id -> image
+        self.tags = {}  # repo:tag -> image id
+        self.containers = {}  # id -> container
+        self.names = {}  # name -> container id
+        self.networks = {}  # id -> network
+        self.volumes = {}  # name -> volume
+        self.execs = {}  # id -> exec
+        self.logs = collections.defaultdict(list)  # container id -> lines
+        self.events = []
+        self.event_condition = threading.Condition(self.lock)
+        for image in images:
+            self.add_image(image)
+
+        bridge_id = _new_id('bridge')
+        self.networks[bridge_id] = {
+            'Name': 'bridge', 'Id': bridge_id, 'Driver': 'bridge',
+            'Labels': {}, 'IPAM': {'Config': []}, 'Containers': {}
+        }
+
+    def sleep(self, operation):
+        delay = self.latencies.get(operation) or 0
+        if delay:
+            time.sleep(delay)
+
+    def add_image(self, name, labels=None, parent=None):
+        with self.lock:
+            tag = _normalize_image(name)
+            image_id = 'sha256:' + _new_id('image', tag)
+            previous = self.tags.get(tag)
+            if previous and previous in self.images:
+                self.images[previous]['RepoTags'].remove(tag)
+            repository = tag.rsplit(':', 1)[0]
+            self.images[image_id] = {
+                'Id': image_id,
+                'RepoTags': [tag],
+                'RepoDigests': [
+                    repository + '@sha256:' + _new_id('digest', tag)],
+                'Created': _now(),
+                'Size': 1024 * 1024,
+                'Parent': parent or '',
+                'Config': {'Labels': dict(labels or {})},
+            }
+            self.tags[tag] = image_id
+            return self.images[image_id]
+
+    def find_image(self, name):
+        with self.lock:
+            if name in self.images:
+                return self.images[name]
+            image_id = self.tags.get(_normalize_image(name))
+            if image_id:
+                return self.images[image_id]
+            for image_id, image in self.images.items():
+                if image_id.split(':')[-1].startswith(name):
+                    return image
+            return None
+
+    def find_container(self, ref):
+        with self.lock:
+            ref = ref.lstrip('/')
+            if ref in self.containers:
+                return self.containers[ref]
+            if ref in self.names:
+                return self.containers[self.names[ref]]
+            for container_id, container in self.containers.items():
+                if container_id.startswith(ref):
+                    return container
+            return None
+
+    def find_network(self, ref):
+        with self.lock:
+            if ref in self.networks:
+                return self.networks[ref]
+            for network in self.networks.values():
+                if network['Name'] == ref or network['Id'].startswith(ref):
+                    return network
+            return None
+
+    def emit(self, event_type, action, actor_id, attributes):
+        with self.lock:
+            self.events.append({
+                'Type': event_type,
+                'Action': action,
+                'status': action,
+                'id': actor_id,
+                'Actor': {'ID': actor_id, 'Attributes': attributes},
+                'time': int(time.time()),
+                'timeNano': time.time_ns(),
+            })
+            self.event_condition.notify_all()
+
+    def exec_rule(self, cmd):
+        command = ' '.join(cmd) if isinstance(cmd, list) else cmd
+        for rule in self.exec_rules:
+            if rule.pattern.search(command):
+                return rule
+        return ExecRule('', output='', exit_code=0)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeDocker'
+
+    routes = []
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'unix'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    # --- plumbing
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(chunks)
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _json_body(self):
+        body = self._read_body()
+        return json.loads(body.decode()) if body else {}
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, status=204):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_error_json(self, status, message):
+        self.send_json({'message': message}, status=status)
+
+    def start_chunked(self, content_type='application/json'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        if isinstance(data, dict):
+            data = (json.dumps(data) + '\r\n').encode()
+        self.wfile.write(
+            str.format('{:x}\r\n', len(data)).encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _dispatch(self, method):
+        parsed = urllib.parse.urlsplit(self.path)
+        path = re.sub(r'^/v[0-9.]+', '', parsed.path)
+        self.query = {
+            k: v[-1] for k, v in urllib.parse.parse_qs(
+                parsed.query, keep_blank_values=True).items()
+        }
+        for route_method, pattern, operation, name in self.routes:
+            if route_method != method:
+                continue
+            match = re.match(pattern + '$', path)
+            if match:
+                with self.state.lock:
+                    self.state.calls[operation] += 1
+                return getattr(self, name)(
+                    *[urllib.parse.unquote(g) for g in match.groups()])
+        self._read_body()
+        self.send_error_json(404, str.format('page not found: {}', path))
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    # --- system
+
+    def version(self):
+        self.send_json({
+            'Version': '20.10.0-fake', 'ApiVersion': API_VERSION,
+            'MinAPIVersion': '1.12', 'Os': 'linux', 'Arch': 'amd64'
+        })
+
+    def ping(self):
+        body = b'OK'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Api-Version', API_VERSION)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def system_df(self):
+        with self.state.lock:
+            volumes = []
+            for volume in self.state.volumes.values():
+                ref_count = sum(
+                    1 for c in self.state.containers.values()
+                    if volume['Name'] in ' '.join(
+                        c['HostConfig'].get('Binds') or []))
+                volumes.append(dict(volume, UsageData={
+                    'Size': volume.get('Size', 0), 'RefCount': ref_count}))
+            self.send_json({
+                'Images': list(self.state.images.values()),
+                'Containers': [],
+                'Volumes': volumes,
+            })
+
+    def events(self):
+        filters = json.loads(self.query.get('filters') or '{}')
+        since = len(self.state.events)
+        self.start_chunked()
+        try:
+            while True:
+                with self.state.lock:
+                    while since >= len(self.state.events):
+                        self.state.event_condition.wait(0.5)
+                        if self.server.stopping:
+                            return
+                    new_events = self.state.events[since:]
+                    since = len(self.state.events)
+                for event in new_events:
+                    if _matches_filters(event, filters):
+                        self.write_chunk(event)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    # --- images
+
+    def inspect_image(self, name):
+        self.state.sleep('inspect')
+        image = self.state.find_image(name)
+        if image is None:
+            return self.send_error_json(
+                404, str.format('No such image: {}', name))
+        self.send_json(image)
+
+    def list_images(self):
+        filters = json.loads(self.query.get('filters') or '{}')
+        with self.state.lock:
+            self.send_json([
+                dict(image, Labels=image['Config']['Labels'])
+                for image in self.state.images.values()
+                if _matches_filters(
+                    {'Labels': image['Config']['Labels']}, filters)
+            ])
+
+    def remove_image(self, name):
+        with self.state.lock:
+            image = self.state.find_image(name)
+            if image is None:
+                return self.send_error_json(
+                    404, str.format('No such image: {}', name))
+            for tag in image['RepoTags']:
+                self.state.tags.pop(tag, None)
+            del self.state.images[image['Id']]
+        self.send_json([{'Deleted': image['Id']}])
+
+    def distribution(self, name):
+        image = self.state.find_image(name)
+        digest = image['RepoDigests'][0].split('@')[-1] if image else \
+            'sha256:' + _new_id('remote', name)
+        self.send_json({'Descriptor': {'digest': digest}})
+
+    def pull(self):
+        self._read_body()
+        name = self.query.get('fromImage', '')
+        tag = self.query.get('tag') or 'latest'
+        full_name = str.format('{}:{}', name, tag)
+        self.start_chunked()
+        self.write_chunk({'status': str.format(
+            'Pulling from {}', name), 'id': tag})
+        layers = [_new_id('layer', full_name, i)[:12] for i in range(3)]
+        for layer in layers:
+            self.write_chunk({
+                'status': 'Pulling fs layer', 'progressDetail': {},
+                'id': layer})
+        self.state.sleep('pull')
+        for layer in layers:
+            self.write_chunk({
+                'status': 'Downloading', 'id': layer,
+                'progressDetail': {'current': 1024, 'total': 1024}})
+            self.write_chunk({
+                'status': 'Pull complete', 'progressDetail': {},
+                'id': layer})
+        self.state.add_image(full_name)
+        self.write_chunk({'status': str.format(
+            'Status: Downloaded newer image for {}', full_name)})
+        self.end_chunked()
+
+    def build(self):
+        self._read_body()
+        tag = self.query.get('t')
+        labels = json.loads(self.query.get('labels') or '{}')
+        self.start_chunked()
+        self.write_chunk({'stream': 'Step 1/1 : FROM fake\n'})
+        self.state.sleep('build')
+        image = self.state.add_image(tag or _new_id('build'), labels=labels)
+        self.write_chunk({'aux': {'ID': image['Id']}})
+        self.write_chunk({'stream': str.format(
+            'Successfully built {}\n', image['Id'][7:19])})
+        if tag:
+            self.write_chunk({'stream': str.format(
+                'Successfully tagged {}\n', _normalize_image(tag))})
+        self.end_chunked()
+
+    def commit(self):
+        conf = self._json_body()
+        container = self.state.find_container(
+            self.query.get('container', ''))
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        name = str.format(
+            '{}:{}', self.query.get('repo'), self.query.get('tag') or 'latest')
+        image = self.state.add_image(
+            name, labels=(conf or {}).get('Labels'),
+            parent=container['Image'])
+        self.send_json({'Id': image['Id']}, status=201)
+
+    # --- networks
+
+    def list_networks(self):
+        filters = json.loads(self.query.get('filters') or '{}')
+        with self.state.lock:
+            self.send_json([
+                network for network in self.state.networks.values()
+                if _matches_filters(network, filters)
+            ])
+
+    def create_network(self):
+        body = self._json_body()
+        with self.state.lock:
+            if self.state.find_network(body['Name']):
+                return self.send_error_json(409, 'network already exists')
+            network_id = _new_id('network', body['Name'])
+            self.state.networks[network_id] = {
+                'Name': body['Name'],
+                'Id': network_id,
+                'Driver': body.get('Driver', 'bridge'),
+                'Labels': body.get('Labels') or {},
+                'IPAM': body.get('IPAM') or {'Config': []},
+                'Containers': {},
+            }
+        self.send_json({'Id': network_id, 'Warning': ''}, status=201)
+
+    def inspect_network(self, ref):
+        network = self.state.find_network(ref)
+        if network is None:
+            return self.send_error_json(404, 'network not found')
+        self.send_json(network)
+
+    def remove_network(self, ref):
+        with self.state.lock:
+            network = self.state.find_network(ref)
+            if network is None:
+                return self.send_error_json(404, 'network not found')
+            if network['Containers']:
+                return self.send_error_json(
+                    403, 'network has active endpoints')
+            del self.state.networks[network['Id']]
+        self.send_empty()
+
+    # --- volumes
+
+    def list_volumes(self):
+        filters = json.loads(self.query.get('filters') or '{}')
+        with self.state.lock:
+            self.send_json({
+                'Volumes': [
+                    v for v in self.state.volumes.values()
+                    if _matches_filters(v, filters)
+                ],
+                'Warnings': None})
+
+    def create_volume(self):
+        body = self._json_body()
+        with self.state.lock:
+            volume = self.state.volumes.setdefault(body['Name'], {
+                'Name': body['Name'],
+                'Driver': 'local',
+                'Labels': body.get('Labels') or {},
+                'Mountpoint': '/var/lib/docker/volumes/' + body['Name'],
+                'Size': 0,
+            })
+        self.send_json(volume, status=201)
+
+    def remove_volume(self, name):
+        with self.state.lock:
+            if self.state.volumes.pop(name, None) is None:
+                return self.send_error_json(404, 'no such volume')
+        self.send_empty()
+
+    # --- containers
+
+    def list_containers(self):
+        filters = json.loads(self.query.get('filters') or '{}')
+        show_all = self.query.get('all') in ('1', 'true', 'True')
+        result = []
+        with self.state.lock:
+            for container in self.state.containers.values():
+                if not show_all and not container['State']['Running']:
+                    continue
+                summary = {
+                    'Id': container['Id'],
+                    'Names': ['/' + container['Name']],
+                    'Image': container['Config']['Image'],
+                    'ImageID': container['Image'],
+                    'Created': int(time.time()),
+                    'State': container['State']['Status'],
+                    'Status': 'Up 1 second' if container['State'][
+                        'Running'] else 'Exited (0) 1 second ago',
+                    'Labels': container['Config']['Labels'],
+                    'Ports': [
+                        {'PrivatePort': int(p.split('/')[0]),
+                         'PublicPort': int(b[0]['HostPort']),
+                         'Type': 'tcp', 'IP': '0.0.0.0'}
+                        for p, b in container['NetworkSettings'][
+                            'Ports'].items() if b
+                    ],
+                    'NetworkSettings': {
+                        'Networks': container['NetworkSettings']['Networks']},
+                }
+                if _matches_filters(summary, filters):
+                    result.append(summary)
+        self.send_json(result)
+
+    def create_container(self):
+        body = self._json_body()
+        name = self.query.get('name') or _new_id('name')[:12]
+        self.state.sleep('create')
+        with self.state.lock:
+            if name in self.state.names:
+                return self.send_error_json(409, str.format(
+                    'Conflict. The container name "/{}" is already in use.',
+                    name))
+            image = self.state.find_image(body.get('Image', ''))
+            if image is None:
+                return self.send_error_json(404, str.format(
+                    'No such image: {}', body.get('Image')))
+
+            host_config = body.get('HostConfig') or {}
+            networks = {}
+            endpoints = (body.get('NetworkingConfig') or {}).get(
+                'EndpointsConfig') or {}
+            for network_name, endpoint in endpoints.items():
+                network = self.state.find_network(network_name)
+                if network is None:
+                    return self.send_error_json(404, str.format(
+                        'network {} not found', network_name))
+                ipam = (endpoint or {}).get('IPAMConfig') or {}
+                networks[network['Name']] = {
+                    'NetworkID': network['Id'],
+                    'IPAddress': ipam.get('IPv4Address', ''),
+                    'Aliases': (endpoint or {}).get('Aliases'),
+                }
+
+            ports = {}
+            for port in (body.get('ExposedPorts') or {}):
+                ports[port] = None
+            for port, bindings in (host_config.get('PortBindings') or
+                                   {}).items():
+                ports[port] = bindings
+
+            container_id = _new_id('container', name)
+            self.state.containers[container_id] = {
+                'Id': container_id,
+                'Name': name,
+                'Created': _now(),
+                'Image': image['Id'],
+                'Config': {
+                    'Image': body.get('Image'),
+                    'Env': body.get('Env') or [],
+                    'Labels': body.get('Labels') or {},
+                    'Cmd': body.get('Cmd'),
+                    'Tty': bool(body.get('Tty')),
+                },
+                'HostConfig': host_config,
+                'State': {
+                    'Status': 'created', 'Running': False,
+                    'StartedAt': '0001-01-01T00:00:00Z', 'ExitCode': 0,
+                    'OOMKilled': False,
+                },
+                'NetworkSettings': {'Networks': networks, 'Ports': ports},
+                'Mounts': [],
+            }
+            self.state.names[name] = container_id
+            for network in networks.values():
+                self.state.networks[network['NetworkID']]['Containers'][
+                    container_id] = {'Name': name}
+        self.state.emit('container', 'create', container_id, dict(
+            body.get('Labels') or {}, name=name))
+        self.send_json({'Id': container_id, 'Warnings': []}, status=201)
+
+    def inspect_container(self, ref):
+        self.state.sleep('inspect')
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(
+                404, str.format('No such container: {}', ref))
+        self.send_json(container)
+
+    def start_container(self, ref):
+        self._read_body()
+        self.state.sleep('start')
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        with self.state.lock:
+            if container['State']['Running']:
+                return self.send_empty(304)
+            container['State'].update(
+                Status='running', Running=True, StartedAt=_now())
+            self.state.logs[container['Id']].append(str.format(
+                '{} started\n', container['Name']))
+        self.state.emit('container', 'start', container['Id'], dict(
+            container['Config']['Labels'], name=container['Name']))
+        self.send_empty()
+
+    def stop_container(self, ref):
+        self._read_body()
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        if container['State']['Running']:
+            self.state.sleep('stop')
+        with self.state.lock:
+            was_running = container['State']['Running']
+            container['State'].update(Status='exited', Running=False)
+        if was_running:
+            self.state.emit('container', 'die', container['Id'], dict(
+                container['Config']['Labels'], name=container['Name'],
+                exitCode='0'))
+        self.send_empty()
+
+    def remove_container(self, ref):
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        force = self.query.get('force') in ('1', 'true', 'True')
+        with self.state.lock:
+            if container['State']['Running'] and not force:
+                return self.send_error_json(
+                    409, 'You cannot remove a running container')
+            del self.state.containers[container['Id']]
+            del self.state.names[container['Name']]
+            for network in self.state.networks.values():
+                network['Containers'].pop(container['Id'], None)
+        self.state.emit('container', 'destroy', container['Id'], dict(
+            container['Config']['Labels'], name=container['Name']))
+        self.send_empty()
+
+    def put_archive(self, ref):
+        self._read_body()
+        if self.state.find_container(ref) is None:
+            return self.send_error_json(404, 'No such container')
+        self.send_empty(200)
+
+    def logs(self, ref):
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        self.start_chunked()
+        for line in self.state.logs[container['Id']]:
+            line = line.encode()
+            self.write_chunk(struct.pack('>BxxxL', 1, len(line)) + line)
+        self.end_chunked()
+
+    def stats(self, ref):
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        sample = {
+            'read': _now(),
+            'cpu_stats': {
+                'cpu_usage': {'total_usage': 2000000},
+                'system_cpu_usage': 100000000, 'online_cpus': 2},
+            'precpu_stats': {
+                'cpu_usage': {'total_usage': 1000000},
+                'system_cpu_usage': 90000000},
+            'memory_stats': {'usage': 64 * 1048576, 'limit': 1024 * 1048576},
+            'networks': {'eth0': {'rx_bytes': 1024, 'tx_bytes': 2048}},
+            'blkio_stats': {'io_service_bytes_recursive': []},
+        }
+        if self.query.get('stream') in ('0', 'false', 'False'):
+            return self.send_json(sample)
+        self.start_chunked()
+        try:
+            while not self.server.stopping:
+                self.write_chunk(sample)
+                time.sleep(1)
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+    # --- exec
+
+    def exec_create(self, ref):
+        body = self._json_body()
+        container = self.state.find_container(ref)
+        if container is None:
+            return self.send_error_json(404, 'No such container')
+        if not container['State']['Running']:
+            return self.send_error_json(409, str.format(
+                'Container {} is not running', ref))
+        exec_id = _new_id('exec')
+        with self.state.lock:
+            self.state.execs[exec_id] = {
+                'ID': exec_id,
+                'ContainerID': container['Id'],
+                'Cmd': body.get('Cmd'),
+                'AttachStdout': body.get('AttachStdout', True),
+                'AttachStderr': body.get('AttachStderr', True),
+                'Running': False,
+                'ExitCode': None,
+            }
+        self.send_json({'Id': exec_id}, status=201)
+
+    def exec_start(self, exec_id):
+        body = self._json_body()
+        exec_data = self.state.execs.get(exec_id)
+        if exec_data is None:
+            return self.send_error_json(404, 'No such exec instance')
+        rule = self.state.exec_rule(exec_data['Cmd'])
+        exec_data['Running'] = True
+
+        def run():
+            duration = rule.duration
+            if duration is None:
+                self.state.sleep('exec')
+            elif duration:
+                time.sleep(duration)
+            exec_data['Running'] = False
+            exec_data['ExitCode'] = rule.exit_code
+
+        if body.get('Detach'):
+            threading.Thread(target=run, daemon=True).start()
+            return self.send_empty(200)
+
+        self.send_response(101)
+        self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Upgrade', 'tcp')
+        self.end_headers()
+        self.wfile.flush()
+        # give the client time to parse headers before the raw stream
+        time.sleep(0.002)
+
+        run()
+        output = rule.output.encode() if isinstance(
+            rule.output, str) else rule.output
+        if output and exec_data['AttachStdout']:
+            for line in output.splitlines(True):
+                self.wfile.write(struct.pack('>BxxxL', 1, len(line)) + line)
+        self.wfile.flush()
+        self.close_connection = True
+
+    def exec_inspect(self, exec_id):
+        exec_data = self.state.execs.get(exec_id)
+        if exec_data is None:
+            return self.send_error_json(404, 'No such exec instance')
+        self.send_json(exec_data)
+
+
+def _matches_filters(item, filters):
+    """ Supports 'label', 'name', 'id', 'type' and 'event' filters """
+    for key, values in (filters or {}).items():
+        if isinstance(values, dict):
+            values = [k for k, v in values.items() if v]
+        labels = item.get('Labels') or (
+            item.get('Actor') or {}).get('Attributes') or {}
+        if key == 'label':
+            for value in values:
+                name, _, expected = value.partition('=')
+                if name not in labels or (
+                        expected and labels[name] != expected):
+                    return False
+        elif key == 'name':
+            names = [n.lstrip('/') for n in item.get('Names') or []] + [
+                item.get('Name') or labels.get('name', '')]
+            if not any(re.search(v, n) for v in values for n in names):
+                return False
+        elif key == 'id':
+            item_id = item.get('Id') or item.get('id') or ''
+            if not any(item_id.startswith(v) for v in values):
+                return False
+        elif key == 'type':
+            if item.get('Type') not in values:
+                return False
+        elif key == 'event':
+            if item.get('Action') not in values:
+                return False
+    return True
+
+
+_ROUTES = [
+    ('GET', r'/version', 'version', 'version'),
+    ('GET', r'/_ping', 'ping', 'ping'),
+    ('HEAD', r'/_ping', 'ping', 'ping'),
+    ('GET', r'/system/df', 'df', 'system_df'),
+    ('GET', r'/events', 'events', 'events'),
+    ('GET', r'/images/json', 'list_images', 'list_images'),
+    ('POST', r'/images/create', 'pull', 'pull'),
+    ('GET', r'/images/(.+)/json', 'inspect_image', 'inspect_image'),
+    ('DELETE', r'/images/(.+)', 'remove_image', 'remove_image'),
+    ('GET', r'/distribution/(.+)/json', 'distribution', 'distribution'),
+    ('POST', r'/build', 'build', 'build'),
+    ('POST', r'/commit', 'commit', 'commit'),
+    ('GET', r'/networks', 'list_networks', 'list_networks'),
+    ('POST', r'/networks/create', 'create_network', 'create_network'),
+    ('GET', r'/networks/([^/]+)', 'inspect_network', 'inspect_network'),
+    ('DELETE', r'/networks/([^/]+)', 'remove_network', 'remove_network'),
+    ('GET', r'/volumes', 'list_volumes', 'list_volumes'),
+    ('POST', r'/volumes/create', 'create_volume', 'create_volume'),
+    ('DELETE', r'/volumes/([^/]+)', 'remove_volume', 'remove_volume'),
+    ('GET', r'/containers/json', 'list_containers', 'list_containers'),
+    ('POST', r'/containers/create', 'create_container', 'create_container'),
+    ('GET', r'/containers/([^/]+)/json', 'inspect_container',
+     'inspect_container'),
+    ('POST', r'/containers/([^/]+)/start', 'start_container',
+     'start_container'),
+    ('POST', r'/containers/([^/]+)/stop', 'stop_container',
+     'stop_container'),
+    ('DELETE', r'/containers/([^/]+)', 'remove_container',
+     'remove_container'),
+    ('PUT', r'/containers/([^/]+)/archive', 'put_archive', 'put_archive'),
+    ('GET', r'/containers/([^/]+)/logs', 'logs', 'logs'),
+    ('GET', r'/containers/([^/]+)/stats', 'stats', 'stats'),
+    ('POST', r'/containers/([^/]+)/exec', 'exec_create', 'exec_create'),
+    ('POST', r'/exec/([^/]+)/start', 'exec_start', 'exec_start'),
+    ('GET', r'/exec/([^/]+)/json', 'exec_inspect', 'exec_inspect'),
+]
+Handler.routes = _ROUTES
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+    stopping = False
+
+
+class FakeDockerEngine(object):
+    """
+    Runs the fake engine in a background thread:
+
+        with FakeDockerEngine('/tmp/fake.sock', latencies={'exec': 0.1}):
+            os.environ['DOCKER_HOST'] = 'unix:///tmp/fake.sock'
+            ...
+    """
+
+    def __init__(self, socket_path, latencies=None, exec_rules=None,
+                 images=()):
+        self.socket_path = socket_path
+        self.state = EngineState(latencies, exec_rules, images)
+        self._server = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return 'unix://' + self.socket_path
+
+    @property
+    def calls(self):
+        return self.state.calls
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = _Server(self.socket_path, Handler)
+        self._server.state = self.state
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stopping = True
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
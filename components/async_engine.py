@@ -0,0 +1,364 @@
+import asyncio
+import codecs
+import json
+import os
+import struct
+import threading
+from urllib.parse import quote, urlencode
+from config import DOCKER_ENGINE
+
+DEFAULT_SOCKET = 'unix:///var/run/docker.sock'
+STREAM_HEADER_SIZE = 8
+STREAM_NAMES = {0: 'stdin', 1: 'stdout', 2: 'stderr'}
+
+
+class EngineAPIError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        super().__init__(str.format('{}: {}', status, message))
+
+
+class NotFound(EngineAPIError):
+    pass
+
+
+def socket_path():
+    """ Path of the Engine unix socket, None for tcp:// and ssh:// hosts """
+    host = os.environ.get('DOCKER_HOST') or DEFAULT_SOCKET
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return None
+
+
+class _Response(object):
+    def __init__(self, status, headers, reader, writer):
+        self.status = status
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+
+    async def iter_body(self):
+        """ Body chunks, transfer encoding removed """
+        if self.headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size_line = await self.reader.readline()
+                size = int(size_line.split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    await self.reader.readline()
+                    return
+                yield await self.reader.readexactly(size)
+                await self.reader.readexactly(2)
+        elif 'content-length' in self.headers:
+            length = int(self.headers['content-length'])
+            if length:
+                yield await self.reader.readexactly(length)
+        else:
+            # raw stream of a hijacked connection lasts until EOF
+            while True:
+                chunk = await self.reader.read(65536)
+                if not chunk:
+                    return
+                yield chunk
+
+    async def read(self):
+        return b''.join([chunk async for chunk in self.iter_body()])
+
+    async def json(self):
+        body = await self.read()
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def close(self):
+        self.writer.close()
+
+
+async def demultiplex(chunks, tty=False):
+    """
+    Splits multiplexed exec/logs output into (stream, bytes) frames.
+    Output of TTY sessions is not multiplexed and goes to stdout.
+    """
+    if tty:
+        async for chunk in chunks:
+            yield 'stdout', chunk
+        return
+
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= STREAM_HEADER_SIZE:
+            stream, length = struct.unpack(
+                '>BxxxL', bytes(buffer[:STREAM_HEADER_SIZE]))
+            if len(buffer) < STREAM_HEADER_SIZE + length:
+                break
+            end = STREAM_HEADER_SIZE + length
+            data = bytes(buffer[STREAM_HEADER_SIZE:end])
+            del buffer[:end]
+            if data:
+                yield STREAM_NAMES.get(stream, 'stdout'), data
+
+
+async def iter_json_lines(chunks):
+    """ Objects of a stream of newline delimited JSON """
+    buffer = b''
+    async for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b'\n')
+        for line in lines:
+            if line.strip():
+                yield json.loads(line.decode('utf-8'))
+    if buffer.strip():
+        yield json.loads(buffer.decode('utf-8'))
+
+
+class AsyncDockerEngine(object):
+    """
+    Minimal asyncio client of the Docker Engine API over the unix socket.
+    Every request uses its own connection, so any number of exec and logs
+    streams can be read concurrently by one event loop.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or socket_path()
+        self._api_version = None
+
+    async def _open(self, method, path, params=None, body=None,
+                    versioned=True, upgrade=False):
+        if versioned:
+            if self._api_version is None:
+                version = await self.version()
+                self._api_version = version['ApiVersion']
+            path = str.format('/v{}{}', self._api_version, path)
+        if params:
+            path += '?' + urlencode({
+                k: v for k, v in params.items() if v is not None})
+
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        headers = [
+            str.format('{} {} HTTP/1.1', method, path),
+            'Host: docker',
+            'User-Agent: docker-components-async',
+            str.format('Content-Length: {}', len(data)),
+        ]
+        if body is not None:
+            headers.append('Content-Type: application/json')
+        if upgrade:
+            headers += ['Connection: Upgrade', 'Upgrade: tcp']
+        else:
+            headers.append('Connection: close')
+
+        reader, writer = await asyncio.open_unix_connection(self.path)
+        writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + data)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            writer.close()
+            raise EngineAPIError(0, 'connection closed by the engine')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        response = _Response(status, response_headers, reader, writer)
+        if status >= 400:
+            try:
+                error = await response.json() or {}
+            except ValueError:
+                error = {}
+            finally:
+                response.close()
+            error_class = NotFound if status == 404 else EngineAPIError
+            raise error_class(status, error.get('message', 'unknown error'))
+        return response
+
+    async def _call(self, method, path, params=None, body=None, **kwargs):
+        response = await self._open(method, path, params, body, **kwargs)
+        try:
+            return await response.json()
+        finally:
+            response.close()
+
+    async def version(self):
+        return await self._call('GET', '/version', versioned=False)
+
+    async def containers(self, all=False, filters=None):
+        """ 'filters' as in the Engine API, e.g. {'label': ['a=b']} """
+        return await self._call('GET', '/containers/json', params={
+            'all': int(all),
+            'filters': json.dumps(filters) if filters else None
+        })
+
+    async def create_container(self, name, config):
+        """ 'config' is the Engine API body, e.g. {'Image': ..., 'Cmd': []} """
+        return await self._call(
+            'POST', '/containers/create', params={'name': name}, body=config)
+
+    async def start(self, container):
+        await self._call(
+            'POST', str.format('/containers/{}/start', quote(container)))
+
+    async def inspect_container(self, container):
+        return await self._call(
+            'GET', str.format('/containers/{}/json', quote(container)))
+
+    async def exec_create(self, container, cmd, tty=False, environment=None,
+                          workdir=None):
+        body = {
+            'Cmd': cmd,
+            'AttachStdin': False,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Tty': tty,
+        }
+        if environment:
+            body['Env'] = [
+                str.format('{}={}', k, v) for k, v in environment.items()]
+        if workdir:
+            body['WorkingDir'] = workdir
+        result = await self._call(
+            'POST', str.format('/containers/{}/exec', quote(container)),
+            body=body)
+        return result['Id']
+
+    async def exec_start(self, exec_id, tty=False):
+        """ Yields (stream, bytes) of the exec output """
+        response = await self._open(
+            'POST', str.format('/exec/{}/start', exec_id),
+            body={'Detach': False, 'Tty': tty}, upgrade=True)
+        try:
+            async for frame in demultiplex(response.iter_body(), tty=tty):
+                yield frame
+        finally:
+            response.close()
+
+    async def exec_start_detached(self, exec_id):
+        await self._call(
+            'POST', str.format('/exec/{}/start', exec_id),
+            body={'Detach': True, 'Tty': False})
+
+    async def exec_inspect(self, exec_id):
+        return await self._call('GET', str.format('/exec/{}/json', exec_id))
+
+    async def exec_run(self, container, cmd, on_output=None, tty=False):
+        """
+        Runs the command, passes its decoded output to on_output(stream,
+        text) as it arrives and returns the exit code.
+        """
+        exec_id = await self.exec_create(container, cmd, tty=tty)
+        decoders = {}
+        async for stream, data in self.exec_start(exec_id, tty=tty):
+            if stream not in decoders:
+                decoders[stream] = codecs.getincrementaldecoder('utf-8')(
+                    errors='replace')
+            text = decoders[stream].decode(data)
+            if text and on_output is not None:
+                on_output(stream, text)
+        for stream, decoder in decoders.items():
+            text = decoder.decode(b'', final=True)
+            if text and on_output is not None:
+                on_output(stream, text)
+        return (await self.exec_inspect(exec_id))['ExitCode']
+
+    async def stats(self, container, stream=True):
+        """ Yields resource usage samples, one a second while streaming """
+        response = await self._open(
+            'GET', str.format('/containers/{}/stats', quote(container)),
+            params={'stream': int(stream)})
+        try:
+            async for item in iter_json_lines(response.iter_body()):
+                yield item
+        finally:
+            response.close()
+
+    async def events(self, filters=None, since=None):
+        """
+        Yields events of the Engine as they happen, the ones since the
+        'since' timestamp first
+        """
+        response = await self._open('GET', '/events', params={
+            'filters': json.dumps(filters) if filters else None,
+            'since': since
+        })
+        try:
+            async for item in iter_json_lines(response.iter_body()):
+                yield item
+        finally:
+            response.close()
+
+    async def logs(self, container, follow=False, tail='all', since=None,
+                   tty=False):
+        """ Yields (stream, bytes) of the container output """
+        response = await self._open(
+            'GET', str.format('/containers/{}/logs', quote(container)),
+            params={
+                'stdout': 1, 'stderr': 1, 'follow': int(follow),
+                'tail': tail, 'since': since
+            })
+        try:
+            async for frame in demultiplex(response.iter_body(), tty=tty):
+                yield frame
+        finally:
+            response.close()
+
+
+class EngineLoop(object):
+    """
+    Event loop running in a background thread. Deployment threads submit
+    coroutines to it and wait for their results, while all exec streams
+    are read by the single loop thread.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name='docker-engine-loop',
+            daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(
+            coroutine, self.loop).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+_engine = None
+_engine_loop = None
+_lock = threading.Lock()
+
+
+def enabled():
+    """
+    Exec streams go through the async engine when it's enabled in config
+    and the Engine is reachable by a unix socket.
+    """
+    path = socket_path()
+    return bool(DOCKER_ENGINE.get('ASYNC_EXEC')) and path is not None and \
+        os.path.exists(path)
+
+
+def engine():
+    global _engine
+    with _lock:
+        if _engine is None or _engine.path != socket_path():
+            _engine = AsyncDockerEngine()
+        return _engine
+
+
+def submit(coroutine):
+    """ Schedules the coroutine in the background loop, returns a future """
+    global _engine_loop
+    with _lock:
+        if _engine_loop is None:
+            _engine_loop = EngineLoop()
+    return asyncio.run_coroutine_threadsafe(coroutine, _engine_loop.loop)
+
+
+def run(coroutine, timeout=None):
+    """ Runs the coroutine in the background loop and returns its result """
+    return submit(coroutine).result(timeout)
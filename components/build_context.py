@@ -0,0 +1,133 @@
+import hashlib
+import io
+import json
+import os
+import stat
+import tarfile
+import threading
+from config import DEPLOYER_STATE_DIR
+
+# name of the Dockerfile injected into the context
+DOCKERFILE_NAME = '.deployer.Dockerfile'
+CHUNK_SIZE = 64 * 1024
+# never a part of the context: git data and generated dependencies
+ALWAYS_EXCLUDED = (
+    '.git', '**/node_modules', '**/bower_components', '**/__pycache__',
+    '**/*.egg-info'
+)
+
+
+def context_files(context_dir, exclude=()):
+    """
+    Sorted relative paths of the context respecting .dockerignore, without
+    ALWAYS_EXCLUDED and 'exclude' patterns
+    """
+    patterns = []
+    dockerignore = os.path.join(context_dir, '.dockerignore')
+    if os.path.exists(dockerignore):
+        with open(dockerignore, mode='r') as f:
+            patterns = [
+                line.strip() for line in f.read().splitlines()
+                if line.strip() and not line.strip().startswith('#')
+            ]
+    # the last matching pattern wins, so these can't be re-included
+    patterns += list(ALWAYS_EXCLUDED) + list(exclude) + [DOCKERFILE_NAME]
+
+    from docker.utils import exclude_paths
+    return sorted(exclude_paths(context_dir, patterns))
+
+
+def _file_hash(path):
+    file_hash = hashlib.sha256()
+    with open(path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class ContextDigestCache(object):
+    """
+    Digest of a build context. Hashes of files are cached by size and
+    mtime, so only changed files are read again.
+    """
+
+    def __init__(self, name):
+        self.path = os.path.join(
+            DEPLOYER_STATE_DIR, 'build_contexts',
+            str.format('{}.json', name))
+        try:
+            with open(self.path, mode='r') as f:
+                self.index = json.load(f)
+        except (IOError, ValueError):
+            self.index = {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, mode='w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.path)
+
+    def _entry_hash(self, context_dir, rel_path):
+        full_path = os.path.join(context_dir, rel_path)
+        st = os.lstat(full_path)
+        if stat.S_ISLNK(st.st_mode):
+            return str.format('link:{}', os.readlink(full_path))
+        if stat.S_ISDIR(st.st_mode):
+            return 'dir'
+
+        cached = self.index.get(rel_path)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        file_hash = _file_hash(full_path)
+        self.index[rel_path] = [st.st_size, st.st_mtime_ns, file_hash]
+        return file_hash
+
+    def digest(self, context_dir, files):
+        digest = hashlib.sha256()
+        for rel_path in files:
+            st = os.lstat(os.path.join(context_dir, rel_path))
+            digest.update(str.format(
+                '{}\0{:o}\0{}\n', rel_path, stat.S_IMODE(st.st_mode),
+                self._entry_hash(context_dir, rel_path)).encode('utf-8'))
+
+        known = set(files)
+        self.index = {k: v for k, v in self.index.items() if k in known}
+        self._save()
+        return digest.hexdigest()
+
+
+def stream_context(context_dir, files, dockerfile_content):
+    """
+    Yields the build context as tar chunks. The archive is written by a
+    thread into a pipe, so the context is never held in memory.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def write_archive():
+        try:
+            with os.fdopen(write_fd, mode='wb') as pipe:
+                with tarfile.open(fileobj=pipe, mode='w|') as tar:
+                    for rel_path in files:
+                        tar.add(
+                            os.path.join(context_dir, rel_path),
+                            arcname=rel_path, recursive=False)
+
+                    dockerfile = dockerfile_content.encode('utf-8')
+                    info = tarfile.TarInfo(DOCKERFILE_NAME)
+                    info.size = len(dockerfile)
+                    tar.addfile(info, io.BytesIO(dockerfile))
+        except Exception as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=write_archive, daemon=True)
+    writer.start()
+
+    with os.fdopen(read_fd, mode='rb') as pipe:
+        for chunk in iter(lambda: pipe.read(CHUNK_SIZE), b''):
+            yield chunk
+
+    writer.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,83 @@
+from components.labels import owner_labels
+from helpers.color_print import ColorPrint
+from config import PACKAGE_CACHES
+
+cprint = ColorPrint()
+
+# mount point inside containers and environment which points the package
+# manager to it
+CACHE_KINDS = {
+    'pip': ('/var/cache/deployer/pip', 'PIP_CACHE_DIR'),
+    'npm': ('/var/cache/deployer/npm', 'npm_config_cache'),
+    'bower': ('/var/cache/deployer/bower', 'bower_storage__packages'),
+}
+
+
+def volume_name(kind):
+    return PACKAGE_CACHES['VOLUMES'][kind]
+
+
+def ensure_cache_volumes(client):
+    """ Creates missing cache volumes with deployer labels """
+    existing = {
+        v['Name'] for v in client.api.volumes().get('Volumes') or []}
+    for kind in CACHE_KINDS:
+        if volume_name(kind) not in existing:
+            client.api.create_volume(
+                volume_name(kind), labels=owner_labels(cache=kind))
+
+
+def cache_binds(kinds):
+    return {
+        volume_name(kind): {'bind': CACHE_KINDS[kind][0], 'mode': 'rw'}
+        for kind in kinds
+    }
+
+
+def cache_environment(kinds):
+    return {CACHE_KINDS[kind][1]: CACHE_KINDS[kind][0] for kind in kinds}
+
+
+def cache_volume_sizes(client):
+    """ Sizes of cache volumes in bytes, -1 if Docker doesn't know it """
+    names = {volume_name(kind): kind for kind in CACHE_KINDS}
+    sizes = {}
+    for volume in client.api.df().get('Volumes') or []:
+        if volume['Name'] in names:
+            usage = volume.get('UsageData') or {}
+            sizes[volume['Name']] = (
+                usage.get('Size', -1), usage.get('RefCount', 0))
+    return sizes
+
+
+def prune_cache_volumes(client, max_size_mb=None):
+    """
+    Removes the biggest unused cache volumes until their total size fits
+    into 'max_size_mb'. Volumes mounted into containers are kept.
+    """
+    if max_size_mb is None:
+        max_size_mb = PACKAGE_CACHES['MAX_SIZE_MB']
+
+    sizes = cache_volume_sizes(client)
+    total = sum(max(size, 0) for size, _ in sizes.values())
+    for name, (size, ref_count) in sorted(sizes.items()):
+        cprint.blue(str.format(
+            '{}: {:.1f} MB, used by {} container(s)',
+            name, max(size, 0) / 1048576.0, ref_count))
+
+    limit = max_size_mb * 1048576
+    for name, (size, ref_count) in sorted(
+            sizes.items(), key=lambda item: item[1][0], reverse=True):
+        if total <= limit:
+            break
+        if ref_count:
+            cprint.orange(str.format(
+                "'{}' is in use and can't be evicted.", name))
+            continue
+        client.api.remove_volume(name)
+        total -= max(size, 0)
+        cprint.orange(str.format("'{}' evicted.", name))
+
+    cprint.green(str.format(
+        'Package caches: {:.1f} MB of {} MB allowed.',
+        total / 1048576.0, max_size_mb))
@@ -0,0 +1,242 @@
+"""
+Change-aware redeployment. Commits of GIT_REPOSITORIES deployed to every
+component are recorded in the state directory. On the next run the diff
+between the recorded commit and the checkout is mapped to the steps of the
+component pipeline by their inputs, and a running container which is
+otherwise up to date gets only those steps instead of the full deployment.
+"""
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import threading
+from helpers.docker_client import LazyDockerClient
+from components.steps import generated_key
+from helpers.git_operations import (
+    changed_paths, head_commit, intact_generated, stale_generated
+)
+from config import CONTAINERS, DEPLOYER_STATE_DIR, DOCKER_NETWORK, \
+    GIT_REPOSITORIES
+
+client = LazyDockerClient()
+
+# component is deployed in full: image, container, setup and all steps
+FULL = 'full'
+# only affected steps are run in the running container
+CHANGED = 'changed'
+# nothing changed since the last deployment
+UNCHANGED = 'unchanged'
+
+DOCKER_FILES_DIR = 'docker_files'
+
+
+def _inspect_container(container_name):
+    from docker.errors import NotFound
+    try:
+        return client.api.inspect_container(container_name)
+    except NotFound:
+        return None
+
+
+def _running_id(container_name):
+    inspect = _inspect_container(container_name)
+    if inspect is None or not inspect['State']['Running']:
+        return None
+    return inspect['Id']
+
+
+def fingerprint(component):
+    """
+    Hash of the deployer side of the component: its settings, the network,
+    Dockerfiles and the module the component is defined in
+    """
+    key = hashlib.sha256(json.dumps(
+        [CONTAINERS[component.config_key], DOCKER_NETWORK],
+        sort_keys=True, default=str).encode('utf-8'))
+
+    paths = [sys.modules[type(component).__module__].__file__]
+    if os.path.isdir(DOCKER_FILES_DIR):
+        paths += [
+            os.path.join(DOCKER_FILES_DIR, name)
+            for name in sorted(os.listdir(DOCKER_FILES_DIR))
+        ]
+    for path in paths:
+        if os.path.isfile(path):
+            key.update(path.encode('utf-8'))
+            with open(path, mode='rb') as f:
+                key.update(f.read())
+    return key.hexdigest()
+
+
+class DeployedState(object):
+    """ Last successful deployment of every component """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(DEPLOYER_STATE_DIR, 'deployed.json')
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, mode='r') as f:
+                self.components = json.load(f)
+        except (IOError, ValueError):
+            self.components = {}
+
+    def get(self, config_key):
+        return self.components.get(config_key)
+
+    def record(self, component, commit):
+        dependencies = {
+            key: _running_id(CONTAINERS[key]['CONTAINER_NAME'])
+            for key in component.depends_on
+        }
+        with self._lock:
+            self.components[component.config_key] = {
+                'commit': commit,
+                'fingerprint': fingerprint(component),
+                'container_id': _running_id(component.container_name),
+                'dependencies': dependencies
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, mode='w') as f:
+                json.dump(self.components, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+class ChangePlan(object):
+    """ What is done with the component: 'mode' and why """
+
+    def __init__(self, component, state, mode, reason, commit=None,
+                 paths=(), steps=()):
+        self.component = component
+        self.state = state
+        self.mode = mode
+        self.reason = reason
+        self.commit = commit
+        self.paths = list(paths)
+        self.steps = list(steps)
+
+    @property
+    def full(self):
+        return self.mode == FULL
+
+    def record(self):
+        """ Called after the component is deployed by this plan """
+        self.state.record(self.component, self.commit)
+
+    def describe(self):
+        if self.mode != CHANGED:
+            return str.format('{} ({})', self.mode, self.reason)
+        if not self.paths:
+            return str.format(
+                '{}, steps: {}', self.reason, ', '.join(self.steps))
+        return str.format(
+            '{} file(s) changed, steps: {}', len(self.paths),
+            ', '.join(self.steps) or 'none')
+
+
+def _matching(paths, patterns):
+    return [
+        path for path in paths
+        if any(fnmatch.fnmatch(path, pattern) for pattern in patterns)
+    ]
+
+
+def _rewrites(component, pipeline, local_dir):
+    """
+    Steps which modify the checkout and whose files don't have the content
+    they left, e.g. after the synchronization reset them
+    """
+    if pipeline is None:
+        return []
+    return [
+        step.name for step in pipeline
+        if step.modifies_checkout and stale_generated(
+            local_dir, generated_key(component.config_key, step.name))
+    ]
+
+
+def _plan_component(component, state, plans, commits, force):
+    commit = None
+    if component.repository:
+        if component.repository not in commits:
+            commits[component.repository] = head_commit(
+                GIT_REPOSITORIES[component.repository]['local_dir'])
+        commit = commits[component.repository]
+
+    def plan(mode, reason, paths=(), steps=()):
+        return ChangePlan(
+            component, state, mode, reason, commit, paths, steps)
+
+    if force:
+        return plan(FULL, 'forced by options')
+    if component.repository and commit is None:
+        return plan(FULL, 'repository is not cloned')
+    deployed = state.get(component.config_key)
+    if deployed is None:
+        return plan(FULL, 'no record of a previous deployment')
+    if deployed['fingerprint'] != fingerprint(component):
+        return plan(FULL, 'settings or Dockerfiles changed')
+    if deployed['container_id'] is None or \
+            deployed['container_id'] != _running_id(component.container_name):
+        return plan(FULL, 'container is missing, stopped or recreated')
+    for key in component.depends_on:
+        if key in plans and plans[key].full:
+            return plan(FULL, str.format('{} is redeployed', key.lower()))
+        if deployed['dependencies'].get(key) != _running_id(
+                CONTAINERS[key]['CONTAINER_NAME']):
+            return plan(FULL, str.format('{} was recreated', key.lower()))
+
+    if commit is None:
+        return plan(UNCHANGED, 'no repository')
+    if deployed['commit'] is None:
+        return plan(FULL, 'deployed commit is unknown')
+    local_dir = GIT_REPOSITORIES[component.repository]['local_dir']
+    paths = changed_paths(local_dir, deployed['commit'])
+    if paths is None:
+        return plan(FULL, str.format(
+            'deployed commit {} is not found', deployed['commit'][:10]))
+    # files the deployer wrote itself are not changes of the repository
+    intact = intact_generated(local_dir)
+    paths = [path for path in paths if path not in intact]
+
+    pipeline = component.pipeline()
+    rewrites = _rewrites(component, pipeline, local_dir)
+    if not paths:
+        if rewrites:
+            return plan(
+                CHANGED, 'files written by the deployer were reset',
+                steps=rewrites)
+        return plan(UNCHANGED, 'repository is not changed')
+    if component.build_context_dir():
+        return plan(FULL, 'build context changed')
+    manifests = _matching(paths, component.setup_manifests)
+    if manifests:
+        return plan(FULL, str.format(
+            'setup manifests changed: {}', ', '.join(manifests)))
+
+    steps = pipeline.affected(paths) if pipeline is not None else []
+    steps += [name for name in rewrites if name not in steps]
+    return plan(CHANGED, 'repository changed', paths, steps)
+
+
+def plan_changes(components, force=False, state=None):
+    """
+    Change plans of the components by config key. Dependencies are planned
+    first: a component is deployed in full when any of its dependencies is.
+    """
+    state = state or DeployedState()
+    by_key = {c.config_key: c for c in components}
+    plans, commits = {}, {}
+
+    def plan(component):
+        if component.config_key not in plans:
+            for key in component.depends_on:
+                if key in by_key:
+                    plan(by_key[key])
+            plans[component.config_key] = _plan_component(
+                component, state, plans, commits, force)
+
+    for c in components:
+        plan(c)
+    return plans
@@ -0,0 +1,409 @@
+"""
+Command line interface of the deployer. Commands import modules they need
+on their own: settings of a stack must be applied before components are
+imported, and 'status', 'logs' and 'exec' talk to the Engine without
+loading docker-py, MySQLdb or git.
+"""
+import argparse
+import os
+import sys
+import time
+from components import labels
+from helpers.color_print import ColorPrint
+from config import CHANGE_PLANNER, CONTAINERS, LOGS
+
+cprint = ColorPrint()
+
+# arguments of the previous interface (flags only) are the ones of 'up'
+DEFAULT_COMMAND = 'up'
+
+
+class CommandError(Exception):
+    pass
+
+
+def _engine_unreachable(error):
+    """
+    The Docker daemon can't be reached, e.g. it's not started or
+    DOCKER_HOST is wrong. docker-py and requests are only checked if a
+    command has imported them.
+    """
+    if isinstance(error, ConnectionError):
+        return True
+    docker_errors = sys.modules.get('docker.errors')
+    if docker_errors is not None and isinstance(
+            error, docker_errors.DockerException) and not isinstance(
+            error, docker_errors.APIError):
+        return True
+    requests_exceptions = sys.modules.get('requests.exceptions')
+    return requests_exceptions is not None and isinstance(
+        error, requests_exceptions.ConnectionError)
+
+
+def resolve_components(names):
+    """
+    Config keys of the components given by config key (any case, '-' may
+    be used for '_') or by container name
+    """
+    aliases = {}
+    for key, settings in CONTAINERS.items():
+        aliases[key.lower()] = key
+        aliases[key.lower().replace('_', '-')] = key
+        aliases[settings['CONTAINER_NAME'].lower()] = key
+
+    keys = []
+    for name in names:
+        key = aliases.get(name.lower())
+        if key is None:
+            raise CommandError(str.format(
+                "Unknown component '{}', choose from: {}", name,
+                ', '.join(sorted(k.lower() for k in CONTAINERS))))
+        if key not in keys:
+            keys.append(key)
+    return keys
+
+
+def _find_container(args):
+    """ Primary container of the component or its replica """
+    from components import status
+    key = resolve_components([args.component])[0]
+    containers = status.list_containers(
+        args.stack or labels.DEFAULT_STACK, component=key)
+
+    prefix = labels.LABEL_PREFIX
+    for c in containers:
+        container_labels = c.get('Labels') or {}
+        if str.format('{}.load_balancer_of', prefix) in container_labels:
+            continue
+        replica = container_labels.get(str.format('{}.replica', prefix))
+        if replica == (None if args.replica is None else str(args.replica)):
+            return status.container_name(c)
+
+    raise CommandError(str.format(
+        "Container of '{}'{} is not found in stack '{}'.",
+        args.component,
+        '' if args.replica is None else str.format(
+            ' replica {}', args.replica),
+        args.stack or labels.DEFAULT_STACK))
+
+
+def cmd_up(args):
+    if args.stack:
+        # settings of the stack are applied before components are imported
+        from components.stacks import activate_stack
+        activate_stack(args.stack)
+
+    if args.fast_mysql:
+        CONTAINERS['MYSQL']['FAST_MODE']['ENABLED'] = True
+
+    from components.deploy_operations import run_deployment
+    run_deployment(
+        check_remote=args.check_remote,
+        rebuild=args.rebuild,
+        refresh_base=args.refresh_base,
+        recreate=args.recreate,
+        only=resolve_components(args.components) or None,
+        with_dependencies=not args.no_deps
+    )
+
+
+def cmd_down(args):
+    from components.teardown import teardown
+    teardown(
+        args.stack or labels.DEFAULT_STACK,
+        config_keys=resolve_components(args.components) or None,
+        grace=args.timeout, images=args.images)
+
+
+def cmd_prune_images(args):
+    from components.teardown import prune_images
+    prune_images(args.stack or labels.DEFAULT_STACK, keep=args.keep)
+
+
+def cmd_status(args):
+    from components import status
+    stack = None if args.all else args.stack or labels.DEFAULT_STACK
+    containers = status.list_containers(stack)
+    if not containers:
+        cprint.orange(str.format(
+            'No containers in {}.', 'any stack' if stack is None else
+            str.format("stack '{}'", stack)))
+        return
+
+    print(status.status_table(containers, with_stack=stack is None))
+    if args.stats:
+        print('')
+        status.watch_stats(
+            containers, interval=args.interval, count=args.count)
+
+
+def _write_output(stream, data):
+    out = sys.stderr if stream == 'stderr' else sys.stdout
+    if data:
+        out.buffer.write(data)
+    out.flush()
+
+
+def _print_deployer_log(args, container_name):
+    from components.stacks import logs_dir
+    path = os.path.join(
+        logs_dir(args.stack or labels.DEFAULT_STACK),
+        str.format('{}.log', container_name))
+    if not os.path.exists(path):
+        raise CommandError(str.format('Log file {} is not found.', path))
+
+    with open(path, mode='rb') as f:
+        lines = f.readlines()
+        if args.tail != 'all':
+            lines = lines[len(lines) - int(args.tail):] if args.tail else []
+        _write_output('stdout', b''.join(lines))
+        while args.follow:
+            time.sleep(LOGS['FLUSH_INTERVAL'])
+            _write_output('stdout', f.read())
+
+
+def cmd_logs(args):
+    container = _find_container(args)
+    if args.deployer:
+        return _print_deployer_log(args, container)
+
+    from components import async_engine
+    if async_engine.enabled():
+        engine = async_engine.engine()
+
+        async def read():
+            inspect = await engine.inspect_container(container)
+            async for stream, data in engine.logs(
+                    container, follow=args.follow, tail=args.tail,
+                    tty=inspect['Config']['Tty']):
+                _write_output(stream, data)
+
+        async_engine.run(read())
+    else:
+        from helpers.docker_client import LazyDockerClient
+        for data in LazyDockerClient().api.logs(
+                container, stream=True, follow=args.follow, tail=args.tail):
+            _write_output('stdout', data)
+
+
+def cmd_exec(args):
+    container = _find_container(args)
+    command = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+    if not command:
+        raise CommandError('Command to execute is not given.')
+    if len(command) == 1 and ' ' in command[0]:
+        command = ['bash', '-c', command[0]]
+
+    from components import async_engine
+    if async_engine.enabled():
+        exit_code = async_engine.run(async_engine.engine().exec_run(
+            container, command,
+            on_output=lambda stream, text: _write_output(
+                stream, text.encode('utf-8'))))
+    else:
+        from helpers.docker_client import LazyDockerClient
+        api = LazyDockerClient().api
+        exec_id = api.exec_create(container, command)['Id']
+        for stdout, stderr in api.exec_start(
+                exec_id, stream=True, demux=True):
+            if stdout:
+                _write_output('stdout', stdout)
+            if stderr:
+                _write_output('stderr', stderr)
+        exit_code = api.exec_inspect(exec_id)['ExitCode']
+    return exit_code
+
+
+def cmd_plan(args):
+    stack = None
+    if args.stack:
+        # an allocated stack is applied to see its containers and changes
+        from components.stacks import find_stack
+        stack = find_stack(args.stack)
+        if stack is not None:
+            stack.apply()
+
+    from components.deploy_operations import change_plans, deployment_plan
+    only = resolve_components(args.components) or None
+    stages = deployment_plan(only=only, with_dependencies=not args.no_deps)
+    changes = {}
+    if CHANGE_PLANNER.get('ENABLED', True) and (
+            stack is not None or not args.stack):
+        changes = change_plans(only=only, with_dependencies=not args.no_deps)
+
+    from components import status
+    states = {
+        status.container_name(c): c.get('State', '')
+        for c in status.list_containers(args.stack or labels.DEFAULT_STACK)
+    }
+    cprint.blue(str.format(
+        "Deployment plan of stack '{}':", args.stack or labels.DEFAULT_STACK))
+    for number, stage in enumerate(stages, start=1):
+        for c in stage:
+            name = c.container_name
+            if args.stack and stack is None:
+                name = str.format('{}_{}', args.stack, name)
+            print(str.format(
+                '  {}. {:<24} {:<16} {}{}', number, name, c.config_key.lower(),
+                states.get(name) or 'missing',
+                str.format(', after {}', ', '.join(
+                    k.lower() for k in c.depends_on)) if c.depends_on else ''))
+            if c.config_key in changes:
+                print(str.format(
+                    '     {}', changes[c.config_key].describe()))
+
+
+def cmd_prune_caches(args):
+    from components.deploy_operations import prune_caches
+    prune_caches(max_size_mb=args.max_cache_size)
+
+
+def _tail(value):
+    if value == 'all':
+        return value
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError("number of lines or 'all' expected")
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        '--stack', metavar='ID',
+        help='isolated copy of the environment with own container names, '
+             'subnet, host ports and directory')
+
+    parser = argparse.ArgumentParser(description='Deploy local environment.')
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+
+    up = commands.add_parser(
+        'up', parents=[common],
+        help='deploy all components or the given ones with dependencies')
+    up.set_defaults(func=cmd_up)
+    up.add_argument('components', nargs='*', metavar='COMPONENT')
+    up.add_argument(
+        '--no-deps', action='store_true',
+        help='consider dependencies of the components as deployed')
+    up.add_argument(
+        '--check-remote', action='store_true', default=None,
+        help='pull images whose local digest differs from the registry one')
+    up.add_argument(
+        '--rebuild', action='store_true',
+        help='build custom images even if Dockerfiles are not changed')
+    up.add_argument(
+        '--refresh-base', action='store_true',
+        help='pull base images of Dockerfiles before build')
+    up.add_argument(
+        '--recreate', action='store_true',
+        help='recreate containers even if their desired state is not changed')
+    up.add_argument(
+        '--fast-mysql', action='store_true',
+        help="MySQL data on tmpfs with relaxed durability, see "
+             "CONTAINERS['MYSQL']['FAST_MODE']")
+
+    down = commands.add_parser(
+        'down', parents=[common],
+        help='remove containers of the given components, the whole stack '
+             'with its network without them')
+    down.set_defaults(func=cmd_down)
+    down.add_argument('components', nargs='*', metavar='COMPONENT')
+    down.add_argument(
+        '-t', '--timeout', type=float, default=None, metavar='SECONDS',
+        help="grace period before containers are killed, "
+             "TEARDOWN['STOP_TIMEOUT'] by default")
+    down.add_argument(
+        '--images', action='store_true',
+        help='remove built images and warm snapshots of the stack too, '
+             'otherwise only stale ones')
+
+    status = commands.add_parser(
+        'status', parents=[common],
+        help='show state, addresses, ports and health of containers')
+    status.set_defaults(func=cmd_status)
+    status.add_argument(
+        '--all', action='store_true', help='containers of all stacks')
+    status.add_argument(
+        '--stats', action='store_true',
+        help='then show CPU, memory and I/O of running containers in a '
+             'refreshing table until interrupted')
+    status.add_argument(
+        '--interval', type=float, default=1.0, metavar='SECONDS',
+        help='refresh interval of --stats')
+    status.add_argument(
+        '--count', type=int, default=None, metavar='N',
+        help='number of --stats refreshes')
+
+    logs = commands.add_parser(
+        'logs', parents=[common], help='show output of a component')
+    logs.set_defaults(func=cmd_logs)
+    logs.add_argument('component')
+    logs.add_argument('-f', '--follow', action='store_true')
+    logs.add_argument(
+        '--tail', type=_tail, default=100, metavar='N',
+        help="number of last lines or 'all', 100 by default")
+    logs.add_argument('--replica', type=int, metavar='N')
+    logs.add_argument(
+        '--deployer', action='store_true',
+        help='log of the deployment steps instead of the container output')
+
+    exec_ = commands.add_parser(
+        'exec', parents=[common],
+        help='run a command in the container of a component')
+    exec_.set_defaults(func=cmd_exec)
+    exec_.add_argument('--replica', type=int, metavar='N')
+    exec_.add_argument('component')
+    exec_.add_argument(
+        'cmd', nargs=argparse.REMAINDER, metavar='COMMAND',
+        help='program with arguments, a single argument with spaces is run '
+             'by bash -c')
+
+    plan = commands.add_parser(
+        'plan', parents=[common],
+        help='show the order components would be deployed in and what is '
+             'changed since the last deployment')
+    plan.set_defaults(func=cmd_plan)
+    plan.add_argument('components', nargs='*', metavar='COMPONENT')
+    plan.add_argument('--no-deps', action='store_true')
+
+    prune_images = commands.add_parser(
+        'prune-images', parents=[common],
+        help='remove replaced builds and old warm snapshots of the stack')
+    prune_images.set_defaults(func=cmd_prune_images)
+    prune_images.add_argument(
+        '--keep', type=int, default=None, metavar='N',
+        help="warm snapshots kept for every component, "
+             "TEARDOWN['KEEP_SNAPSHOTS'] by default")
+
+    prune = commands.add_parser(
+        'prune-caches',
+        help='show sizes of package cache volumes and evict them above the '
+             'size limit')
+    prune.set_defaults(func=cmd_prune_caches)
+    prune.add_argument(
+        '--max-cache-size', type=int, default=None, metavar='MB',
+        help="PACKAGE_CACHES['MAX_SIZE_MB'] by default")
+
+    return parser
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or (argv[0].startswith('-') and argv[0] not in (
+            '-h', '--help')):
+        argv.insert(0, DEFAULT_COMMAND)
+
+    args = build_parser().parse_args(argv)
+    try:
+        exit_code = args.func(args)
+    except CommandError as e:
+        cprint.red(str(e))
+        exit_code = 2
+    except Exception as e:
+        if not _engine_unreachable(e):
+            raise
+        cprint.red(str.format('Docker daemon is not reachable: {}', e))
+        exit_code = 3
+    except KeyboardInterrupt:
+        exit_code = 130
+    raise SystemExit(exit_code or 0)
@@ -0,0 +1,90 @@
+import fnmatch
+import gzip
+import hashlib
+import io
+import os
+import tarfile
+import tempfile
+from config import CONTAINERS, DEPLOYER_STATE_DIR
+
+SNAPSHOTS_DIR = os.path.join(DEPLOYER_STATE_DIR, 'db_snapshots')
+
+# directories which never contain migrations or fixtures of the project
+SKIP_DIRS = ('.git', 'node_modules', 'bower_components', 'dist')
+
+
+def iter_files(root, patterns):
+    """ Relative paths of files under 'root' matching any of 'patterns' """
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(d for d in dir_names if d not in SKIP_DIRS)
+        for file_name in sorted(file_names):
+            path = os.path.relpath(os.path.join(dir_path, file_name), root)
+            if any(fnmatch.fnmatch(path, p) for p in patterns):
+                yield path
+
+
+def snapshot_key(root, patterns, commands):
+    """ Hash of the commands and content of files matching 'patterns' """
+    key = hashlib.sha256('\n'.join(commands).encode('utf-8'))
+    for path in iter_files(root, patterns):
+        key.update(path.encode('utf-8'))
+        with open(os.path.join(root, path), mode='rb') as f:
+            key.update(f.read())
+    return key.hexdigest()
+
+
+def snapshot_path(name, key):
+    return os.path.join(
+        SNAPSHOTS_DIR, str.format('{}-{}.sql.gz', name, key[:16]))
+
+
+def dump_databases(client, databases, path):
+    """ Dumps schemas and data of databases from MySQL container to path """
+    exec_id = client.api.exec_create(
+        CONTAINERS['MYSQL']['CONTAINER_NAME'],
+        ['mysqldump', '-u', 'root', '--single-transaction', '--routines',
+         '--add-drop-database', '--databases'] + list(databases),
+        stdout=True, stderr=False
+    )
+
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, mode='wb') as dump:
+        for chunk in client.api.exec_start(exec_id, stream=True):
+            dump.write(chunk)
+
+    exit_code = client.api.exec_inspect(exec_id)['ExitCode']
+    if exit_code != 0:
+        os.remove(tmp_path)
+        raise IOError(str.format(
+            'mysqldump of {} failed with exit code {}',
+            ', '.join(databases), exit_code))
+    os.replace(tmp_path, path)
+
+
+def restore_databases(client, path):
+    """ Loads the dump into MySQL container in bulk """
+    container_name = CONTAINERS['MYSQL']['CONTAINER_NAME']
+    dump_name = os.path.basename(path)
+
+    with tempfile.TemporaryFile() as archive:
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            tar.add(path, arcname=dump_name)
+        archive.seek(0)
+        client.api.put_archive(container_name, '/tmp', archive)
+
+    exec_id = client.api.exec_create(
+        container_name,
+        ['bash', '-c', str.format(
+            'gunzip -c /tmp/{0} | mysql -u root && rm -f /tmp/{0}',
+            dump_name)]
+    )
+    output = io.BytesIO()
+    for chunk in client.api.exec_start(exec_id, stream=True):
+        output.write(chunk)
+
+    exit_code = client.api.exec_inspect(exec_id)['ExitCode']
+    if exit_code != 0:
+        raise IOError(str.format(
+            "Restore of '{}' failed with exit code {}: {}",
+            path, exit_code, output.getvalue().decode(errors='replace')))
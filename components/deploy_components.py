@@ -1,64 +1,335 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import functools
 from time import sleep
 from io import BytesIO
-import json
+import glob
+import hashlib
+import ipaddress
 import os
-import docker
-from docker import types  # noqa
-from components.mysql_components import raw_sql, wait_for_mysql_starts
+import posixpath
+import shlex
+import tarfile
+import time
+from components.mysql_components import execute_batch, raw_sql
+from components.probes import HttpProbe, SqlProbe, TcpProbe, wait_until_ready
+from components import async_engine, build_context, db_snapshots, events
+from components.cache_volumes import cache_binds, cache_environment
+from components.journal import StepFailedError, StepJournal
+from components.labels import (
+    LABEL_PREFIX,
+    BUILD_HASH_LABEL, SPEC_HASH_LABEL, current_stack, owner_labels, spec_hash
+)
+from components.scheduler import DependencyScheduler
+from components.status import list_containers, status_table
+from components.steps import BOOT_SCOPE, Pipeline, Step, generated_key
 from helpers.color_print import ColorPrint
+from helpers.docker_client import LazyDockerClient
+from helpers.git_operations import (
+    modified_files, record_generated, stale_generated
+)
+from helpers.log_writer import LogWriter
+from helpers.progress import PullProgress, iter_json_objects
+from helpers.tracing import span, traced, tracer
 from config import (
-    DOCKER_NETWORK, CONTAINERS, GIT_REPOSITORIES, HOME_DEPLOYMENT_DIR
+    DOCKER_NETWORK, CONTAINERS, GIT_REPOSITORIES, HOME_DEPLOYMENT_DIR, IMAGES,
+    DEPLOYER_STATE_DIR, DB_SNAPSHOTS, LOGS, LOAD_BALANCER, STEPS
 )
 
-client = docker.from_env()
+client = LazyDockerClient()
 cprint = ColorPrint()
+log_writer = LogWriter(
+    LOGS['DIR'],
+    interval=LOGS['FLUSH_INTERVAL'],
+    max_lines=LOGS['MAX_TERMINAL_LINES'],
+    tail_lines=LOGS['TAIL_LINES']
+)
+
+# commands which only change state of the shell session
+SHELL_STATE_COMMANDS = ('cd ', 'source ', 'export ', 'deactivate')
+# file in setup artifact directories with the setup key they were made by
+SETUP_STAMP = '.deployer_setup_key'
+
+
+def _local_image(image_name):
+    from docker.errors import ImageNotFound
+    try:
+        return client.api.inspect_image(image_name)
+    except ImageNotFound:
+        return None
+
+
+def image_is_up_to_date(image_name, check_remote=False):
+    """
+    Image is up to date when it exists locally and, if 'check_remote' is
+    set, one of its repo digests matches the digest in the registry.
+    """
+    local_image = _local_image(image_name)
+    if local_image is None:
+        return False
+    if not check_remote:
+        return True
+
+    remote_digest = client.api.inspect_distribution(
+        image_name)['Descriptor']['digest']
+    return any(
+        d.split('@')[-1] == remote_digest
+        for d in local_image.get('RepoDigests') or []
+    )
 
 
-def prepare_images():
-    """ Pull images if they're doesn't exists locally. """
-    images_to_prepare = [
-        v['IMAGE_NAME'] for k, v in CONTAINERS.items()
-        if 'IMAGE_NAME' in v.keys()
+def base_images(dockerfile_content):
+    """
+    Images from FROM instructions of the Dockerfile, without 'scratch' and
+    names of earlier build stages
+    """
+    images, stages = [], set()
+    for line in dockerfile_content.splitlines():
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].upper() == 'FROM':
+            if parts[1] != 'scratch' and parts[1] not in stages:
+                images.append(parts[1])
+            if len(parts) >= 4 and parts[2].upper() == 'AS':
+                stages.add(parts[3])
+    return images
+
+
+def pull_base_image(image_name):
+    """ Pulls the image, IOError is raised if the registry reports an error """
+    from docker.utils import parse_repository_tag
+    repository, tag = parse_repository_tag(image_name)
+    for event in iter_json_objects(
+            client.api.pull(repository, tag=tag or 'latest', stream=True)):
+        if 'error' in event:
+            raise IOError(str.format(
+                "Pull of '{}' failed: {}", image_name, event['error']))
+
+
+@traced('pull_image')
+def pull_image(image_name, progress, check_remote=False):
+    if image_is_up_to_date(image_name, check_remote):
+        progress.finish(image_name, 'Up to date')
+        return
+
+    from docker.utils import parse_repository_tag
+    repository, tag = parse_repository_tag(image_name)
+    for event in iter_json_objects(
+            client.api.pull(repository, tag=tag, stream=True)):
+        progress.update(image_name, event)
+
+    progress.finish(image_name, 'Pulled')
+
+
+@traced('prepare_images')
+def prepare_images(check_remote=None, config_keys=None):
+    """
+    Pull images concurrently if they aren't up to date locally. Only
+    images of 'config_keys' components are pulled if given.
+    """
+    from docker.utils import parse_repository_tag
+    if check_remote is None:
+        check_remote = IMAGES.get('CHECK_REMOTE', False)
+
+    settings = [
+        v for k, v in CONTAINERS.items()
+        if config_keys is None or k in config_keys
     ]
+    images_to_prepare = set()
+    for v in settings:
+        image_name = v.get('IMAGE_NAME')
+        if image_name and image_name != 'custom':
+            repository, tag = parse_repository_tag(image_name)
+            images_to_prepare.add(
+                str.format('{}:{}', repository, tag or 'latest'))
+    if any(v.get('REPLICAS', 1) > 1 for v in settings):
+        repository, tag = parse_repository_tag(LOAD_BALANCER['IMAGE_NAME'])
+        images_to_prepare.add(
+            str.format('{}:{}', repository, tag or 'latest'))
+
+    progress = PullProgress()
     for image_name in images_to_prepare:
-        if image_name != 'custom':
-            for s in client.api.pull(image_name, stream=True):
-                resp = json.loads(s.decode().replace('\r\n', ''))
-                if 'progressDetail' not in resp.keys():
-                    print(str.format('[{}]', resp['status']))
-                else:
-                    print(str.format('[{}] Progress: {}',
-                                     resp['status'], resp['progressDetail']))
+        progress.add_image(image_name)
+
+    with ThreadPoolExecutor(
+            max_workers=IMAGES.get('PULL_WORKERS')) as executor:
+        futures = [
+            executor.submit(pull_image, image_name, progress, check_remote)
+            for image_name in images_to_prepare
+        ]
+    for future in futures:
+        future.result()
 
 
+@traced('prepare_network')
 def prepare_network():
-    for net in client.api.networks():
-        if net['Name'] in (DOCKER_NETWORK['NETWORK_NAME'], 'deployer_Network'):
-            client.api.remove_network(net['Id'])
+    """
+    Creates the network. Existing network is kept if its configuration is
+    not changed, otherwise it's removed with all attached containers.
+    """
+    network_spec = {
+        'subnet': DOCKER_NETWORK['SUBNET'],
+        'gateway': DOCKER_NETWORK['GATEWAY'],
+        'driver': 'bridge'
+    }
+    network_hash = spec_hash(network_spec)
 
-    ipam_pool = docker.types.IPAMPool(
+    for net in client.api.networks():
+        if net['Name'] == DOCKER_NETWORK['NETWORK_NAME']:
+            labels = net.get('Labels') or {}
+            if labels.get(SPEC_HASH_LABEL) == network_hash:
+                return
+            _remove_network(net['Id'])
+        elif net['Name'] == 'deployer_Network':
+            _remove_network(net['Id'])
+
+    from docker.types import IPAMConfig, IPAMPool
+    ipam_pool = IPAMPool(
         subnet=DOCKER_NETWORK['SUBNET'],
         gateway=DOCKER_NETWORK['GATEWAY']
     )
 
-    ipam_config = docker.types.IPAMConfig(
+    ipam_config = IPAMConfig(
         pool_configs=[ipam_pool]
     )
 
     client.api.create_network(
-        DOCKER_NETWORK['NETWORK_NAME'], driver="bridge", ipam=ipam_config)
+        DOCKER_NETWORK['NETWORK_NAME'], driver="bridge", ipam=ipam_config,
+        labels=owner_labels(spec_hash=network_hash))
+
+
+def _remove_network(network_id):
+    """ Removes the network together with containers attached to it """
+    attached = client.api.inspect_network(network_id).get('Containers') or {}
+    for container_id in attached:
+        client.api.remove_container(container_id, force=True, v=True)
+    client.api.remove_network(network_id)
+
+
+def _inspect_container(container_name):
+    from docker.errors import NotFound
+    try:
+        return client.api.inspect_container(container_name)
+    except NotFound:
+        return None
+
+
+def _reserved_addresses(config_key):
+    """
+    Addresses of the load balancer and replicas of a component. Every
+    component has its own block of free addresses at the end of the
+    subnet, so they don't depend on replicas of other components.
+    """
+    network = ipaddress.ip_network(DOCKER_NETWORK['SUBNET'])
+    used = {DOCKER_NETWORK['GATEWAY']} | {
+        c['NETWORK']['IPV4_ADDRESS'] for c in CONTAINERS.values()}
+    size = LOAD_BALANCER.get('ADDRESSES_PER_COMPONENT', 8)
+    start = sorted(CONTAINERS).index(config_key) * size
+
+    addresses = []
+    host = network.broadcast_address - 1
+    while len(addresses) < start + size:
+        if host <= network.network_address:
+            raise ValueError(str.format(
+                'Subnet {} has no free addresses for replicas', network))
+        if str(host) not in used:
+            addresses.append(str(host))
+        host -= 1
+    return addresses[start:]
+
+
+def replica_address(config_key, index):
+    """ Address of the replica of a component from its reserved block """
+    addresses = _reserved_addresses(config_key)
+    if index >= len(addresses):
+        raise ValueError(str.format(
+            "'{}' can't have more than {} replicas, see "
+            "LOAD_BALANCER['ADDRESSES_PER_COMPONENT']",
+            config_key, len(addresses)))
+    return addresses[index]
+
+
+def load_balancer_address(config_key):
+    """ The first address of the block reserved for the component """
+    return _reserved_addresses(config_key)[0]
+
+
+def component_span(name):
+    """ Wraps a method of a component into a span named after container """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with span(
+                    str.format('{} {}', self.container_name, name),
+                    category='component'):
+                return method(self, *args, **kwargs)
+        wrapper.__traced__ = True
+        return wrapper
+    return decorator
 
 
 class DeploymentComponent(ABC):
+    # key of the component settings in CONTAINERS
+    config_key = None
+    # CONTAINERS keys of the components which must be deployed before
+    depends_on = ()
+    # GIT_REPOSITORIES key of the repository mounted into the container
+    repository = None
+    # dependency manifests of the repository (glob patterns), their content
+    # is a part of the warm snapshot key
+    setup_manifests = ()
+    # paths created in the mounted repository by the setup phase, required
+    # for starting from a warm snapshot (they aren't a part of the image)
+    setup_artifacts = ()
+    # paths generated in the mounted repository by steps (glob patterns),
+    # e.g. collected static files; like setup artifacts they are never a
+    # part of the build context
+    generated_paths = ()
+    # databases filled by the component and files of the mounted repository
+    # (glob patterns) which define their content, e.g. migrations, fixtures
+    databases = ()
+    database_inputs = ()
+    # package managers whose shared cache volumes are mounted into container
+    package_caches = ()
+    # run in the running container when files of the repository changed,
+    # for processes which don't reload changed code on their own
+    reload_commands = ()
+    # methods which are wrapped into tracing spans in every subclass
+    traced_methods = ('create', 'after_ready', 'inspect_after_start')
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method_name in cls.traced_methods:
+            method = cls.__dict__.get(method_name)
+            if method is not None and not getattr(
+                    method, '__traced__', False):
+                setattr(cls, method_name, component_span(method_name)(method))
 
     def __init__(
-            self, container_name, image_name, docker_port, localhost_port):
+            self, container_name, image_name, docker_port, localhost_port,
+            rebuild=False, refresh_base=False, recreate=False):
         self.image_name = image_name
         self.container_name = container_name
         self.localhost_port = localhost_port
         self.docker_port = docker_port
         self.report_string = None
+        # build image even if its build hash is not changed
+        self.rebuild = rebuild
+        # pull base images of Dockerfile before build
+        self.refresh_base = refresh_base
+        # recreate container even if its desired state is not changed
+        self.recreate = recreate
+        self._journal = None
+        self.setup_key = None
+        # replicas are started from the warm snapshot of the primary
+        # container, 'replica_index' is None for the primary one
+        self.snapshot_name = container_name
+        self.replica_index = None
+        self.create_kwargs = None
+        self.setup_commands = None
+        # ids of the container and its dependencies, the deployment is
+        # aborted when any of them dies
+        self.watched_ids = ()
 
     def inspect_after_start(self):
         inspect = client.api.inspect_container(self.container_name)
@@ -92,29 +363,481 @@ class DeploymentComponent(ABC):
             ', '.join(docker_ports),
             create_datetime
         )
+        if self.replica_count() > 1:
+            self.report_string += str.format(
+                "Replicas: {}, balanced by '{}' at http://localhost:{}\n",
+                self.replica_count(), self.load_balancer_name(),
+                self.localhost_port)
 
         cprint.blue(self.report_string)
 
-    def exec_cmd(self, container_name, cmd, detach=False):
+    @property
+    def journal(self):
+        if self._journal is None:
+            self._journal = StepJournal(os.path.join(
+                DEPLOYER_STATE_DIR, 'journal',
+                str.format('{}.json', self.container_name)))
+        return self._journal
+
+    def desired_spec(self, create_kwargs):
+        """
+        Desired state of the container: creation parameters with the image
+        resolved to its id, the network id and ids of dependency containers
+        (their recreation invalidates the state this container was set up
+        against, e.g. databases in MySQL).
+        """
+        spec = dict(create_kwargs)
+        spec['image'] = client.api.inspect_image(spec['image'])['Id']
+        spec['network'] = client.api.inspect_network(
+            DOCKER_NETWORK['NETWORK_NAME'])['Id']
+
+        dependencies = {}
+        for key in self.depends_on:
+            dependency = _inspect_container(CONTAINERS[key]['CONTAINER_NAME'])
+            dependencies[key] = dependency['Id'] if dependency else None
+        spec['dependencies'] = dependencies
+
+        return spec
+
+    def _setup_key(self, image_id, setup_commands):
+        """ Hash of the base image, setup commands and dependency manifests """
+        key = hashlib.sha256(image_id.encode())
+        key.update('\n'.join(setup_commands).encode('utf-8'))
+
+        local_dir = GIT_REPOSITORIES[self.repository]['local_dir']
+        for pattern in self.setup_manifests:
+            for path in sorted(glob.glob(os.path.join(local_dir, pattern))):
+                key.update(os.path.relpath(path, local_dir).encode())
+                with open(path, mode='rb') as manifest:
+                    key.update(manifest.read())
+
+        return key.hexdigest()
+
+    def _warm_image_tag(self):
+        return str.format(
+            '{}_warm:{}', self.snapshot_name, self.setup_key[:16])
+
+    def _warm_image(self):
+        """ Tag of the warm snapshot image if it can be used """
+        if not self.setup_key:
+            return None
+
+        tag = self._warm_image_tag()
+        if _local_image(tag) is None:
+            return None
+
+        for artifact in self.setup_artifacts:
+            if self._artifact_setup_key(artifact) != self.setup_key:
+                return None
+
+        return tag
+
+    def _artifact_setup_key(self, artifact):
+        """ Setup key stamped into the artifact directory, None if absent """
+        local_dir = GIT_REPOSITORIES[self.repository]['local_dir']
+        try:
+            with open(os.path.join(local_dir, artifact, SETUP_STAMP),
+                      mode='r') as stamp:
+                return stamp.read().strip()
+        except IOError:
+            return None
+
+    def _stamp_artifacts(self):
+        """
+        Writes the setup key into the artifact directories, so a warm
+        snapshot isn't used with artifacts of another setup. It's written
+        from the container, which owns them.
+        """
+        local_dir = GIT_REPOSITORIES[self.repository]['local_dir']
+        host_config = self.create_kwargs.get('host_config') or {}
+        mount = None
+        for bind in host_config.get('Binds') or []:
+            host_path, container_path = bind.split(':')[:2]
+            if host_path == local_dir:
+                mount = container_path
+        if mount is None:
+            return
+
+        for artifact in self.setup_artifacts:
+            if self._artifact_setup_key(artifact) != self.setup_key:
+                path = shlex.quote(posixpath.join(mount, artifact))
+                self.exec_cmd(self.container_name, str.format(
+                    "test ! -d {0} || printf '%s' {1} > {0}/{2}",
+                    path, self.setup_key, SETUP_STAMP))
+
+    def _with_package_caches(self, create_kwargs):
+        """ Adds cache volume binds and environment to creation parameters """
+        if not self.package_caches:
+            return create_kwargs
+
+        host_config = dict(create_kwargs.get('host_config') or {})
+        host_config['Binds'] = list(host_config.get('Binds') or []) + [
+            str.format('{}:{}:{}', name, bind['bind'], bind['mode'])
+            for name, bind in sorted(
+                cache_binds(self.package_caches).items())
+        ]
+        environment = dict(create_kwargs.get('environment') or {})
+        environment.update(cache_environment(self.package_caches))
+
+        return dict(
+            create_kwargs, host_config=host_config, environment=environment)
+
+    def _with_resources(self, create_kwargs):
+        """ Adds CPU and memory limits from RESOURCES of the component """
+        resources = CONTAINERS[self.config_key].get('RESOURCES') or {}
+        if not any(resources.values()):
+            return create_kwargs
+
+        host_config = dict(create_kwargs.get('host_config') or {})
+        if resources.get('CPUS'):
+            host_config['NanoCpus'] = int(resources['CPUS'] * 1e9)
+        if resources.get('MEMORY_MB'):
+            host_config['Memory'] = resources['MEMORY_MB'] * 1024 * 1024
+        return dict(create_kwargs, host_config=host_config)
+
+    def create_and_start_container(self, setup_commands=None, **create_kwargs):
+        """
+        Reconciles the container with its desired state: an existing
+        container with the same spec hash is kept (e.g. after a failed run,
+        so steps are resumed), otherwise it's recreated. A new container is
+        created from the warm snapshot image if it matches 'setup_commands'.
+        Starts the container if needed and binds the step journal to it.
+        Returns the container id.
+        """
+        if self.replica_count() > 1:
+            # the host port is taken by the load balancer
+            create_kwargs = self._without_host_ports(create_kwargs)
+        elif 'REPLICAS' in CONTAINERS[self.config_key]:
+            # scaled down to one container, which takes the port back
+            self._remove_load_balancer()
+        self.create_kwargs = create_kwargs
+        self.setup_commands = setup_commands
+
+        create_kwargs = self._with_resources(
+            self._with_package_caches(create_kwargs))
+        spec = self.desired_spec(create_kwargs)
+        if setup_commands:
+            self.setup_key = self._setup_key(spec['image'], setup_commands)
+            spec['setup_key'] = self.setup_key
+        desired_hash = spec_hash(spec)
+
+        inspect = _inspect_container(self.container_name)
+        if inspect is not None:
+            labels = inspect['Config'].get('Labels') or {}
+            if self.recreate or labels.get(SPEC_HASH_LABEL) != desired_hash:
+                cprint.orange(str.format(
+                    "Desired state of '{}' changed, recreating container.",
+                    self.container_name))
+                client.api.remove_container(inspect['Id'], force=True, v=True)
+                inspect = None
+            else:
+                cprint.green(str.format(
+                    "Container '{}' is up to date, kept.",
+                    self.container_name))
+
+        started_warm = False
+        if inspect is None:
+            warm_image = self._warm_image()
+            if warm_image is not None:
+                cprint.green(str.format(
+                    "Starting '{}' from warm snapshot '{}'.",
+                    self.container_name, warm_image))
+                create_kwargs = dict(create_kwargs, image=warm_image)
+                started_warm = True
+
+            with span(str.format('{} create_container', self.container_name)):
+                client.api.create_container(
+                    name=self.container_name,
+                    labels=owner_labels(
+                        spec_hash=desired_hash, component=self.config_key,
+                        **self._replica_labels()),
+                    **create_kwargs
+                )
+            inspect = client.api.inspect_container(self.container_name)
+
+        if not inspect['State']['Running']:
+            with span(str.format('{} start', self.container_name)):
+                client.api.start(inspect['Id'])
+            inspect = client.api.inspect_container(inspect['Id'])
+
+        self.journal.bind(inspect['Id'], inspect['State']['StartedAt'])
+        self._watch(inspect['Id'], spec['dependencies'].values())
+        if started_warm:
+            self.journal.record(
+                self._setup_journal_key(), 'setup', 'warm snapshot',
+                'succeeded')
+        return inspect['Id']
+
+    def _watch(self, container_id, dependency_ids=None):
+        if dependency_ids is None:
+            dependencies = [
+                _inspect_container(CONTAINERS[key]['CONTAINER_NAME'])
+                for key in self.depends_on
+            ]
+            dependency_ids = [d['Id'] for d in dependencies if d]
+        self.watched_ids = (container_id,) + tuple(
+            i for i in dependency_ids if i)
+
+    def _setup_journal_key(self):
+        return str.format('setup:{}', self.setup_key)
+
+    @component_span('setup')
+    def run_setup(self, commands):
+        """
+        Runs environment setup steps, unless the container was started from
+        a warm snapshot, and commits the snapshot after the setup.
+        """
+        if self.journal.is_done(self._setup_journal_key()):
+            cprint.green(str.format(
+                '[{}] environment setup is already done, skipped.',
+                self.container_name))
+        else:
+            self.run_steps('setup', commands)
+            self.journal.record(
+                self._setup_journal_key(), 'setup', 'setup steps',
+                'succeeded')
+        self._stamp_artifacts()
+
+        if _local_image(self._warm_image_tag()) is None:
+            cprint.orange(str.format(
+                "Committing warm snapshot '{}'.", self._warm_image_tag()))
+            repository, tag = self._warm_image_tag().split(':')
+            client.api.commit(
+                self.container_name, repository=repository, tag=tag,
+                conf={'Labels': owner_labels(
+                    setup_key=self.setup_key, component=self.config_key)}
+            )
 
-        container = client.containers.get(container_name)
+    def _exec(self, container_name, cmd, log):
+        """ Runs shell command with output to 'log', returns exit code """
+        with log:
+            if async_engine.enabled():
+                future = async_engine.submit(async_engine.engine().exec_run(
+                    container_name, ['bash', '-c', cmd],
+                    on_output=lambda stream, text: log.write(text)))
+                # output of a dead container is not waited for
+                return events.bus.result(future, self.watched_ids)
+
+            exec_id = client.api.exec_create(
+                container_name, ['bash', '-c', cmd])
+            for chunk in client.api.exec_start(exec_id, stream=True):
+                log.write(chunk)
+            return client.api.exec_inspect(exec_id)['ExitCode']
 
+    def exec_cmd(self, container_name, cmd, detach=False):
+        """ Executes untracked command(s), fails on non-zero exit code """
         if isinstance(cmd, list):
-            response = container.exec_run(
-                cmd="bash -c '" + " ".join(cmd) + "'", stream=True,
-                detach=detach)
-            for r in response:
-                cprint.yellow(r.decode())
-
-        elif isinstance(cmd, str):
-            response = container.exec_run(
-                cmd=str.format("bash -c '{}'", cmd), stream=True,
-                detach=detach)
-            for r in response:
-                cprint.yellow(r.decode())
-        else:
+            cmd = ' '.join(cmd)
+        elif not isinstance(cmd, str):
             raise TypeError("'cmd' parameter must me list or str.")
 
+        if detach:
+            exec_id = client.api.exec_create(
+                container_name, ['bash', '-c', cmd])
+            client.api.exec_start(exec_id, detach=True)
+            return
+
+        log = log_writer.step(container_name, 'exec', cmd)
+        exit_code = self._exec(container_name, cmd, log)
+        if exit_code != 0:
+            raise StepFailedError(
+                container_name, 'exec', cmd, exit_code, output=log.tail())
+
+    @component_span('databases')
+    def run_database_steps(self, groups):
+        """
+        Runs migration and data loading step groups ([(name, commands)]).
+        When a snapshot of the component databases made for the same
+        migrations and fixtures exists it's restored instead, otherwise
+        the snapshot is dumped after the steps.
+        """
+        commands = [c for _, group_commands in groups for c in group_commands]
+        local_dir = GIT_REPOSITORIES[self.repository]['local_dir']
+        key = db_snapshots.snapshot_key(
+            local_dir, self.database_inputs, commands)
+        journal_key = str.format('databases:{}', key)
+
+        if self.journal.is_done(journal_key):
+            cprint.green(str.format(
+                '[{}] databases are already prepared, skipped.',
+                self.container_name))
+            return
+
+        path = db_snapshots.snapshot_path(self.container_name, key)
+        use_snapshots = DB_SNAPSHOTS.get('ENABLED', True)
+
+        if use_snapshots and os.path.exists(path):
+            cprint.green(str.format(
+                "[{}] restoring databases from snapshot '{}'.",
+                self.container_name, path))
+            db_snapshots.restore_databases(client, path)
+        else:
+            # migrations and fixtures of the key are applied even if the
+            # same commands already succeeded in the container
+            step_keys = []
+            for name, group_commands in groups:
+                step_keys += self.run_steps(
+                    name, group_commands, cache_key=key)
+            # the dump is restored instead of these steps, so it's made
+            # only from databases they were applied to under this key
+            if use_snapshots and all(
+                    self.journal.is_done(k, cache_key=key)
+                    for k in step_keys):
+                cprint.orange(str.format(
+                    "[{}] dumping databases {} to '{}'.",
+                    self.container_name, ', '.join(self.databases), path))
+                db_snapshots.dump_databases(client, self.databases, path)
+
+        self.journal.record(journal_key, 'databases', key, 'succeeded')
+
+    def _run_tracked(self, key, name, cmd, detach=False, per_boot=False,
+                     cache_key=None, rerun=False):
+        """
+        Runs the command as a step recorded in the journal with exit code
+        and duration, unless it's already done and 'rerun' is not set
+        """
+        events.bus.check(self.watched_ids)
+        if not rerun and self.journal.is_done(key, cache_key=cache_key):
+            log_writer.message(self.container_name, str.format(
+                '{} already done, skipped: {}', name, cmd),
+                color=ColorPrint.GREEN)
+            return
+
+        log_writer.message(
+            self.container_name, str.format('{}: {}', name, cmd))
+        started = time.monotonic()
+        if detach:
+            self.exec_cmd(self.container_name, cmd, detach=True)
+            self.journal.record(
+                key, name, cmd, 'started', per_boot=per_boot,
+                cache_key=cache_key)
+            return
+
+        with span(str.format('{} {}', self.container_name, name),
+                  category='step', cmd=cmd):
+            log = log_writer.step(self.container_name, name, cmd)
+            exit_code = self._exec(self.container_name, cmd, log)
+        duration = round(time.monotonic() - started, 3)
+        self.journal.record(
+            key, name, cmd,
+            'succeeded' if exit_code == 0 else 'failed',
+            exit_code=exit_code, duration=duration, per_boot=per_boot,
+            cache_key=cache_key)
+
+        if exit_code != 0:
+            raise StepFailedError(
+                self.container_name, name, cmd, exit_code,
+                output=log.tail())
+
+    def run_steps(self, group, commands, detach=False, per_boot=False,
+                  cache_key=None):
+        """
+        Runs every command of the list in the component container as a
+        separate step, recorded in the journal with exit code and duration.
+        Steps that already succeeded in this container are skipped, so a
+        rerun resumes from the first failed step. Commands which only change
+        shell state ('cd', 'source', ...) are prepended to following steps.
+        'per_boot' steps (e.g. starting of servers) are repeated after the
+        container restart, and all steps are repeated once 'cache_key' is
+        changed. Returns journal keys of the steps.
+        """
+        context, keys = [], []
+        for index, cmd in enumerate(commands):
+            cmd = cmd.strip()
+            if cmd.startswith(SHELL_STATE_COMMANDS):
+                context.append(cmd)
+                continue
+
+            # the position keeps a command repeated in the group apart
+            full_cmd = ' '.join(context + [cmd])
+            keys.append(hashlib.sha1(str.format(
+                '{}\n{}\n{}', group, index, full_cmd).encode()).hexdigest())
+            self._run_tracked(
+                keys[-1], str.format('{}[{}]', group, index), full_cmd,
+                detach=detach, per_boot=per_boot, cache_key=cache_key)
+        return keys
+
+    def _execute_step(self, step, cache_key, rerun=False):
+        if step.action is not None:
+            with span(str.format('{} {}', self.container_name, step.name),
+                      category='step'):
+                return step.action()
+        self._run_tracked(
+            str.format('step:{}', step.name), step.name,
+            step.shell_command(), detach=step.detach,
+            per_boot=step.per_boot, cache_key=cache_key, rerun=rerun)
+
+    def _run_step(self, step, cache_key, only=None):
+        if only is not None and step.name not in only:
+            return
+        if not step.modifies_checkout or not self.repository:
+            return self._execute_step(step, cache_key)
+
+        # tracked files the step changes are recorded, so it's run again
+        # once they are reset by the synchronization or edited
+        local_dir = GIT_REPOSITORIES[self.repository]['local_dir']
+        key = generated_key(self.config_key, step.name)
+        stale = stale_generated(local_dir, key)
+        before = modified_files(local_dir)
+        self._execute_step(step, cache_key, rerun=bool(stale))
+        record_generated(local_dir, key, before)
+
+    def pipeline(self):
+        """ Steps run in the container after the environment setup """
+        return None
+
+    @component_span('pipeline')
+    def run_pipeline(self, pipeline, only=None):
+        """
+        Runs steps of the pipeline in the container, every step as soon as
+        the ones it waits for are done and at most STEPS['WORKERS'] at the
+        same time. A step is skipped if it succeeded in this container with
+        the same cache key, or if it's not in 'only' when it's given.
+        """
+        if pipeline is None:
+            return
+
+        root = None
+        if self.repository:
+            root = GIT_REPOSITORIES[self.repository]['local_dir']
+        cache_keys = pipeline.cache_keys(root)
+
+        dependencies = pipeline.dependencies()
+        scheduler = DependencyScheduler(max_workers=STEPS['WORKERS'])
+        for step in pipeline:
+            scheduler.add_task(
+                step.name,
+                functools.partial(
+                    self._run_step, step, cache_keys[step.name], only),
+                depends_on=dependencies[step.name])
+        scheduler.run()
+
+    @component_span('apply_changes')
+    def apply_changes(self, plan):
+        """
+        Brings the running container up to date with changed files of its
+        repository without the full deployment: runs only the steps of the
+        change plan and reload commands of the component.
+        """
+        if not plan.paths and not plan.steps:
+            return
+        if plan.paths:
+            cprint.green(str.format(
+                "[{}] {} file(s) changed since the last deployment, "
+                "running {}.", self.container_name, len(plan.paths),
+                ', '.join(plan.steps) or 'no steps'))
+        else:
+            cprint.green(str.format(
+                "[{}] {}, running {}.", self.container_name, plan.reason,
+                ', '.join(plan.steps)))
+        inspect = client.api.inspect_container(self.container_name)
+        self.journal.bind(inspect['Id'], inspect['State']['StartedAt'])
+        self._watch(inspect['Id'])
+        if plan.steps:
+            self.run_pipeline(self.pipeline(), only=plan.steps)
+        if plan.paths and self.reload_commands:
+            self.exec_cmd(self.container_name, list(self.reload_commands))
+
     def build_links(self, container_name=None):
         con_name = container_name if container_name else self.container_name
         links = {
@@ -125,29 +848,325 @@ class DeploymentComponent(ABC):
 
         return links
 
+    def _build_hash(self, dockerfile_content, context_digest=None):
+        """
+        Hash of the Dockerfile and its build inputs: ids of base images and
+        the digest of the build context. Missing base images are pulled
+        first, so the hash doesn't change once the build pulls them.
+        """
+        build_hash = hashlib.sha256(dockerfile_content.encode('utf-8'))
+        for base_image in base_images(dockerfile_content):
+            local_image = _local_image(base_image)
+            if local_image is None:
+                pull_base_image(base_image)
+                local_image = client.api.inspect_image(base_image)
+            build_hash.update(local_image['Id'].encode())
+        if context_digest:
+            build_hash.update(context_digest.encode())
+        return build_hash.hexdigest()
+
+    def build_context_dir(self):
+        """
+        Mounted repository is used as the build context when BUILD_CONTEXT
+        is enabled for the component, so Dockerfile can COPY from it.
+        """
+        if CONTAINERS[self.config_key].get('BUILD_CONTEXT') and \
+                self.repository:
+            return GIT_REPOSITORIES[self.repository]['local_dir']
+        return None
+
+    @component_span('build_image')
     def build_image_from_dockerfile(self, dockerfile):
         """ Builds image and returns a tag for using in container creation """
         with open(os.path.join('docker_files', dockerfile),
                   mode="r") as dockerfile:
             tag = str.format('{}_image', self.container_name)
-            f = BytesIO(dockerfile.read().encode('utf-8'))
+            dockerfile_content = dockerfile.read()
+
+            if self.refresh_base:
+                for base_image in base_images(dockerfile_content):
+                    pull_base_image(base_image)
+
+            context_dir = self.build_context_dir()
+            files, context_digest = None, None
+            if context_dir:
+                files = build_context.context_files(
+                    context_dir,
+                    exclude=self.setup_artifacts + self.generated_paths)
+                context_digest = build_context.ContextDigestCache(
+                    self.container_name).digest(context_dir, files)
+
+            build_hash = self._build_hash(dockerfile_content, context_digest)
+            if not self.rebuild:
+                image = _local_image(tag)
+                labels = (image or {}).get('Config', {}).get('Labels') or {}
+                if labels.get(BUILD_HASH_LABEL) == build_hash:
+                    cprint.green(str.format(
+                        "Image '{}' is up to date, build skipped.", tag))
+                    return tag
+
+            if context_dir:
+                context_kwargs = {
+                    'fileobj': build_context.stream_context(
+                        context_dir, files, dockerfile_content),
+                    'custom_context': True,
+                    'dockerfile': build_context.DOCKERFILE_NAME
+                }
+            else:
+                context_kwargs = {
+                    'fileobj': BytesIO(dockerfile_content.encode('utf-8'))
+                }
+
+            log = log_writer.step(
+                self.container_name, 'build', tag, color=ColorPrint.GREEN)
             try:
                 for line in client.api.build(
-                    fileobj=f,
-                    nocache=False,
+                    nocache=self.rebuild,
                     rm=True,
                     tag=tag,
                     decode=True,
-                    pull=True
+                    pull=False,
+                    labels=owner_labels(build_hash=build_hash),
+                    **context_kwargs
                 ):
+                    if 'error' in line:
+                        raise IOError(line['error'])
                     line = line.get('stream')
                     if line is not None:
-                        cprint.green(line)
+                        log.write(line)
 
                 return tag
 
-            except Exception:
-                raise IOError("Invalid Dockerfile!")
+            except Exception as e:
+                log.close()
+                raise IOError(str.format(
+                    'Invalid Dockerfile! {}\nLast output:\n{}',
+                    e, '\n'.join(log.tail())))
+            finally:
+                log.close()
+
+    def readiness_probe(self):
+        """ Probe which tells that the deployed service is ready to use """
+        return None
+
+    @component_span('wait_until_ready')
+    def wait_until_ready(self):
+        probe = self.readiness_probe()
+        if probe is None:
+            return
+
+        cprint.orange(str.format(
+            "Waiting for '{}' to be ready ({})...",
+            self.container_name, probe))
+        wait_until_ready(
+            probe,
+            timeout=CONTAINERS[self.config_key].get(
+                'WAIT_FOR_START_TIMEOUT', 60),
+            events=events.bus if events.bus.running else None,
+            watched=self.watched_ids
+        )
+        cprint.green(str.format("'{}' is ready.", self.container_name))
+
+    def after_ready(self):
+        """
+        Called once the component is ready after it's deployed or brought
+        up to date, e.g. to create databases in the server
+        """
+
+    def _container_url(self, path='/'):
+        return str.format(
+            'http://{}:{}{}', self.ipv4_address(), self.docker_port, path)
+
+    def replica_count(self):
+        return CONTAINERS[self.config_key].get('REPLICAS', 1)
+
+    def ipv4_address(self):
+        if self.replica_index is None:
+            return CONTAINERS[self.config_key]['NETWORK']['IPV4_ADDRESS']
+        return replica_address(self.config_key, self.replica_index)
+
+    def _replica_labels(self):
+        if self.replica_index is None:
+            return {}
+        return {
+            'replica_of': self.snapshot_name, 'replica': self.replica_index}
+
+    @staticmethod
+    def _without_host_ports(create_kwargs):
+        host_config = dict(create_kwargs.get('host_config') or {})
+        host_config.pop('PortBindings', None)
+        return dict(create_kwargs, host_config=host_config)
+
+    def _replica(self, index):
+        replica = copy.copy(self)
+        replica.container_name = str.format(
+            '{}_r{}', self.snapshot_name, index)
+        replica.replica_index = index
+        replica.report_string = None
+        replica._journal = None
+        return replica
+
+    def _deploy_replica(self, server_group, server_commands):
+        with span(str.format('deploy {}', self.container_name)):
+            networking_config = client.api.create_networking_config({
+                DOCKER_NETWORK['NETWORK_NAME']:
+                    client.api.create_endpoint_config(
+                        ipv4_address=self.ipv4_address())
+            })
+            self.create_and_start_container(
+                setup_commands=self.setup_commands,
+                **dict(self.create_kwargs,
+                       networking_config=networking_config))
+            self.run_setup(self.setup_commands)
+            self.run_steps(server_group, server_commands, per_boot=True)
+            self.wait_until_ready()
+
+    @component_span('replicas')
+    def deploy_replicas(self, server_group, server_commands):
+        """
+        Scales the component to REPLICAS containers. Replicas are started
+        from the warm snapshot of this (primary) container and share its
+        mounted repository and databases, so only 'server_commands' are run
+        in them. Replicas above the count are removed and the load balancer
+        on the host port is updated to the current set.
+        """
+        replicas = [self._replica(i) for i in range(1, self.replica_count())]
+        if replicas:
+            if not self.setup_commands:
+                raise ValueError(str.format(
+                    "'{}' has no warm snapshot to start replicas from",
+                    self.container_name))
+            with ThreadPoolExecutor(max_workers=len(replicas)) as executor:
+                futures = [
+                    executor.submit(
+                        r._deploy_replica, server_group, server_commands)
+                    for r in replicas
+                ]
+            for future in futures:
+                future.result()
+
+        self._remove_replicas(above=self.replica_count())
+        self._update_load_balancer(
+            [self.ipv4_address()] + [r.ipv4_address() for r in replicas])
+
+    def _remove_replicas(self, above):
+        label = str.format(
+            '{}.replica_of={}', LABEL_PREFIX, self.snapshot_name)
+        replica_label = str.format('{}.replica', LABEL_PREFIX)
+        for container in client.api.containers(
+                all=True, filters={'label': label}):
+            if int(container['Labels'].get(replica_label, 0)) >= above:
+                client.api.remove_container(
+                    container['Id'], force=True, v=True)
+                cprint.orange(str.format(
+                    "Replica '{}' removed.",
+                    container['Names'][0].lstrip('/')))
+
+    def load_balancer_name(self):
+        return str.format('{}_lb', self.snapshot_name)
+
+    def _load_balancer_archive(self, addresses):
+        """ nginx config with replicas as upstream servers, as tar """
+        lines = ['upstream replicas {']
+        lines += [
+            str.format('    server {}:{};', address, self.docker_port)
+            for address in addresses
+        ]
+        lines += [
+            '}',
+            'server {',
+            '    listen 80;',
+            '    client_max_body_size 100m;',
+            '    location / {',
+            '        proxy_pass http://replicas;',
+            str.format(
+                '        proxy_set_header Host $host:{};',
+                self.localhost_port),
+            '        proxy_set_header X-Real-IP $remote_addr;',
+            '        proxy_set_header X-Forwarded-For '
+            '$proxy_add_x_forwarded_for;',
+            '    }',
+            '}',
+        ]
+        content = ('\n'.join(lines) + '\n').encode('utf-8')
+
+        archive = BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            info = tarfile.TarInfo('default.conf')
+            info.size = len(content)
+            tar.addfile(info, BytesIO(content))
+        return archive.getvalue()
+
+    def _remove_load_balancer(self):
+        inspect = _inspect_container(self.load_balancer_name())
+        if inspect is not None:
+            client.api.remove_container(inspect['Id'], force=True, v=True)
+            cprint.orange(str.format(
+                "Load balancer '{}' removed.", self.load_balancer_name()))
+
+    def _update_load_balancer(self, addresses):
+        """
+        Keeps an nginx container on the host port which balances between
+        'addresses'. Changed set of replicas is applied by reloading the
+        config, the container is removed when there is a single replica.
+        """
+        if len(addresses) < 2:
+            self._remove_load_balancer()
+            return
+
+        name = self.load_balancer_name()
+        inspect = _inspect_container(name)
+
+        desired_hash = spec_hash({
+            'image': client.api.inspect_image(
+                LOAD_BALANCER['IMAGE_NAME'])['Id'],
+            'network': client.api.inspect_network(
+                DOCKER_NETWORK['NETWORK_NAME'])['Id'],
+            'host_port': self.localhost_port,
+            'address': load_balancer_address(self.config_key),
+        })
+        if inspect is not None and (
+                inspect['Config'].get('Labels') or {}).get(
+                SPEC_HASH_LABEL) != desired_hash:
+            client.api.remove_container(inspect['Id'], force=True, v=True)
+            inspect = None
+
+        archive = self._load_balancer_archive(addresses)
+        if inspect is None:
+            client.api.create_container(
+                name=name,
+                image=LOAD_BALANCER['IMAGE_NAME'],
+                ports=[80],
+                labels=owner_labels(
+                    spec_hash=desired_hash, component=self.config_key,
+                    load_balancer_of=self.snapshot_name),
+                host_config=client.api.create_host_config(
+                    port_bindings={80: self.localhost_port}),
+                networking_config=client.api.create_networking_config({
+                    DOCKER_NETWORK['NETWORK_NAME']:
+                        client.api.create_endpoint_config(
+                            ipv4_address=load_balancer_address(
+                                self.config_key))
+                })
+            )
+            client.api.put_archive(name, '/etc/nginx/conf.d', archive)
+            client.api.start(name)
+        else:
+            client.api.put_archive(name, '/etc/nginx/conf.d', archive)
+            if not inspect['State']['Running']:
+                client.api.start(name)
+            else:
+                exec_id = client.api.exec_create(
+                    name, ['nginx', '-s', 'reload'])
+                client.api.exec_start(exec_id)
+                exit_code = client.api.exec_inspect(exec_id)['ExitCode']
+                if exit_code != 0:
+                    raise StepFailedError(
+                        name, 'reload', 'nginx -s reload', exit_code)
+
+        cprint.green(str.format(
+            "'{}' balances {} replicas at localhost:{}.",
+            name, len(addresses), self.localhost_port))
 
     @abstractmethod
     def create(self):
@@ -155,9 +1174,49 @@ class DeploymentComponent(ABC):
 
 
 class DeployMySQL(DeploymentComponent):
+    config_key = 'MYSQL'
+
+    def readiness_probe(self):
+        return SqlProbe('SELECT VERSION() AS mysql_ver;')
+
+    def fast_mode(self):
+        fast_mode = CONTAINERS['MYSQL'].get('FAST_MODE') or {}
+        return fast_mode if fast_mode.get('ENABLED') else None
+
+    def server_command(self):
+        """
+        Command of the image with tuned server options in fast mode, None
+        for the default one
+        """
+        fast_mode = self.fast_mode()
+        if fast_mode is None or not fast_mode.get('SERVER_OPTIONS'):
+            return None
+        command = client.api.inspect_image(
+            self.image_name)['Config'].get('Cmd') or []
+        return list(command) + [
+            str.format('--{}={}', name, value)
+            for name, value in sorted(fast_mode['SERVER_OPTIONS'].items())
+        ]
+
     def create(self):
         print('\r\nStart deploying of MySQL container.\r\n')
 
+        # default settings are kept out of the spec, so enabling the fast
+        # mode is the only change which recreates the container
+        create_kwargs, host_config_kwargs = {}, {}
+        fast_mode = self.fast_mode()
+        if fast_mode is not None:
+            cprint.orange(
+                'MySQL fast mode: data is on tmpfs and lost when the '
+                'container stops.')
+            host_config_kwargs['tmpfs'] = {
+                fast_mode['DATA_DIR']: str.format(
+                    'rw,size={}m,mode=1777', fast_mode['TMPFS_SIZE_MB'])
+            }
+            command = self.server_command()
+            if command is not None:
+                create_kwargs['command'] = command
+
         networking_config = client.api.create_networking_config({
             DOCKER_NETWORK['NETWORK_NAME']: client.api.create_endpoint_config(
                 ipv4_address=CONTAINERS['MYSQL']['NETWORK']['IPV4_ADDRESS'],
@@ -166,8 +1225,7 @@ class DeployMySQL(DeploymentComponent):
             )
         })
 
-        mysql_container = client.api.create_container(
-            name=self.container_name,
+        self.create_and_start_container(
             image=self.image_name,
             environment={
                 'MYSQL_ROOT_PASSWORD': CONTAINERS['MYSQL'][
@@ -176,24 +1234,27 @@ class DeployMySQL(DeploymentComponent):
             ports=[self.docker_port],
             host_config=client.api.create_host_config(port_bindings={
                 self.docker_port: self.localhost_port
-            }),
+            }, **host_config_kwargs),
             hostname=self.container_name,
             domainname=self.container_name,
-            networking_config=networking_config
+            networking_config=networking_config,
+            **create_kwargs
         )
-        client.api.start(mysql_container)
 
-        wait_for_mysql_starts()
-
-        for d in ('sso', 'feedback', 'feedback_default', 'demo'):
-            self.exec_cmd(
-                container_name=self.container_name,
-                cmd=str.format(
-                    'mysql -u root -e "create database if not exists {};"', d)
-            )
+    def after_ready(self):
+        execute_batch([
+            str.format('CREATE DATABASE IF NOT EXISTS {}', d)
+            for d in ('sso', 'feedback', 'feedback_default', 'demo')
+        ])
 
 
 class DeployRabbitMQ(DeploymentComponent):
+    config_key = 'RABBITMQ'
+
+    def readiness_probe(self):
+        # management plugin starts after the broker itself
+        return HttpProbe(self._container_url())
+
     def create(self):
         networking_config = client.api.create_networking_config({
             DOCKER_NETWORK['NETWORK_NAME']: client.api.create_endpoint_config(
@@ -203,8 +1264,7 @@ class DeployRabbitMQ(DeploymentComponent):
             )
         })
 
-        rabbitmq_container = client.api.create_container(
-            name=self.container_name,
+        self.create_and_start_container(
             image=self.image_name,
             environment={},
             ports=[self.docker_port],
@@ -216,7 +1276,6 @@ class DeployRabbitMQ(DeploymentComponent):
             domainname=self.container_name,
             networking_config=networking_config
         )
-        client.api.start(rabbitmq_container)
 
 
 # class DeployGraylog(DeploymentComponent):
@@ -266,6 +1325,27 @@ class DeployRabbitMQ(DeploymentComponent):
 
 
 class DeployFeedbackApi(DeploymentComponent):
+    config_key = 'FEEDBACK_API'
+    # SSO is required for access code generation, RabbitMQ - for celery
+    depends_on = ('MYSQL', 'SSO', 'RABBITMQ')
+    repository = 'feedback-api-python'
+    setup_manifests = (
+        'setup.py', 'requirements*.txt', 'feedback_api/requirements*.txt')
+    setup_artifacts = ('feedback_api/dist/env',)
+    generated_paths = (
+        'feedback_api/dist', 'feedback_api/.config',
+        'feedback_api/.sso_access_code')
+    databases = ('feedback', 'feedback_default', 'demo')
+    package_caches = ('pip',)
+    database_inputs = ('*/migrations/*.py', '*/fixtures/*')
+    # celery workers don't reload changed code on their own
+    reload_commands = (
+        "cd /feedback-api-python/feedback_api/autodeployment/;",
+        'python2.7 restart_celery.py'
+    )
+
+    def readiness_probe(self):
+        return HttpProbe(self._container_url())
 
     def _manage_access_code(self):
         cprint.green('Checking of access_code in DB...')
@@ -297,6 +1377,60 @@ class DeployFeedbackApi(DeploymentComponent):
         self.exec_cmd(
             self.container_name, 'fbapi-mgm generate_token')
 
+    def pipeline(self):
+        db_commands = [
+            "fbapi-mgm migrate contenttypes --database=demo;",
+            "fbapi-mgm migrate contenttypes --database=default;",
+            "fbapi-mgm migrate model_generic --database=default;",
+            "fbapi-mgm migrate model --database=demo;",
+            "fbapi-mgm makeunit --db=demo --unitname=local_unit;",
+            "fbapi-mgm migrate model --database=demo;"
+        ]
+
+        load_data_commands = [
+            "fbapi-mgm loaddata --app model --database demo channel;",
+            "fbapi-mgm loaddata --app model --database demo state;",
+            "fbapi-mgm loaddata --app model --database demo protocol;",
+            "fbapi-mgm loaddata --app model --database demo language;",
+            "fbapi-mgm loaddata --app model --database demo entity_lookup;",
+            "fbapi-mgm loaddata --app model --database demo deploy_initial_data;",
+            "fbapi-mgm makeconfig --db=demo;",
+            "fbapi-mgm makequesttype --db=demo;"
+        ]
+
+        venv = [
+            "cd feedback-api-python;",
+            "source feedback_api/dist/env/bin/activate;"
+        ]
+        return Pipeline([
+            # changes tracked files of the repository, so is never snapshotted
+            Step('prepare_app', [
+                "rm -rf feedback_api/.config;",
+                "python setup.py uncomment_local_config "
+                "--project=feedback_api;",
+                "python feedback_api/autodeployment/update_config_files.py;"
+            ], context=venv, inputs=(
+                'setup.py', 'feedback_api/autodeployment/*.py'),
+                concurrent=False, modifies_checkout=True),
+            Step('check', ["fbapi-mgm check;"], context=venv,
+                 requires=('prepare_app',)),
+            Step('databases', action=lambda: self.run_database_steps([
+                ('db', db_commands),
+                ('load_data', load_data_commands)
+            ]), requires=('check',), inputs=self.database_inputs),
+            Step('collectstatic', ["fbapi-mgm collectstatic --noinput;"],
+                 requires=('check',), inputs=('*/static/*',)),
+            Step('access_code', action=self._manage_access_code,
+                 requires=('databases',)),
+            Step('server_run', [
+                "fbapi-uwsgi start;",
+                "nginx;",
+                "usr/sbin/crond;",
+                "cd /feedback-api-python/feedback_api/autodeployment/;",
+                'python2.7 restart_celery.py'
+            ], requires=('databases', 'collectstatic'), scope=BOOT_SCOPE)
+        ])
+
     def create(self):
         print('Start deploying of Feedback API container.\r\n')
 
@@ -314,9 +1448,22 @@ class DeployFeedbackApi(DeploymentComponent):
 
         local_dir = GIT_REPOSITORIES['feedback-api-python']['local_dir']
 
-        feedback_container = client.api.create_container(
+        # environment setup, its result is kept in the warm snapshot
+        setup_commands = [
+            "cd feedback-api-python;",
+            "rm -rf feedback_api/dist;",
+            "cp feedback_api/autodeployment/local_nginx.conf /etc/nginx/conf.d/;",
+            "cp feedback_api/autodeployment/crontab_local /etc/crontab;",
+            "python2.7 /get-pip.py;",
+            "python3.4 setup.py venv --project=feedback_api;",
+            "pip2.7 install fabric;",
+            "source feedback_api/dist/env/bin/activate;",
+            "python setup.py develop --project=feedback_api;"
+        ]
+
+        self.create_and_start_container(
+            setup_commands=setup_commands,
             image=image_tag,
-            name=self.container_name,
             stdin_open=True, tty=True,
             ports=[self.docker_port],
             host_config=client.api.create_host_config(
@@ -343,61 +1490,65 @@ class DeployFeedbackApi(DeploymentComponent):
             networking_config=networking_config
         )
 
-        client.api.start(feedback_container)
+        self.run_setup(setup_commands)
+
+        self.run_pipeline(self.pipeline())
 
-        prepare_app_commands = [
+        # cron jobs and celery workers are run only by the primary container
+        self.deploy_replicas('server_run', [
             "cd feedback-api-python;",
-            "rm -rf feedback_api/dist;",
-            "rm -rf feedback_api/.config;",
-            "cp feedback_api/autodeployment/local_nginx.conf /etc/nginx/conf.d/;",
-            "cp feedback_api/autodeployment/crontab_local /etc/crontab;",
-            "python2.7 /get-pip.py;",
-            "python3.4 setup.py venv --project=feedback_api;",
-            "pip2.7 install fabric;",
             "source feedback_api/dist/env/bin/activate;",
-            "python setup.py develop --project=feedback_api;",
-            "python setup.py uncomment_local_config --project=feedback_api;",
-            "python feedback_api/autodeployment/update_config_files.py;",
-            "fbapi-mgm check;"
-        ]
-        self.exec_cmd(self.container_name, prepare_app_commands)
-
-        db_commands = [
-            "fbapi-mgm migrate contenttypes --database=demo;",
-            "fbapi-mgm migrate contenttypes --database=default;",
-            "fbapi-mgm migrate model_generic --database=default;",
-            "fbapi-mgm migrate model --database=demo;",
-            "fbapi-mgm makeunit --db=demo --unitname=local_unit;",
-            "fbapi-mgm migrate model --database=demo;"
-        ]
-        self.exec_cmd(self.container_name, db_commands)
-
-        load_data_commands = [
-            "fbapi-mgm loaddata --app model --database demo channel;",
-            "fbapi-mgm loaddata --app model --database demo state;",
-            "fbapi-mgm loaddata --app model --database demo protocol;",
-            "fbapi-mgm loaddata --app model --database demo language;",
-            "fbapi-mgm loaddata --app model --database demo entity_lookup;",
-            "fbapi-mgm loaddata --app model --database demo deploy_initial_data;",
-            "fbapi-mgm makeconfig --db=demo;",
-            "fbapi-mgm makequesttype --db=demo;"
-        ]
-        self.exec_cmd(self.container_name, load_data_commands)
-
-        server_run_commands = [
-            "fbapi-mgm collectstatic --noinput;",
             "fbapi-uwsgi start;",
-            "nginx;",
-            "usr/sbin/crond;",
-            "cd /feedback-api-python/feedback_api/autodeployment/;",
-            'python2.7 restart_celery.py'
-        ]
-        self.exec_cmd(self.container_name, server_run_commands)
-
-        self._manage_access_code()
+            "nginx;"
+        ])
 
 
 class DeploySSO(DeploymentComponent):
+    config_key = 'SSO'
+    depends_on = ('MYSQL',)
+    repository = 'sso'
+    setup_manifests = ('setup.py', 'requirements*.txt', 'setup*.ini')
+    setup_artifacts = ('dist/env',)
+    generated_paths = ('dist',)
+    databases = ('sso',)
+    package_caches = ('pip', 'npm', 'bower')
+    database_inputs = (
+        '*/migrations/*.py', '*/fixtures/*', 'autodeployment/*.json')
+
+    def readiness_probe(self):
+        return HttpProbe(self._container_url())
+
+    def pipeline(self):
+        db_commands = [
+            'cd sso/autodeployment;',
+            'sso-mgm migrate;',
+            'sso-mgm loaddata app_local.json;',
+            'sso-mgm loaddata app_group_local.json;',
+            'sso-mgm loaddata enterprise_local.json;',
+            "sso-mgm loaddata user_local.json;"
+        ]
+        autodeployment = ['cd sso/autodeployment;']
+        return Pipeline([
+            # changes tracked files of the repository, so is never snapshotted
+            Step('venv', ['python setup.py uncomment_local_config_files;'],
+                 context=['cd sso;', 'source dist/env/bin/activate;'],
+                 inputs=('setup.py', 'setup*.ini'), concurrent=False,
+                 modifies_checkout=True),
+            Step('check', ['sso-mgm check;'], context=autodeployment,
+                 requires=('venv',)),
+            Step('bower_install', ['sso-mgm bower_install -- --allow-root;'],
+                 context=autodeployment, requires=('venv',),
+                 inputs=('bower.json', '*/bower.json')),
+            Step('databases', action=lambda: self.run_database_steps(
+                [('db', db_commands)]), requires=('check',),
+                inputs=self.database_inputs),
+            Step('collectstatic', ['sso-mgm collectstatic --noinput;'],
+                 requires=('bower_install',), inputs=('*/static/*',)),
+            # TODO: in a case of dev environment, maybe start it
+            # TODO: with Django development server?
+            Step('server', ['sso-uwsgi start;', 'nginx'],
+                 requires=('databases', 'collectstatic'), scope=BOOT_SCOPE)
+        ])
 
     def create(self):
         print('\r\nStart deploying of SSO container.\r\n')
@@ -414,9 +1565,20 @@ class DeploySSO(DeploymentComponent):
 
         local_dir = GIT_REPOSITORIES['sso']['local_dir']
 
-        sso_container = client.api.create_container(
+        # environment setup, its result is kept in the warm snapshot
+        setup_commands = [
+            'cd sso;',
+            'cp autodeployment/sso_local_nginx.conf /etc/nginx/conf.d/;',
+            'python3.4 setup.py venv;',
+            'source dist/env/bin/activate;',
+            'python setup.py develop;',
+            'deactivate;',
+            'npm install -g bower;'
+        ]
+
+        self.create_and_start_container(
+            setup_commands=setup_commands,
             image=image_tag,
-            name=self.container_name,
             stdin_open=True, tty=True,
             ports=[self.docker_port],
             host_config=client.api.create_host_config(
@@ -441,7 +1603,6 @@ class DeploySSO(DeploymentComponent):
             networking_config=networking_config
         )
 
-        client.api.start(sso_container)
         # get object by name
         # mysql_container = client.containers.get('deployer_mysql57')
         # client.api.create_network("dev_network", driver="bridge")
@@ -450,43 +1611,32 @@ class DeploySSO(DeploymentComponent):
         #     links={'deployer_mysql57': 'mysql'}  # name: alias
         # )
 
-        venv_commands = [
-            'cd sso;',
-            'cp autodeployment/sso_local_nginx.conf /etc/nginx/conf.d/;'
-            'python3.4 setup.py venv;',
-            'source dist/env/bin/activate;',
-            'python setup.py develop;',
-            'python setup.py uncomment_local_config_files;',
-            'deactivate;'
-        ]
-        self.exec_cmd(self.container_name, venv_commands)
+        self.run_setup(setup_commands)
 
-        deploy_commands = [
-            'cd sso/autodeployment;',
-            'sso-mgm check;',
-            'sso-mgm migrate;',
-            'npm install -g bower && sso-mgm bower_install -- --allow-root;',
-            'sso-mgm loaddata app_local.json;',
-            'sso-mgm loaddata app_group_local.json;',
-            'sso-mgm loaddata enterprise_local.json;',
-            "sso-mgm loaddata user_local.json;"
-        ]
-        self.exec_cmd(self.container_name, deploy_commands)
+        self.run_pipeline(self.pipeline())
 
-        # TODO: in a case of dev environment, maybe start it
-        # TODO: with Django development server?
-        server_commands = [
-            'sso-mgm collectstatic --noinput;',
+        self.deploy_replicas('server', [
+            'cd sso;',
+            'source dist/env/bin/activate;',
             'sso-uwsgi start;',
             'nginx'
-        ]
-        self.exec_cmd(self.container_name, server_commands)
+        ])
 
 
 class DeployXircleFeebackBundle(DeploymentComponent):
-    def create(self):
-        print('Start deploying of XircleFeebackBundle container.\r\n')
+    config_key = 'XIRCL_FB_BUNDLE'
+    repository = 'feedback_ui'
+    setup_manifests = ('package.json', 'bower.json')
+    setup_artifacts = ('node_modules',)
+    package_caches = ('npm', 'bower')
+
+    def readiness_probe(self):
+        return TcpProbe(
+            CONTAINERS[self.config_key]['NETWORK']['IPV4_ADDRESS'],
+            self.docker_port
+        )
 
+    def _write_config_js(self):
         local_dir = GIT_REPOSITORIES['feedback_ui']['local_dir']
 
         xircl_fb_config = """
@@ -518,6 +1668,17 @@ window.uxMetricsEnabled = false;""".format(
         ) as config_js:
             config_js.write(xircl_fb_config)
 
+    def pipeline(self):
+        return Pipeline([
+            # config.js is tracked, so it's written again after a reset
+            Step('config_js', action=self._write_config_js,
+                 concurrent=False, modifies_checkout=True),
+            Step('server', ['npm start'], detach=True, scope=BOOT_SCOPE)
+        ])
+
+    def create(self):
+        print('Start deploying of XircleFeebackBundle container.\r\n')
+
         networking_config = client.api.create_networking_config({
             DOCKER_NETWORK['NETWORK_NAME']: client.api.create_endpoint_config(
                 ipv4_address=CONTAINERS[
@@ -530,9 +1691,13 @@ window.uxMetricsEnabled = false;""".format(
         image_tag = self.build_image_from_dockerfile(
             'xircl_fb_bundle_local_Dockerfile')
 
-        xircl_fb_container = client.api.create_container(
+        local_dir = GIT_REPOSITORIES['feedback_ui']['local_dir']
+
+        setup_commands = ['npm install && npm run bower-install']
+
+        self.create_and_start_container(
+            setup_commands=setup_commands,
             image=image_tag,
-            name=self.container_name,
             stdin_open=True, tty=True,
             ports=[self.docker_port],
             host_config=client.api.create_host_config(
@@ -549,18 +1714,18 @@ window.uxMetricsEnabled = false;""".format(
             networking_config=networking_config
         )
 
-        client.api.start(xircl_fb_container)
-
-        self.exec_cmd(
-            self.container_name,
-            'npm install && npm run bower-install'
-        )
-        self.exec_cmd(self.container_name, 'npm start', detach=True)
+        self.run_setup(setup_commands)
+        self.run_pipeline(self.pipeline())
 
 
 class DeploymentComposite(object):
     def __init__(self):
-        self.components = []  # must be a list, because ordering are important
+        # ordering is kept for the report, deployment order is defined
+        # by 'depends_on' of components
+        self.components = []
+        # change plans of components by config key, components without a
+        # plan are deployed in full
+        self.change_plans = {}
 
     def append_component(self, component):
         """ Can accept single DeployComponent or list of them """
@@ -581,14 +1746,60 @@ class DeploymentComposite(object):
     def remove_component(self, component):
         self.components.remove(component)
 
-    def execute_deployment(self):
+    def _dependencies_of(self, component):
+        """
+        Container names of the components this one depends on. Dependencies
+        which are not a part of the composite are considered as already
+        deployed.
+        """
+        by_key = {c.config_key: c for c in self.components}
+        return [
+            by_key[key].container_name for key in component.depends_on
+            if key in by_key
+        ]
+
+    def _deploy_component(self, component):
+        plan = self.change_plans.get(component.config_key)
+        with span(str.format('deploy {}', component.container_name)):
+            if plan is None or plan.full:
+                component.create()
+            else:
+                component.apply_changes(plan)
+            component.wait_until_ready()
+            component.after_ready()
+            component.inspect_after_start()
+        if plan is not None:
+            plan.record()
+
+    def execute_deployment(self, max_workers=None):
+        """
+        Deploys components concurrently: every component starts as soon as
+        all of its dependencies are deployed.
+        """
         if self.components:
+            scheduler = DependencyScheduler(max_workers=max_workers)
             for c in self.components:
-                c.create()
-                c.inspect_after_start()
-
-            report = '\r\n------------------------------------------\n'.join(
-                [c.report_string for c in self.components]
-            )
-
-            cprint.cyan(report)
\ No newline at end of file
+                scheduler.add_task(
+                    c.container_name,
+                    lambda c=c: self._deploy_component(c),
+                    depends_on=self._dependencies_of(c)
+                )
+            events.bus.start()
+            try:
+                scheduler.run()
+            finally:
+                events.bus.stop()
+                log_writer.flush()
+                self.report_trace()
+
+            # the whole stack with replicas and load balancers in one call
+            cprint.cyan(status_table(list_containers(current_stack())))
+
+    def report_trace(self):
+        """ Exports spans of the run and prints the slowest of them """
+        trace_path = tracer.export_chrome_trace(os.path.join(
+            DEPLOYER_STATE_DIR, 'traces',
+            time.strftime('trace-%Y%m%d-%H%M%S.json')))
+        cprint.purple(tracer.summary())
+        cprint.purple(str.format(
+            'Chrome trace of the deployment: {}', trace_path))
@@ -1,32 +1,32 @@
+from components.cache_volumes import ensure_cache_volumes, prune_cache_volumes
+from components.change_planner import plan_changes
 from components.deploy_components import (
     DeploymentComposite, DeployMySQL, DeploySSO, DeployFeedbackApi,
-    DeployRabbitMQ, DeployXircleFeebackBundle, prepare_images, prepare_network
+    DeployRabbitMQ, DeployXircleFeebackBundle, client, prepare_images,
+    prepare_network
 )
-from helpers.git_operations import clone_repositories
+from components.scheduler import DependencyScheduler
+from helpers.git_operations import sync_repositories
 from helpers.color_print import ColorPrint
+from helpers.tracing import tracer
 cprint = ColorPrint()
 try:
-    from config import CONTAINERS
+    from config import CHANGE_PLANNER, CONTAINERS
 except ImportError:
     cprint.red(
         "Settings will be taken from default config but it's strongly "
         "recommended to create your own config.py, based on it!")
-    from config_default import CONTAINERS
+    from config_default import CHANGE_PLANNER, CONTAINERS
 
 
-def run_deployment():
-
-    prepare_network()
-    prepare_images()
-    clone_repositories()
-
-    deployment_composite = DeploymentComposite()
-
+def default_components(**component_options):
+    """ Components of the local environment """
     mysql_dep = DeployMySQL(
         container_name=CONTAINERS['MYSQL']['CONTAINER_NAME'],
         image_name=CONTAINERS['MYSQL']['IMAGE_NAME'],
         docker_port=CONTAINERS['MYSQL']['DOCKER_PORT'],
-        localhost_port=CONTAINERS['MYSQL']['LOCAL_PORT']
+        localhost_port=CONTAINERS['MYSQL']['LOCAL_PORT'],
+        **component_options
     )
 
     rabbitmq_dep = DeployRabbitMQ(
@@ -34,27 +34,31 @@ def run_deployment():
         image_name=CONTAINERS['RABBITMQ']['IMAGE_NAME'],
         docker_port=CONTAINERS['RABBITMQ']['DOCKER_PORT'],
         localhost_port=CONTAINERS['RABBITMQ']['LOCAL_PORT'],
+        **component_options
     )
 
     sso_dep = DeploySSO(
         container_name=CONTAINERS['SSO']['CONTAINER_NAME'],
         image_name='sso',  # custom
         docker_port=CONTAINERS['SSO']['DOCKER_PORT'],
-        localhost_port=CONTAINERS['SSO']['LOCAL_PORT']
+        localhost_port=CONTAINERS['SSO']['LOCAL_PORT'],
+        **component_options
     )
 
     feedback_dep = DeployFeedbackApi(
         container_name=CONTAINERS['FEEDBACK_API']['CONTAINER_NAME'],
         image_name='feedback',  # custom
         docker_port=CONTAINERS['FEEDBACK_API']['DOCKER_PORT'],
-        localhost_port=CONTAINERS['FEEDBACK_API']['LOCAL_PORT']
+        localhost_port=CONTAINERS['FEEDBACK_API']['LOCAL_PORT'],
+        **component_options
     )
 
     xircle_feedback_bundle_dep = DeployXircleFeebackBundle(
         container_name=CONTAINERS['XIRCL_FB_BUNDLE']['CONTAINER_NAME'],
         image_name=CONTAINERS['XIRCL_FB_BUNDLE']['IMAGE_NAME'],
         docker_port=CONTAINERS['XIRCL_FB_BUNDLE']['DOCKER_PORT'],
-        localhost_port=CONTAINERS['XIRCL_FB_BUNDLE']['LOCAL_PORT']
+        localhost_port=CONTAINERS['XIRCL_FB_BUNDLE']['LOCAL_PORT'],
+        **component_options
     )
 
     # graylog_dep = DeployGraylog(
@@ -64,12 +68,105 @@ def run_deployment():
     #     localhost_port=9000,
     # )
 
-    deployment_composite.append_component([
+    return [
         mysql_dep,
         rabbitmq_dep,
         sso_dep,
         feedback_dep,
         xircle_feedback_bundle_dep
-    ])
+    ]
+
+
+def select_components(components, config_keys, with_dependencies=True):
+    """ Components with the given config keys and the ones they depend on """
+    by_key = {c.config_key: c for c in components}
+    selected = set()
+    pending = list(config_keys)
+    while pending:
+        key = pending.pop()
+        if key in selected or key not in by_key:
+            continue
+        selected.add(key)
+        if with_dependencies:
+            pending.extend(by_key[key].depends_on)
+    return [c for c in components if c.config_key in selected]
+
+
+def run_deployment(
+        check_remote=None, rebuild=False, refresh_base=False,
+        recreate=False, components=default_components, only=None,
+        with_dependencies=True):
+    """
+    'components' is a callable which accepts component options and returns
+    the list of components to deploy. 'only' limits them to the given
+    config keys (with dependencies unless 'with_dependencies' is False),
+    images and repositories of other components are not touched.
+    Components whose running containers are up to date except changed
+    files of repositories get only the affected steps, see CHANGE_PLANNER.
+    """
+    selected = components(
+        rebuild=rebuild, refresh_base=refresh_base, recreate=recreate)
+    repositories = None
+    if only is not None:
+        selected = select_components(selected, only, with_dependencies)
+        repositories = [c.repository for c in selected if c.repository]
+
+    tracer.reset()
+    sync_repositories(repositories)
+
+    plans = {}
+    if CHANGE_PLANNER.get('ENABLED', True):
+        plans = plan_changes(selected, force=bool(
+            check_remote or rebuild or refresh_base or recreate))
+        for c in selected:
+            cprint.blue(str.format(
+                '{}: {}', c.container_name, plans[c.config_key].describe()))
 
+    full = [
+        c.config_key for c in selected
+        if c.config_key not in plans or plans[c.config_key].full
+    ]
+    if full:
+        prepare_network()
+        prepare_images(check_remote=check_remote, config_keys=full)
+        ensure_cache_volumes(client)
+
+    deployment_composite = DeploymentComposite()
+    deployment_composite.append_component(selected)
+    deployment_composite.change_plans = plans
     deployment_composite.execute_deployment()
+
+
+def deployment_plan(
+        only=None, with_dependencies=True, components=default_components):
+    """
+    Stages of the deployment: lists of components which are deployed
+    concurrently once the previous stages are done.
+    """
+    selected = components()
+    if only is not None:
+        selected = select_components(selected, only, with_dependencies)
+
+    composite = DeploymentComposite()
+    composite.append_component(selected)
+    scheduler = DependencyScheduler()
+    by_name = {}
+    for c in selected:
+        by_name[c.container_name] = c
+        scheduler.add_task(
+            c.container_name, None,
+            depends_on=composite._dependencies_of(c))
+    return [[by_name[name] for name in stage] for stage in scheduler.stages()]
+
+
+def change_plans(
+        only=None, with_dependencies=True, components=default_components):
+    """ Change plans of components against the current checkouts """
+    selected = components()
+    if only is not None:
+        selected = select_components(selected, only, with_dependencies)
+    return plan_changes(selected)
+
+
+def prune_caches(max_size_mb=None):
+    prune_cache_volumes(client, max_size_mb=max_size_mb)
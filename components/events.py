@@ -0,0 +1,232 @@
+"""
+Bus of Docker events of the deployer containers in the current stack. One
+background subscription to the Engine events stream publishes start, die,
+oom and health_status events: waits wake up on them instead of sleeping
+out their intervals, and a deployment is aborted as soon as its container
+or a container it depends on dies.
+"""
+import collections
+import threading
+import time
+from concurrent.futures import CancelledError
+from components import async_engine, labels
+from config import EVENTS
+
+ACTIONS = ('start', 'die', 'oom', 'health_status')
+DEATH_ACTIONS = ('die', 'oom')
+
+
+class ContainerEvent(object):
+    """ Container event of the Engine, e.g. 'die' with 'exitCode' """
+
+    def __init__(self, action, container_id, name, attributes=None,
+                 timestamp=None):
+        self.action = action
+        self.container_id = container_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.timestamp = timestamp or time.time()
+
+    @classmethod
+    def from_message(cls, message):
+        # health events are reported as 'health_status: healthy'
+        action, _, health = (
+            message.get('Action') or message.get('status') or '').partition(
+            ':')
+        actor = message.get('Actor') or {}
+        attributes = dict(actor.get('Attributes') or {})
+        if health:
+            attributes['health'] = health.strip()
+        return cls(
+            action.strip(),
+            actor.get('ID') or message.get('id'),
+            attributes.get('name', '').lstrip('/'),
+            attributes,
+            message.get('timeNano', 0) / 1e9 or message.get('time'))
+
+    def __str__(self):
+        if self.action == 'oom':
+            return str.format("'{}' ran out of memory", self.name)
+        if self.action == 'die':
+            return str.format(
+                "'{}' died with exit code {}", self.name,
+                self.attributes.get('exitCode', 'unknown'))
+        if self.action == 'health_status':
+            return str.format(
+                "'{}' is {}", self.name, self.attributes.get('health'))
+        return str.format("'{}' {}", self.name, self.action)
+
+
+class ContainerDiedError(Exception):
+    def __init__(self, event):
+        self.event = event
+        super(ContainerDiedError, self).__init__(
+            str.format('Deployment aborted: {}.', event))
+
+
+class EventBus(object):
+    """
+    Keeps recent events and containers which died (by id, so a container
+    recreated under the same name is not confused with the old one) and
+    calls subscribers from the thread reading the stream.
+    """
+
+    def __init__(self, history=1000):
+        self._condition = threading.Condition()
+        self._events = collections.deque(maxlen=history)
+        self._sequence = 0
+        self._subscribers = []
+        self._dead = {}
+        self._running = False
+        self._future = None
+        self._stream = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def filters(self):
+        return {
+            'type': ['container'],
+            'event': list(ACTIONS),
+            'label': [
+                str.format('{}={}', labels.OWNER_LABEL, labels.OWNER),
+                str.format(
+                    '{}={}', labels.STACK_LABEL, labels.current_stack())
+            ]
+        }
+
+    def start(self):
+        """
+        Subscribes to the events stream, the ones since this moment are
+        published even if the subscription takes a while
+        """
+        if self._running or not EVENTS.get('ENABLED', True):
+            return self
+        self._running = True
+        since = int(time.time())
+        if async_engine.enabled():
+            self._future = async_engine.submit(self._read(since))
+        else:
+            threading.Thread(
+                target=self._read_docker_py, args=(since,),
+                name='docker-events', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        with self._condition:
+            self._condition.notify_all()
+
+    async def _read(self, since):
+        engine = async_engine.engine()
+        async for message in engine.events(
+                filters=self.filters(), since=since):
+            self.publish(ContainerEvent.from_message(message))
+
+    def _read_docker_py(self, since):
+        from helpers.docker_client import LazyDockerClient
+        self._stream = LazyDockerClient().api.events(
+            since=since, filters=self.filters(), decode=True)
+        try:
+            for message in self._stream:
+                self.publish(ContainerEvent.from_message(message))
+        except Exception:
+            if self._running:
+                raise
+
+    def publish(self, event):
+        with self._condition:
+            self._sequence += 1
+            self._events.append((self._sequence, event))
+            if event.action in DEATH_ACTIONS:
+                # 'oom' is followed by 'die', the first cause is kept
+                self._dead.setdefault(event.container_id, event)
+            elif event.action == 'start':
+                self._dead.pop(event.container_id, None)
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+        for callback in subscribers:
+            callback(event)
+
+    def subscribe(self, callback):
+        with self._condition:
+            self._subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._condition:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _died(self, container_ids):
+        with self._condition:
+            for container_id in container_ids:
+                if container_id in self._dead:
+                    return self._dead[container_id]
+        return None
+
+    def check(self, container_ids):
+        """ Raises ContainerDiedError if any of the containers died """
+        event = self._died(container_ids)
+        if event is not None:
+            raise ContainerDiedError(event)
+
+    def wait(self, container_ids, timeout):
+        """
+        Waits up to 'timeout' seconds for the next event of any of the
+        containers and returns it, None on timeout. Without subscription
+        it just sleeps.
+        """
+        if not self._running:
+            time.sleep(timeout)
+            return None
+
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            seen = self._sequence
+            while self._running:
+                for sequence, event in self._events:
+                    if sequence > seen and \
+                            event.container_id in container_ids:
+                        return event
+                seen = self._sequence
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+        return None
+
+    def result(self, future, container_ids):
+        """
+        Result of the future (e.g. of an exec stream), which is cancelled
+        and ContainerDiedError raised once any of the containers dies
+        """
+        def on_event(event):
+            if event.action in DEATH_ACTIONS and \
+                    event.container_id in container_ids:
+                future.cancel()
+
+        self.subscribe(on_event)
+        try:
+            died = self._died(container_ids)
+            if died is None:
+                try:
+                    return future.result()
+                except CancelledError:
+                    died = self._died(container_ids)
+                    if died is None:
+                        raise
+            future.cancel()
+            raise ContainerDiedError(died)
+        finally:
+            self.unsubscribe(on_event)
+
+
+bus = EventBus()
@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+
+
+class StepFailedError(Exception):
+    def __init__(self, container_name, step_name, cmd, exit_code,
+                 output=None):
+        self.container_name = container_name
+        self.step_name = step_name
+        self.cmd = cmd
+        self.exit_code = exit_code
+        # last lines of the step output
+        self.output = output or []
+        message = str.format(
+            "Step '{}' in '{}' failed with exit code {}: {}",
+            step_name, container_name, exit_code, cmd)
+        if self.output:
+            message += '\nLast output:\n' + '\n'.join(self.output)
+        super(StepFailedError, self).__init__(message)
+
+
+class StepJournal(object):
+    """
+    Persisted results of steps executed in a container. The journal is
+    bound to a container id: when the container is recreated all records
+    are dropped. Records of per-boot steps (starting of servers) are valid
+    only until the container is restarted.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.container_id = None
+        self.started_at = None
+        self.steps = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, mode='r') as journal_file:
+                data = json.load(journal_file)
+        except (IOError, ValueError):
+            return
+        self.container_id = data.get('container_id')
+        self.started_at = data.get('started_at')
+        self.steps = data.get('steps', {})
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, mode='w') as journal_file:
+            json.dump({
+                'container_id': self.container_id,
+                'started_at': self.started_at,
+                'steps': self.steps
+            }, journal_file, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def bind(self, container_id, started_at):
+        with self._lock:
+            if container_id != self.container_id:
+                self.steps = {}
+            self.container_id = container_id
+            self.started_at = started_at
+            self._save()
+
+    def reset(self):
+        with self._lock:
+            self.steps = {}
+            self._save()
+
+    def is_done(self, key, cache_key=None):
+        """
+        Step succeeded (or was started, if detached) in this container,
+        with the same cache key if it's given
+        """
+        with self._lock:
+            record = self.steps.get(key)
+            if not record or record['status'] not in ('succeeded', 'started'):
+                return False
+            if cache_key is not None and record.get('cache_key') != cache_key:
+                return False
+            return record['boot'] is None or record['boot'] == self.started_at
+
+    def record(self, key, name, cmd, status, exit_code=None, duration=None,
+               per_boot=False, cache_key=None):
+        with self._lock:
+            self.steps[key] = {
+                'name': name,
+                'cmd': cmd,
+                'status': status,
+                'exit_code': exit_code,
+                'duration': duration,
+                'finished_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'boot': self.started_at if per_boot else None,
+                'cache_key': cache_key
+            }
+            self._save()
@@ -0,0 +1,47 @@
+# Labels written by the deployer to Docker objects it creates.
+import hashlib
+import json
+
+LABEL_PREFIX = 'deployer'
+
+# marks containers, networks, images and volumes owned by the deployer
+OWNER_LABEL = LABEL_PREFIX + '.owner'
+OWNER = 'docker_components'
+
+# id of the stack (isolated environment) the object belongs to
+STACK_LABEL = LABEL_PREFIX + '.stack'
+DEFAULT_STACK = 'default'
+
+_current_stack = {'id': DEFAULT_STACK}
+
+# hash of Dockerfile content and build inputs of an image
+BUILD_HASH_LABEL = LABEL_PREFIX + '.build_hash'
+
+# hash of the desired state of a container or a network
+SPEC_HASH_LABEL = LABEL_PREFIX + '.spec_hash'
+
+
+def spec_hash(spec):
+    """ Stable hash of a JSON-serializable specification """
+    return hashlib.sha256(
+        json.dumps(spec, sort_keys=True, default=str).encode('utf-8')
+    ).hexdigest()
+
+
+def set_stack(stack_id):
+    _current_stack['id'] = stack_id
+
+
+def current_stack():
+    return _current_stack['id']
+
+
+def owner_labels(**labels):
+    """
+    Owner and stack labels plus additional deployer labels (without
+    prefix)
+    """
+    result = {OWNER_LABEL: OWNER, STACK_LABEL: current_stack()}
+    for name, value in labels.items():
+        result[str.format('{}.{}', LABEL_PREFIX, name)] = str(value)
+    return result
@@ -1,48 +1,150 @@
-import datetime
-from time import sleep
-import MySQLdb
+import queue
+import threading
+from contextlib import contextmanager
 from helpers.color_print import ColorPrint
 from config import CONTAINERS
 
 cprint = ColorPrint()
 
 
+def _mysqldb():
+    """ Imported on first use, commands which run no SQL don't need it """
+    import MySQLdb
+    import MySQLdb.cursors
+    return MySQLdb
+
+
 def get_mysql_connection():
-    conn = MySQLdb.connect(
+    from MySQLdb.constants import CLIENT
+    conn = _mysqldb().connect(
         host=CONTAINERS['MYSQL']['NETWORK']['IPV4_ADDRESS'],
         user='root',
         passwd=CONTAINERS['MYSQL']['MYSQL_ROOT_PASSWORD'],
-        port=CONTAINERS['MYSQL']['DOCKER_PORT']
+        port=CONTAINERS['MYSQL']['DOCKER_PORT'],
+        client_flag=CLIENT.MULTI_STATEMENTS
     )
     conn.autocommit(True)
 
     return conn
 
 
-def raw_sql(sql):
-    _conn = get_mysql_connection()
-    try:
-        cur = _conn.cursor(MySQLdb.cursors.DictCursor)
-        cur.execute(sql)
-        res = cur.fetchall()  # tuple of dicts
-        return res
-    finally:
-        _conn.close()
-
-
-def wait_for_mysql_starts():
-    wait_timeout = datetime.datetime.now() + datetime.timedelta(
-        seconds=CONTAINERS['MYSQL']['WAIT_FOR_START_TIMEOUT'])
-    cprint.orange('Waiting for MySQL server starts...')
-    while True:
-        if datetime.datetime.now() >= wait_timeout:
-            cprint.red('Wait timeout expired. MySQL server does not respond!')
-            break
+class MySQLConnectionPool(object):
+    """
+    Keeps up to 'size' open connections for reuse. Idle connections are
+    pinged before they are handed out and broken ones are replaced.
+    """
+
+    def __init__(self, size=4, connect=get_mysql_connection):
+        self.size = size
+        self.connect = connect
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _is_healthy(self, conn):
+        try:
+            conn.ping()
+            return True
+        except _mysqldb().Error:
+            return False
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except _mysqldb().Error:
+            pass
+
+    def acquire(self, timeout=None):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self.connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                conn = self._idle.get(timeout=timeout)
+
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
         try:
-            result = raw_sql("SELECT VERSION() AS mysql_ver;")
-            cprint.green(
-                str.format('MySQL {} is running.', result[0]['mysql_ver']))
-            break
+            yield conn
+        except _mysqldb().Error:
+            self.release(conn, broken=True)
+            raise
         except Exception:
-            sleep(1)
-            cprint.yellow('Waiting...')
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close_all(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MySQLConnectionPool(
+                size=CONTAINERS['MYSQL'].get('POOL_SIZE', 4))
+        return _pool
+
+
+def raw_sql(sql, args=None):
+    with get_pool().connection() as conn:
+        cur = conn.cursor(_mysqldb().cursors.DictCursor)
+        try:
+            cur.execute(sql, args)
+            res = cur.fetchall()  # tuple of dicts
+            return res
+        finally:
+            cur.close()
+
+
+def execute_batch(statements):
+    """
+    Executes several statements in one round trip and returns a list
+    with results of every statement.
+    """
+    sql = ';\n'.join(s.strip().rstrip(';') for s in statements) + ';'
+    results = []
+    with get_pool().connection() as conn:
+        cur = conn.cursor(_mysqldb().cursors.DictCursor)
+        try:
+            cur.execute(sql)
+            while True:
+                results.append(cur.fetchall())
+                if not cur.nextset():
+                    break
+            return results
+        finally:
+            cur.close()
@@ -0,0 +1,129 @@
+import socket
+import time
+from abc import ABC, abstractmethod
+from components.mysql_components import raw_sql
+
+
+class ProbeTimeoutError(Exception):
+    pass
+
+
+class Probe(ABC):
+    """ Readiness check. 'check' raises an exception if not ready. """
+
+    @abstractmethod
+    def check(self):
+        pass
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class TcpProbe(Probe):
+    """ Ready when a TCP connection can be established """
+
+    def __init__(self, host, port, connect_timeout=1):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+
+    def check(self):
+        socket.create_connection(
+            (self.host, self.port), timeout=self.connect_timeout).close()
+
+    def __str__(self):
+        return str.format('tcp://{}:{}', self.host, self.port)
+
+
+class HttpProbe(Probe):
+    """
+    Ready when the URL responds with a status lower than 'max_status'.
+    By default any response except server errors is accepted (502 from
+    nginx means that the application server is not started yet).
+    """
+
+    def __init__(self, url, max_status=500, request_timeout=2):
+        self.url = url
+        self.max_status = max_status
+        self.request_timeout = request_timeout
+
+    def check(self):
+        import requests
+        response = requests.get(
+            self.url, timeout=self.request_timeout, allow_redirects=False)
+        if response.status_code >= self.max_status:
+            raise IOError(str.format(
+                '{} responded with {}', self.url, response.status_code))
+
+    def __str__(self):
+        return self.url
+
+
+class SqlProbe(Probe):
+    """ Ready when the SQL query is executed without errors """
+
+    def __init__(self, sql='SELECT 1;'):
+        self.sql = sql
+
+    def check(self):
+        raw_sql(self.sql)
+
+    def __str__(self):
+        return str.format('sql: {}', self.sql)
+
+
+class ExecProbe(Probe):
+    """ Ready when the command exits with 0 inside the container """
+
+    def __init__(self, client, container_name, cmd):
+        self.client = client
+        self.container_name = container_name
+        self.cmd = cmd
+
+    def check(self):
+        exec_id = self.client.api.exec_create(
+            self.container_name, cmd=self.cmd, stdout=False, stderr=False)
+        self.client.api.exec_start(exec_id)
+        exit_code = self.client.api.exec_inspect(exec_id)['ExitCode']
+        if exit_code != 0:
+            raise IOError(str.format(
+                "'{}' exited with {}", self.cmd, exit_code))
+
+    def __str__(self):
+        return str.format('exec in {}: {}', self.container_name, self.cmd)
+
+
+def wait_until_ready(
+        probe, timeout, initial_interval=0.1, max_interval=2, backoff=1.5,
+        events=None, watched=()):
+    """
+    Runs the probe until it succeeds. Interval between tries starts short
+    and grows up to 'max_interval'. Raises ProbeTimeoutError on timeout.
+    With an event bus the next try is made as soon as any of 'watched'
+    container ids gets an event, and ContainerDiedError is raised once any
+    of them dies.
+    """
+    deadline = time.monotonic() + timeout
+    interval = initial_interval
+    while True:
+        try:
+            probe.check()
+            return
+        except Exception as e:
+            last_error = e
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ProbeTimeoutError(str.format(
+                '{} is not ready after {} seconds: {}',
+                probe, timeout, last_error))
+
+        if events is None:
+            time.sleep(min(interval, remaining))
+        else:
+            events.check(watched)
+            if events.wait(watched, min(interval, remaining)) is not None:
+                events.check(watched)
+                interval = initial_interval
+                continue
+        interval = min(interval * backoff, max_interval)
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class DependencyError(Exception):
+    pass
+
+
+class DependencyScheduler(object):
+    """
+    Runs named tasks on a worker pool. Every task starts as soon as all
+    tasks it depends on are finished, so independent branches of the graph
+    are executed at the same time.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.tasks = {}  # name -> (callable, tuple of dependency names)
+
+    def add_task(self, name, func, depends_on=()):
+        if name in self.tasks:
+            raise DependencyError(
+                str.format("Task '{}' is already registered.", name))
+        self.tasks[name] = (func, tuple(depends_on))
+
+    def validate(self):
+        """ Checks that all dependencies are known and there are no cycles """
+        for name, (_, deps) in self.tasks.items():
+            for d in deps:
+                if d not in self.tasks:
+                    raise DependencyError(str.format(
+                        "Task '{}' depends on unknown task '{}'.", name, d))
+
+        visited, in_progress = set(), set()
+
+        def visit(name, path):
+            if name in visited:
+                return
+            if name in in_progress:
+                raise DependencyError(str.format(
+                    'Dependency cycle detected: {}',
+                    ' -> '.join(path + [name])))
+            in_progress.add(name)
+            for d in self.tasks[name][1]:
+                visit(d, path + [name])
+            in_progress.remove(name)
+            visited.add(name)
+
+        for name in self.tasks:
+            visit(name, [])
+
+    def stages(self):
+        """
+        Task names grouped in the order of execution: tasks of a stage
+        depend only on tasks of the previous stages.
+        """
+        self.validate()
+
+        stages, done = [], set()
+        pending = list(self.tasks)
+        while pending:
+            stage = [
+                name for name in pending
+                if all(d in done for d in self.tasks[name][1])
+            ]
+            stages.append(stage)
+            done.update(stage)
+            pending = [name for name in pending if name not in done]
+        return stages
+
+    def run(self):
+        """
+        Executes all tasks and returns a dict of their results. The first
+        failed task stops scheduling of new tasks; tasks that are already
+        running are awaited and then the error is re-raised.
+        """
+        self.validate()
+
+        results = {}
+        pending = dict(self.tasks)  # insertion order is the tie-breaker
+        running = {}
+        error = None
+        workers = self.max_workers or max(len(self.tasks), 1)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                if error is None:
+                    for name, (func, deps) in list(pending.items()):
+                        if all(d in results for d in deps):
+                            running[executor.submit(func)] = name
+                            del pending[name]
+
+                if not running:
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+
+        if error is not None:
+            raise error
+
+        return results
@@ -0,0 +1,254 @@
+import fcntl
+import ipaddress
+import json
+import os
+import re
+import socket
+import sys
+import time
+from contextlib import contextmanager
+import config
+from components import labels
+from helpers.color_print import ColorPrint
+from helpers.docker_client import LazyDockerClient
+from config import (
+    CONTAINERS, DOCKER_NETWORK, GIT_REPOSITORIES, LOGS, STACKS
+)
+
+client = LazyDockerClient()
+cprint = ColorPrint()
+
+STACK_ID_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,31}$')
+
+# modules which copy string settings on import, the stack must be applied
+# before any of them is imported
+SETTINGS_CONSUMERS = (
+    'components.deploy_components', 'components.build_context',
+    'components.db_snapshots', 'components.change_planner'
+)
+
+
+class StackAllocationError(Exception):
+    pass
+
+
+def _rebase(path, old_root, new_root):
+    """ Moves the path from under 'old_root' to 'new_root' """
+    if os.path.commonpath([path, old_root]) == old_root:
+        return os.path.join(new_root, os.path.relpath(path, old_root))
+    return os.path.join(new_root, os.path.basename(path))
+
+
+def _shift_address(address, old_network, new_network):
+    offset = int(ipaddress.ip_address(address)) - int(
+        old_network.network_address)
+    return str(new_network.network_address + offset)
+
+
+class StackInstance(object):
+    """
+    Isolated copy of the environment derived from the stack id and its
+    index in the registry: containers and the network are prefixed with
+    the id, the subnet is the index-th one after the configured subnet,
+    host ports are shifted by index * PORT_STEP and all files live in the
+    own deployment dir. Index 0 is the default (unprefixed) stack.
+    """
+
+    def __init__(self, stack_id, index):
+        self.stack_id = stack_id
+        self.index = index
+        # settings of the default stack everything is derived from
+        self.base_network = ipaddress.ip_network(DOCKER_NETWORK['SUBNET'])
+        self.base_ports = [s['LOCAL_PORT'] for s in CONTAINERS.values()]
+        self.network = ipaddress.ip_network(str.format(
+            '{}/{}',
+            self.base_network.network_address +
+            index * self.base_network.num_addresses,
+            self.base_network.prefixlen))
+
+    @property
+    def prefix(self):
+        return str.format('{}_', self.stack_id)
+
+    @property
+    def port_offset(self):
+        return self.index * STACKS['PORT_STEP']
+
+    @property
+    def home_dir(self):
+        return os.path.join(STACKS['HOME_DIR'], self.stack_id)
+
+    def local_ports(self):
+        return [port + self.port_offset for port in self.base_ports]
+
+    def apply(self):
+        """ Rewrites settings of the config module for this stack """
+        if labels.current_stack() != labels.DEFAULT_STACK:
+            raise RuntimeError(str.format(
+                "Stack '{}' is already active", labels.current_stack()))
+        loaded = [m for m in SETTINGS_CONSUMERS if m in sys.modules]
+        if loaded:
+            raise RuntimeError(str.format(
+                'Stack must be activated before import of {}',
+                ', '.join(loaded)))
+
+        old_home = config.HOME_DEPLOYMENT_DIR
+        old_network = self.base_network
+        new_network = self.network
+
+        config.HOME_DEPLOYMENT_DIR = self.home_dir
+        config.DEPLOYER_STATE_DIR = _rebase(
+            config.DEPLOYER_STATE_DIR, old_home, self.home_dir)
+        LOGS['DIR'] = _rebase(LOGS['DIR'], old_home, self.home_dir)
+
+        for settings in GIT_REPOSITORIES.values():
+            settings['local_dir'] = _rebase(
+                settings['local_dir'], old_home, self.home_dir)
+
+        DOCKER_NETWORK['NETWORK_NAME'] = \
+            self.prefix + DOCKER_NETWORK['NETWORK_NAME']
+        DOCKER_NETWORK['SUBNET'] = str(new_network)
+        DOCKER_NETWORK['GATEWAY'] = _shift_address(
+            DOCKER_NETWORK['GATEWAY'], old_network, new_network)
+
+        for settings in CONTAINERS.values():
+            settings['CONTAINER_NAME'] = \
+                self.prefix + settings['CONTAINER_NAME']
+            settings['LOCAL_PORT'] += self.port_offset
+            settings['NETWORK']['IPV4_ADDRESS'] = _shift_address(
+                settings['NETWORK']['IPV4_ADDRESS'], old_network,
+                new_network)
+
+        labels.set_stack(self.stack_id)
+
+    def __str__(self):
+        return str.format(
+            "stack '{}': network {} ({}), host ports +{}, dir {}",
+            self.stack_id, DOCKER_NETWORK['NETWORK_NAME'], self.network,
+            self.port_offset, self.home_dir)
+
+
+@contextmanager
+def _locked_registry():
+    """ Registry of allocated stacks, locked for the whole host """
+    path = STACKS['REGISTRY']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.lock', mode='w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(path, mode='r') as f:
+                    registry = json.load(f)
+            except (IOError, ValueError):
+                registry = {}
+
+            yield registry
+
+            tmp_path = path + '.tmp'
+            with open(tmp_path, mode='w') as f:
+                json.dump(registry, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _docker_subnets():
+    subnets = []
+    for network in client.api.networks():
+        for pool in (network.get('IPAM') or {}).get('Config') or []:
+            if pool.get('Subnet'):
+                subnets.append(ipaddress.ip_network(pool['Subnet']))
+    return subnets
+
+
+def _docker_ports():
+    ports = set()
+    for container in client.api.containers(all=True):
+        for port in container.get('Ports') or []:
+            if port.get('PublicPort'):
+                ports.add(port['PublicPort'])
+    return ports
+
+
+def _port_is_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('0.0.0.0', port))
+        except OSError:
+            return False
+    return True
+
+
+def _is_available(stack, subnets, ports):
+    if any(stack.network.overlaps(subnet) for subnet in subnets):
+        return False
+    return all(
+        port not in ports and _port_is_free(port)
+        for port in stack.local_ports())
+
+
+def allocate_stack(stack_id):
+    """
+    Returns the stack, allocating the first index whose subnet and host
+    ports collide neither with Docker networks and containers nor with
+    other stacks. A known stack keeps its index.
+    """
+    if not STACK_ID_PATTERN.match(stack_id):
+        raise ValueError(str.format(
+            "Invalid stack id '{}', lowercase letters, digits, '-' and '_' "
+            "are allowed.", stack_id))
+
+    with _locked_registry() as registry:
+        if stack_id in registry:
+            return StackInstance(stack_id, registry[stack_id]['index'])
+
+        used = {entry['index'] for entry in registry.values()}
+        subnets = _docker_subnets()
+        ports = _docker_ports()
+        for index in range(1, STACKS['MAX_STACKS'] + 1):
+            if index in used:
+                continue
+            stack = StackInstance(stack_id, index)
+            if _is_available(stack, subnets, ports):
+                registry[stack_id] = {
+                    'index': index,
+                    'subnet': str(stack.network),
+                    'port_offset': stack.port_offset,
+                    'created': time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+                return stack
+
+    raise StackAllocationError(str.format(
+        "No free subnet and ports for stack '{}' among {} stacks.",
+        stack_id, STACKS['MAX_STACKS']))
+
+
+def find_stack(stack_id):
+    """ Allocated stack, None if it's not known """
+    with _locked_registry() as registry:
+        if stack_id in registry:
+            return StackInstance(stack_id, registry[stack_id]['index'])
+    return None
+
+
+def activate_stack(stack_id):
+    """ Allocates the stack and applies it to the settings of this run """
+    stack = allocate_stack(stack_id)
+    stack.apply()
+    cprint.blue(str.format('Deploying {}', stack))
+    return stack
+
+
+def logs_dir(stack_id):
+    """ Directory of deployment logs of the stack, it may be not active """
+    if stack_id == labels.DEFAULT_STACK:
+        return LOGS['DIR']
+    return _rebase(
+        LOGS['DIR'], config.HOME_DEPLOYMENT_DIR,
+        StackInstance(stack_id, 0).home_dir)
+
+
+def release_stack(stack_id):
+    with _locked_registry() as registry:
+        registry.pop(stack_id, None)
@@ -0,0 +1,253 @@
+"""
+State of deployer containers from a single filtered list call and their
+resource usage from concurrently streamed stats. Docker-py is used only if
+the Engine isn't reachable by the unix socket.
+"""
+import sys
+import threading
+import time
+from components import async_engine, labels
+
+STATUS_COLUMNS = (
+    'NAME', 'COMPONENT', 'STATE', 'HEALTH', 'UPTIME', 'IP', 'PORTS')
+STATS_COLUMNS = (
+    'NAME', 'CPU %', 'MEM USAGE / LIMIT', 'MEM %', 'NET I/O', 'BLOCK I/O')
+
+HEALTH_STATES = (
+    ('(health: starting)', 'starting'),
+    ('(unhealthy)', 'unhealthy'),
+    ('(healthy)', 'healthy')
+)
+
+
+def _docker_api():
+    from helpers.docker_client import LazyDockerClient
+    return LazyDockerClient().api
+
+
+def list_containers(stack=None, **label_values):
+    """
+    All containers owned by the deployer in one call, only the ones of
+    the stack if it's given and with deployer labels (without prefix)
+    from 'label_values'
+    """
+    filters = {'label': [
+        str.format('{}={}', labels.OWNER_LABEL, labels.OWNER)]}
+    if stack is not None:
+        filters['label'].append(
+            str.format('{}={}', labels.STACK_LABEL, stack))
+    for name, value in sorted(label_values.items()):
+        filters['label'].append(str.format(
+            '{}.{}={}', labels.LABEL_PREFIX, name, value))
+
+    if async_engine.enabled():
+        return async_engine.run(async_engine.engine().containers(
+            all=True, filters=filters))
+    return _docker_api().containers(all=True, filters=filters)
+
+
+def container_name(container):
+    return container['Names'][0].lstrip('/')
+
+
+def _label(container, name):
+    return (container.get('Labels') or {}).get(
+        str.format('{}.{}', labels.LABEL_PREFIX, name))
+
+
+def _component(container):
+    component = (_label(container, 'component') or '-').lower()
+    if _label(container, 'load_balancer_of'):
+        return component + ' (lb)'
+    if _label(container, 'replica'):
+        return str.format('{} #{}', component, _label(container, 'replica'))
+    return component
+
+
+def _health(status):
+    for marker, health in HEALTH_STATES:
+        if marker in status:
+            return health
+    return '-'
+
+
+def _uptime(status):
+    if not status.startswith('Up '):
+        return '-'
+    for marker, _ in HEALTH_STATES:
+        status = status.replace(marker, '')
+    return status[len('Up '):].strip()
+
+
+def _ports(container):
+    ports = []
+    for p in sorted(container.get('Ports') or [], key=lambda p: (
+            p.get('PrivatePort', 0), p.get('PublicPort', 0))):
+        if p.get('PublicPort'):
+            port = str.format(
+                '{}->{}/{}', p['PublicPort'], p['PrivatePort'], p['Type'])
+        else:
+            port = str.format('{}/{}', p['PrivatePort'], p['Type'])
+        if port not in ports:  # published on IPv4 and IPv6
+            ports.append(port)
+    return ', '.join(ports) or '-'
+
+
+def _addresses(container):
+    networks = (container.get('NetworkSettings') or {}).get('Networks') or {}
+    return ', '.join(
+        n['IPAddress'] for n in networks.values() if n.get('IPAddress')) or '-'
+
+
+def status_rows(containers, with_stack=False):
+    rows = []
+    for c in sorted(containers, key=container_name):
+        row = [
+            container_name(c),
+            _component(c),
+            c.get('State', ''),
+            _health(c.get('Status', '')),
+            _uptime(c.get('Status', '')),
+            _addresses(c),
+            _ports(c)
+        ]
+        if with_stack:
+            row.insert(1, c.get('Labels', {}).get(labels.STACK_LABEL, '-'))
+        rows.append(row)
+    return rows
+
+
+def format_table(columns, rows):
+    rows = [list(columns)] + [[str(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+    return '\n'.join(
+        '  '.join(v.ljust(w) for v, w in zip(row, widths)).rstrip()
+        for row in rows)
+
+
+def status_table(containers, with_stack=False):
+    columns = list(STATUS_COLUMNS)
+    if with_stack:
+        columns.insert(1, 'STACK')
+    return format_table(columns, status_rows(containers, with_stack))
+
+
+def _size(value):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(value) < 1024.0 or unit == 'GiB':
+            return str.format('{:.4g}{}', float(value), unit)
+        value /= 1024.0
+
+
+def stats_row(name, stats):
+    """ Row of the stats table computed as 'docker stats' does """
+    if not stats:
+        return [name, '--', '--', '--', '--', '--']
+
+    cpu, precpu = stats.get('cpu_stats') or {}, stats.get('precpu_stats') or {}
+    cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - \
+        precpu.get('cpu_usage', {}).get('total_usage', 0)
+    system_delta = cpu.get('system_cpu_usage', 0) - \
+        precpu.get('system_cpu_usage', 0)
+    online_cpus = cpu.get('online_cpus') or len(
+        cpu.get('cpu_usage', {}).get('percpu_usage') or ()) or 1
+    cpu_percent = 0.0
+    if cpu_delta > 0 and system_delta > 0:
+        cpu_percent = 100.0 * cpu_delta / system_delta * online_cpus
+
+    memory = stats.get('memory_stats') or {}
+    details = memory.get('stats') or {}
+    # page cache is not counted, like in 'docker stats'
+    usage = memory.get('usage', 0) - details.get(
+        'inactive_file', details.get('total_inactive_file', 0))
+    limit = memory.get('limit', 0)
+    memory_percent = 100.0 * usage / limit if limit else 0.0
+
+    rx = tx = 0
+    for network in (stats.get('networks') or {}).values():
+        rx += network.get('rx_bytes', 0)
+        tx += network.get('tx_bytes', 0)
+
+    read = write = 0
+    for entry in (stats.get('blkio_stats') or {}).get(
+            'io_service_bytes_recursive') or []:
+        if entry.get('op', '').lower() == 'read':
+            read += entry.get('value', 0)
+        elif entry.get('op', '').lower() == 'write':
+            write += entry.get('value', 0)
+
+    return [
+        name,
+        str.format('{:.2f}%', cpu_percent),
+        str.format('{} / {}', _size(usage), _size(limit)),
+        str.format('{:.2f}%', memory_percent),
+        str.format('{} / {}', _size(rx), _size(tx)),
+        str.format('{} / {}', _size(read), _size(write))
+    ]
+
+
+class StatsMonitor(object):
+    """
+    Streams stats of all given containers at the same time and keeps the
+    latest sample of each. Streams are read by the async engine loop, or
+    by a thread per container with docker-py.
+    """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.latest = {}
+        self._futures = []
+
+    def start(self):
+        if async_engine.enabled():
+            engine = async_engine.engine()
+            for name in self.names:
+                self._futures.append(
+                    async_engine.submit(self._read(engine, name)))
+        else:
+            for name in self.names:
+                threading.Thread(
+                    target=self._read_docker_py, args=(name,),
+                    name=str.format('stats-{}', name), daemon=True).start()
+        return self
+
+    async def _read(self, engine, name):
+        async for stats in engine.stats(name):
+            self.latest[name] = stats
+
+    def _read_docker_py(self, name):
+        for stats in _docker_api().stats(name, decode=True, stream=True):
+            self.latest[name] = stats
+
+    def rows(self):
+        return [stats_row(name, self.latest.get(name)) for name in self.names]
+
+    def stop(self):
+        for future in self._futures:
+            future.cancel()
+
+
+def watch_stats(containers, interval=1.0, count=None, stream=None):
+    """
+    Redraws the stats table of running containers every 'interval'
+    seconds, 'count' times or until interrupted
+    """
+    stream = stream or sys.stdout
+    names = [
+        container_name(c) for c in sorted(containers, key=container_name)
+        if c.get('State') == 'running'
+    ]
+    monitor = StatsMonitor(names).start()
+    try:
+        shown = 0
+        while count is None or shown < count:
+            time.sleep(interval)
+            if stream.isatty():
+                stream.write('\033[H\033[J')  # clear the screen
+            elif shown:
+                stream.write('\n')
+            stream.write(format_table(STATS_COLUMNS, monitor.rows()) + '\n')
+            stream.flush()
+            shown += 1
+    finally:
+        monitor.stop()
@@ -0,0 +1,166 @@
+"""
+Declarative steps of component pipelines. A pipeline is run inside the
+component container as a graph: every step starts as soon as the steps it
+requires are done, and a step is skipped while its cache key matches the
+last successful run recorded in the journal.
+"""
+import fnmatch
+import hashlib
+import os
+from components.db_snapshots import iter_files
+
+# done once in the container while the cache key is the same
+CONTAINER_SCOPE = 'container'
+# done again after every start of the container, e.g. servers
+BOOT_SCOPE = 'boot'
+SCOPES = (CONTAINER_SCOPE, BOOT_SCOPE)
+
+
+class PipelineError(Exception):
+    pass
+
+
+def generated_key(config_key, step_name):
+    """ Key of the files of the checkout written by the step """
+    return str.format('{}:{}', config_key, step_name)
+
+
+class Step(object):
+    """
+    One step of a pipeline.
+
+    'commands' are run by one shell in the container and joined with '&&',
+    so the step fails on the first failed command; 'context' commands
+    ('cd', 'source') are put in front of them. Instead of commands a step
+    may have an 'action', a callable run by the deployer itself.
+    'requires' are names of steps which must be done before, 'inputs' are
+    glob patterns of repository files the step reads: their content is a
+    part of the cache key together with the commands and cache keys of the
+    required steps (not for 'boot' steps, which are repeated only after a
+    restart). A step which isn't 'concurrent' runs alone: it waits for all
+    steps declared before it and the ones declared after it wait for it.
+    'detach' steps are started in background (servers). Files of the
+    checkout which a 'modifies_checkout' step changes are recorded as
+    written by the deployer, and the step is run again once they don't
+    have the content it left, e.g. after the synchronization reset them.
+    """
+
+    def __init__(self, name, commands=(), context=(), requires=(), inputs=(),
+                 concurrent=True, scope=CONTAINER_SCOPE, detach=False,
+                 action=None, modifies_checkout=False):
+        if scope not in SCOPES:
+            raise PipelineError(str.format(
+                "Unknown scope '{}' of step '{}'.", scope, name))
+        if bool(commands) == (action is not None):
+            raise PipelineError(str.format(
+                "Step '{}' needs either commands or an action.", name))
+        self.name = name
+        self.commands = list(commands)
+        self.context = list(context)
+        self.requires = tuple(requires)
+        self.inputs = tuple(inputs)
+        self.concurrent = concurrent
+        self.scope = scope
+        self.detach = detach
+        self.action = action
+        self.modifies_checkout = modifies_checkout
+
+    @property
+    def per_boot(self):
+        return self.scope == BOOT_SCOPE
+
+    def shell_command(self):
+        return ' && '.join(
+            c.strip().rstrip(';').strip()
+            for c in self.context + self.commands)
+
+    def __repr__(self):
+        return str.format('Step({!r})', self.name)
+
+
+class Pipeline(object):
+    """
+    Steps of a component in the order of declaration, which has to be a
+    topological one: a step may require only steps declared before it.
+    """
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        names = set()
+        for step in self.steps:
+            if step.name in names:
+                raise PipelineError(str.format(
+                    "Step '{}' is declared twice.", step.name))
+            for required in step.requires:
+                if required not in names:
+                    raise PipelineError(str.format(
+                        "Step '{}' requires '{}' which is not declared "
+                        "before it.", step.name, required))
+            names.add(step.name)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def dependencies(self):
+        """
+        Names of the steps every step waits for: the required ones plus
+        ordering of the steps which don't run concurrently
+        """
+        dependencies, declared, barrier = {}, [], None
+        for step in self.steps:
+            if not step.concurrent:
+                waits_for = list(declared)
+            else:
+                waits_for = list(step.requires)
+                if barrier is not None and barrier not in waits_for:
+                    waits_for.append(barrier)
+            dependencies[step.name] = waits_for
+            declared.append(step.name)
+            if not step.concurrent:
+                barrier = step.name
+        return dependencies
+
+    def cache_keys(self, root):
+        """
+        Cache key of every step: hash of its commands, content of its
+        inputs under 'root' and cache keys of the required steps
+        """
+        patterns = sorted({p for step in self.steps for p in step.inputs})
+        files = list(iter_files(root, patterns)) if patterns else []
+        digests = {}
+
+        def digest(path):
+            if path not in digests:
+                with open(os.path.join(root, path), mode='rb') as f:
+                    digests[path] = hashlib.sha256(f.read()).hexdigest()
+            return digests[path]
+
+        keys = {}
+        for step in self.steps:
+            key = hashlib.sha256(step.name.encode('utf-8'))
+            key.update(step.shell_command().encode('utf-8'))
+            for required in step.requires:
+                if not step.per_boot:
+                    key.update(keys[required].encode('utf-8'))
+            for path in files:
+                if any(fnmatch.fnmatch(path, p) for p in step.inputs):
+                    key.update(path.encode('utf-8'))
+                    key.update(digest(path).encode('utf-8'))
+            keys[step.name] = key.hexdigest()
+        return keys
+
+    def affected(self, paths):
+        """
+        Names of the steps which have to be run again when files of the
+        repository at 'paths' are changed: steps reading any of them and
+        the ones requiring such steps. 'boot' steps are not affected.
+        """
+        names = []
+        for step in self.steps:
+            if step.per_boot:
+                continue
+            if any(r in names for r in step.requires) or any(
+                    fnmatch.fnmatch(path, pattern)
+                    for path in paths for pattern in step.inputs):
+                names.append(step.name)
+        return names
@@ -0,0 +1,205 @@
+"""
+Removal of Docker objects owned by the deployer. Everything is found by
+labels written at creation, so containers of other tools on the same host
+are never touched, and objects of one kind are removed concurrently.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from components import labels
+from components.stacks import release_stack
+from components.status import container_name, list_containers
+from helpers.color_print import ColorPrint
+from helpers.docker_client import LazyDockerClient
+from config import TEARDOWN
+
+client = LazyDockerClient(max_pool_size=TEARDOWN['WORKERS'])
+cprint = ColorPrint()
+
+CACHE_LABEL = labels.LABEL_PREFIX + '.cache'
+COMPONENT_LABEL = labels.LABEL_PREFIX + '.component'
+
+
+def _label_filters(stack_id):
+    return {'label': [
+        str.format('{}={}', labels.OWNER_LABEL, labels.OWNER),
+        str.format('{}={}', labels.STACK_LABEL, stack_id)
+    ]}
+
+
+def _owned(item, stack_id):
+    item_labels = item.get('Labels') or {}
+    return item_labels.get(labels.OWNER_LABEL) == labels.OWNER and \
+        item_labels.get(labels.STACK_LABEL) == stack_id
+
+
+def _in_use(error):
+    """ Objects used by containers of others are kept, not failed """
+    from docker.errors import APIError
+    return isinstance(error, APIError) and \
+        error.status_code in (403, 409)
+
+
+def _concurrently(func, items):
+    """
+    Calls func for all items at once, returns the number of items it
+    didn't fail or return False for
+    """
+    def call(item):
+        try:
+            return func(item) is not False
+        except Exception as e:
+            cprint.red(str(e))
+            return False
+
+    if not items:
+        return 0
+    with ThreadPoolExecutor(max_workers=TEARDOWN['WORKERS']) as executor:
+        return sum(executor.map(call, items))
+
+
+def remove_containers(containers, grace=None):
+    """
+    Stops running containers at once, giving them 'grace' seconds before
+    they are killed, then removes them with their anonymous volumes
+    """
+    if grace is None:
+        grace = TEARDOWN['STOP_TIMEOUT']
+    running = [c for c in containers if c.get('State') == 'running']
+    if grace > 0 and running:
+        _concurrently(
+            lambda c: client.api.stop(c['Id'], timeout=grace), running)
+
+    def remove(container):
+        client.api.remove_container(container['Id'], force=True, v=True)
+        cprint.orange(str.format(
+            "Container '{}' removed.", container_name(container)))
+
+    return _concurrently(remove, containers)
+
+
+def remove_networks(stack_id):
+    """ Networks of the stack, the ones used by others are kept """
+    def remove(network):
+        try:
+            client.api.remove_network(network['Id'])
+        except Exception as e:
+            if not _in_use(e):
+                raise
+            cprint.orange(str.format(
+                "Network '{}' is kept, it's in use.", network['Name']))
+            return False
+        cprint.orange(str.format("Network '{}' removed.", network['Name']))
+
+    return _concurrently(remove, [
+        n for n in client.api.networks(filters=_label_filters(stack_id))
+        if _owned(n, stack_id)
+    ])
+
+
+def remove_volumes(stack_id):
+    """ Named volumes of the stack except shared package caches """
+    volumes = client.api.volumes(
+        filters=_label_filters(stack_id)).get('Volumes') or []
+
+    def remove(volume):
+        client.api.remove_volume(volume['Name'])
+        cprint.orange(str.format("Volume '{}' removed.", volume['Name']))
+
+    return _concurrently(remove, [
+        v for v in volumes
+        if _owned(v, stack_id) and CACHE_LABEL not in (v.get('Labels') or {})
+    ])
+
+
+def _is_dangling(image):
+    return not [
+        t for t in image.get('RepoTags') or [] if t != '<none>:<none>']
+
+
+def stale_images(stack_id, keep=None, remove_all=False):
+    """
+    Images built or committed for the stack: all of them with
+    'remove_all', otherwise untagged builds replaced by newer ones and warm
+    snapshots beyond the 'keep' newest of every component
+    """
+    if keep is None:
+        keep = TEARDOWN['KEEP_SNAPSHOTS']
+    images = sorted(
+        [
+            i for i in client.api.images(
+                all=False, filters=_label_filters(stack_id))
+            if _owned(i, stack_id)
+        ],
+        key=lambda i: i.get('Created') or 0, reverse=True)
+    if remove_all:
+        return images
+
+    stale, kept = [], {}
+    for image in images:
+        if _is_dangling(image):
+            stale.append(image)
+            continue
+        component = (image.get('Labels') or {}).get(COMPONENT_LABEL)
+        if component is None:
+            continue  # a build, its tag is replaced by the next one
+        kept[component] = kept.get(component, 0) + 1
+        if kept[component] > keep:
+            stale.append(image)
+    return stale
+
+
+def remove_images(images):
+    def remove(image):
+        name = ', '.join(image.get('RepoTags') or []) or image['Id'][:19]
+        try:
+            client.api.remove_image(image['Id'], force=False, noprune=False)
+        except Exception as e:
+            if not _in_use(e):
+                raise
+            cprint.orange(str.format(
+                "Image '{}' is kept, it's used by a container.", name))
+            return False
+        cprint.orange(str.format("Image '{}' removed.", name))
+
+    return _concurrently(remove, images)
+
+
+def teardown(stack_id, config_keys=None, grace=None, images=False):
+    """
+    Removes containers of the given components of the stack (with their
+    replicas and load balancers), or the whole stack: its containers,
+    networks and volumes, and releases its allocation. With 'images' the
+    images of the stack are removed as well, otherwise only stale ones.
+    Returns the number of removed objects.
+    """
+    started = time.time()
+    containers = list_containers(stack_id)
+    if config_keys is not None:
+        containers = [
+            c for c in containers
+            if (c.get('Labels') or {}).get(COMPONENT_LABEL) in config_keys
+        ]
+    removed = remove_containers(containers, grace=grace)
+
+    if config_keys is None:
+        removed += remove_networks(stack_id)
+        removed += remove_volumes(stack_id)
+        removed += remove_images(stale_images(stack_id, remove_all=images))
+        release_stack(stack_id)
+        cprint.green(str.format(
+            "Stack '{}' torn down in {:.1f}s, {} objects removed.",
+            stack_id, time.time() - started, removed))
+    else:
+        cprint.green(str.format(
+            "Removed {} container(s) of {} in stack '{}' in {:.1f}s.",
+            removed, ', '.join(k.lower() for k in config_keys), stack_id,
+            time.time() - started))
+    return removed
+
+
+def prune_images(stack_id, keep=None):
+    """ Removes stale builds and warm snapshots of the stack """
+    removed = remove_images(stale_images(stack_id, keep=keep))
+    cprint.green(str.format(
+        "{} stale images of stack '{}' removed.", removed, stack_id))
+    return removed
@@ -4,6 +4,9 @@ HOME_DEPLOYMENT_DIR = os.path.join(
     os.path.expanduser('~'), 'deployer_test_dir', 'feedback'
 )
 
+# step journals, caches and other state of the deployer
+DEPLOYER_STATE_DIR = os.path.join(HOME_DEPLOYMENT_DIR, '.deployer')
+
 GIT_REPOSITORIES = {
     "feedback-api-python": {
         "branch": "master",
@@ -22,6 +25,104 @@ GIT_REPOSITORIES = {
     }
 }
 
+GIT_SYNC = {
+    'WORKERS': 4,  # repositories synchronized at the same time
+    'CLONE_MODE': 'full',  # 'full', 'shallow' or 'blobless'
+    'DEPTH': 1,  # history depth for 'shallow' mode
+    # 'reset' - hard reset of existing checkout to the remote branch, it
+    # discards local commits and refuses to run while tracked files have
+    # uncommitted changes (except the ones written by the deployer),
+    # 'ff' - fast-forward only (fails if local branch has diverged)
+    'UPDATE_STRATEGY': 'reset',
+    # bare mirrors new checkouts borrow objects from, None to disable
+    'MIRROR_DIR': os.path.join(
+        os.path.expanduser('~'), 'deployer_test_dir', 'git_mirrors')
+}
+
+IMAGES = {
+    'PULL_WORKERS': 4,  # images pulled at the same time
+    # compare digests of local images with the registry ones; otherwise
+    # any local image with a matching tag is considered up to date
+    'CHECK_REMOTE': False
+}
+
+DB_SNAPSHOTS = {
+    # dump databases after migrations and fixtures loading, restore the dump
+    # instead of running them while migrations and fixtures are the same
+    'ENABLED': True
+}
+
+PACKAGE_CACHES = {
+    # named volumes shared by containers for pip, npm and bower caches
+    'VOLUMES': {
+        'pip': 'deployer_pip_cache',
+        'npm': 'deployer_npm_cache',
+        'bower': 'deployer_bower_cache'
+    },
+    'MAX_SIZE_MB': 4096  # total size limit used by cache pruning
+}
+
+STACKS = {
+    # isolated copies of the environment started with 'run.py --stack ID'
+    # get their own container names, subnet, host ports and directory;
+    # allocations are kept in the registry shared by all stacks of the host
+    'REGISTRY': os.path.join(
+        os.path.expanduser('~'), 'deployer_test_dir', 'stacks.json'),
+    'HOME_DIR': os.path.join(
+        os.path.expanduser('~'), 'deployer_test_dir', 'stacks'),
+    'MAX_STACKS': 50,
+    'PORT_STEP': 100  # host ports of the N-th stack are shifted by N * STEP
+}
+
+LOGS = {
+    # full output of every component, e.g. <DIR>/dep_sso.log
+    'DIR': os.path.join(DEPLOYER_STATE_DIR, 'logs'),
+    'FLUSH_INTERVAL': 0.2,  # seconds between terminal writes
+    'MAX_TERMINAL_LINES': 200,  # per write, the rest is only in log files
+    'TAIL_LINES': 30  # last lines of a failed step shown in its error
+}
+
+DOCKER_ENGINE = {
+    # stream output of exec sessions with the asyncio Engine API client in
+    # one background thread (unix socket only), docker-py is used otherwise
+    'ASYNC_EXEC': True
+}
+
+LOAD_BALANCER = {
+    # put in front of components with REPLICAS > 1 on their LOCAL_PORT
+    'IMAGE_NAME': 'nginx:1.25-alpine',
+    # block of addresses at the end of the subnet reserved for every
+    # component: the load balancer and up to this number minus one replicas
+    'ADDRESSES_PER_COMPONENT': 8
+}
+
+TEARDOWN = {
+    # 'run.py down' finds containers, networks, volumes and images by labels
+    'STOP_TIMEOUT': 3,  # seconds to stop before the kill, 0 to kill at once
+    'WORKERS': 16,  # objects removed at the same time
+    # warm snapshots kept for every component, older ones are stale
+    'KEEP_SNAPSHOTS': 2
+}
+
+CHANGE_PLANNER = {
+    # 'run.py up' diffs repositories against commits of the last deployment
+    # and runs only affected steps in running containers which are otherwise
+    # up to date, see 'run.py plan'
+    'ENABLED': True
+}
+
+EVENTS = {
+    # subscribe to Docker events of deployer containers during deployment:
+    # readiness waits wake up on them and a deployment is aborted as soon
+    # as its container or a dependency dies
+    'ENABLED': True
+}
+
+STEPS = {
+    # steps of one component pipeline run in its container at the same time
+    'WORKERS': 4
+}
+
 DOCKER_NETWORK = {
     'NETWORK_NAME': 'dep_network',
     'SUBNET': '172.16.1.0/24',
@@ -40,7 +141,26 @@ CONTAINERS = {
             'HOSTNAME': ['mysqlhost']
         },
         'MYSQL_ROOT_PASSWORD': 'root',
-        'WAIT_FOR_START_TIMEOUT': 10  # seconds
+        'POOL_SIZE': 4,  # max open connections of the deployer
+        # throwaway databases for test stacks: the data dir is on tmpfs and
+        # durability is relaxed, everything is lost when the container stops
+        'FAST_MODE': {
+            'ENABLED': False,
+            'DATA_DIR': '/var/lib/mysql/data',
+            # tmpfs pages count towards the memory limit of RESOURCES
+            'TMPFS_SIZE_MB': 2048,
+            # passed to mysqld after the command of the image
+            'SERVER_OPTIONS': {
+                'innodb_flush_log_at_trx_commit': 0,
+                'sync_binlog': 0,
+                'innodb_doublewrite': 0,
+                'innodb_buffer_pool_size': '1G',
+                'innodb_log_file_size': '256M'
+            }
+        },
+        # limits of the container (of every replica), None for no limit
+        'RESOURCES': {'CPUS': None, 'MEMORY_MB': None},
+        'WAIT_FOR_START_TIMEOUT': 60  # seconds
     },
 
     'RABBITMQ': {
@@ -52,6 +172,8 @@ CONTAINERS = {
             'IPV4_ADDRESS': '172.16.1.3',
             'HOSTNAME': ['rabbitmqhost']
         },
+        'RESOURCES': {'CPUS': None, 'MEMORY_MB': None},
+        'WAIT_FOR_START_TIMEOUT': 60  # seconds
     },
 
     'SSO': {
@@ -59,10 +181,18 @@ CONTAINERS = {
         'LOCAL_PORT': 10180,
         'CONTAINER_NAME': 'dep_sso',
         'IMAGE_NAME': 'custom',  # from Dockerfile
+        # send cloned repository as build context (respecting .dockerignore)
+        # so the Dockerfile can COPY from it
+        'BUILD_CONTEXT': False,
         'NETWORK': {
             'IPV4_ADDRESS': '172.16.1.4',
             'HOSTNAME': ['ssohost']
         },
+        # containers started from the same prepared image behind a load
+        # balancer on LOCAL_PORT, databases are prepared only once
+        'REPLICAS': 1,
+        'RESOURCES': {'CPUS': None, 'MEMORY_MB': None},
+        'WAIT_FOR_START_TIMEOUT': 120  # seconds
     },
 
     'FEEDBACK_API': {
@@ -70,10 +200,16 @@ CONTAINERS = {
         'LOCAL_PORT': 10181,
         'CONTAINER_NAME': 'dep_feedback_api',
         'IMAGE_NAME': 'custom',  # from Dockerfile
+        'BUILD_CONTEXT': False,
         'NETWORK': {
             'IPV4_ADDRESS': '172.16.1.5',
             'HOSTNAME': ['feedbackapihost']
         },
+        # containers started from the same prepared image behind a load
+        # balancer on LOCAL_PORT, databases are prepared only once
+        'REPLICAS': 1,
+        'RESOURCES': {'CPUS': None, 'MEMORY_MB': None},
+        'WAIT_FOR_START_TIMEOUT': 120  # seconds
     },
 
     'XIRCL_FB_BUNDLE': {
@@ -81,9 +217,12 @@ CONTAINERS = {
         'LOCAL_PORT': 8081,
         'CONTAINER_NAME': 'dep_xircl_ui',
         'IMAGE_NAME': 'custom',  # from Dockerfile
+        'BUILD_CONTEXT': False,
         'NETWORK': {
             'IPV4_ADDRESS': '172.16.1.6',
             'HOSTNAME': ['xircluihost']
         },
+        'RESOURCES': {'CPUS': None, 'MEMORY_MB': None},
+        'WAIT_FOR_START_TIMEOUT': 300  # seconds
     }
 }
@@ -0,0 +1,32 @@
+import threading
+
+
+class LazyDockerClient(object):
+    """
+    Proxy to docker.from_env() which imports docker-py and connects on
+    first use, so importing the deployer doesn't need a running daemon and
+    DOCKER_HOST may be set (e.g. to a fake engine) after import.
+    """
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import docker
+                    self._client = docker.from_env(**self._kwargs)
+        return self._client
+
+    def reset(self):
+        """ Closes the connection, the next call reconnects from env """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+
+    def __getattr__(self, name):
+        return getattr(self._get_client(), name)
@@ -1,26 +1,264 @@
+import fcntl
+import hashlib
+import json
 import os
-from git import Repo
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from helpers.color_print import ColorPrint
-from config import GIT_REPOSITORIES
+from helpers.tracing import span, traced
+from config import GIT_REPOSITORIES, GIT_SYNC
 
 cprint = ColorPrint()
 
+# tracked files of checkouts rewritten by the deployer, kept in '.git'
+GENERATED_FILE = 'deployer_generated.json'
+_generated_lock = threading.Lock()
 
-def clone_repositories():
 
-    for component_name, repo_settings in GIT_REPOSITORIES.items():
+def _clone_options():
+    mode = GIT_SYNC.get('CLONE_MODE', 'full')
+    if mode == 'shallow':
+        return {'depth': GIT_SYNC.get('DEPTH', 1)}
+    elif mode == 'blobless':
+        return {'filter': 'blob:none'}
+    elif mode == 'full':
+        return {}
+    raise ValueError(str.format("Unknown git clone mode '{}'.", mode))
 
-        os.makedirs(repo_settings['local_dir'], exist_ok=True, mode=0o777)
 
-        # TODO: if dir with repo already exists - do something
-        Repo.clone_from(
-            url=repo_settings['url'],
-            to_path=repo_settings['local_dir'],
-            branch=repo_settings['branch']
-        )
+def _fetch_options():
+    if GIT_SYNC.get('CLONE_MODE', 'full') == 'shallow':
+        return {'depth': GIT_SYNC.get('DEPTH', 1)}
+    return {}
 
-        cprint.purple(str.format(
-            '{} successfully cloned from branch {}.',
-            repo_settings['url'],
-            repo_settings['branch']
-        ))
+
+def update_mirror(component_name, url):
+    """
+    Creates or refreshes a bare mirror of the repository. Mirrors are
+    shared by all stacks on the host, so every one is locked for the update.
+    """
+    from git import Repo
+    mirror_dir = os.path.join(
+        GIT_SYNC['MIRROR_DIR'], str.format('{}.git', component_name))
+
+    os.makedirs(GIT_SYNC['MIRROR_DIR'], exist_ok=True, mode=0o777)
+    with open(mirror_dir + '.lock', mode='w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.isdir(mirror_dir):
+                Repo(mirror_dir).git.fetch('--prune', 'origin')
+            else:
+                Repo.clone_from(url=url, to_path=mirror_dir, mirror=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    return mirror_dir
+
+
+def _clone(component_name, repo_settings):
+    from git import Repo
+    options = _clone_options()
+    if GIT_SYNC.get('MIRROR_DIR'):
+        options['reference_if_able'] = update_mirror(
+            component_name, repo_settings['url'])
+
+    Repo.clone_from(
+        url=repo_settings['url'],
+        to_path=repo_settings['local_dir'],
+        branch=repo_settings['branch'],
+        **options
+    )
+
+
+def _update(repo_settings):
+    from git import Repo
+    repo = Repo(repo_settings['local_dir'])
+    branch = repo_settings['branch']
+    remote_ref = str.format('origin/{}', branch)
+
+    repo.git.fetch('origin', branch, **_fetch_options())
+    # refspec of shallow single-branch clones may not contain the branch
+    repo.git.update_ref(
+        str.format('refs/remotes/{}', remote_ref), 'FETCH_HEAD')
+
+    strategy = GIT_SYNC.get('UPDATE_STRATEGY', 'reset')
+    if strategy == 'reset':
+        changes = local_changes(repo_settings['local_dir'])
+        if changes:
+            raise IOError(str.format(
+                "'{}' has local changes which the reset would discard: {}. "
+                "Commit or stash them first.",
+                repo_settings['local_dir'], ', '.join(changes)))
+        repo.git.checkout('-f', '-B', branch, remote_ref)
+    elif strategy == 'ff':
+        repo.git.checkout(branch)
+        repo.git.merge('--ff-only', remote_ref)
+    else:
+        raise ValueError(
+            str.format("Unknown git update strategy '{}'.", strategy))
+
+
+def head_commit(local_dir):
+    """ Commit checked out in the directory, None if it's not a checkout """
+    from git import Repo
+    if not os.path.isdir(os.path.join(local_dir, '.git')):
+        return None
+    return Repo(local_dir).head.commit.hexsha
+
+
+def changed_paths(local_dir, since):
+    """
+    Paths of tracked files changed in the checkout since the commit, by
+    later commits or local modifications. Both paths of renamed files are
+    given. None if the commit is unknown, e.g. cut off by a shallow clone.
+    """
+    from git import Repo
+    from git.exc import GitCommandError
+    try:
+        diff = Repo(local_dir).git.diff('--name-only', '--no-renames', since)
+    except GitCommandError:
+        return None
+    return sorted(set(diff.splitlines()))
+
+
+def _file_digest(path):
+    try:
+        with open(path, mode='rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def modified_files(local_dir):
+    """ Digests of tracked files which differ from HEAD, by path """
+    from git import Repo
+    diff = Repo(local_dir).git.diff('--name-only', '--no-renames', 'HEAD')
+    return {
+        path: _file_digest(os.path.join(local_dir, path))
+        for path in diff.splitlines()
+    }
+
+
+def _generated_path(local_dir):
+    return os.path.join(local_dir, '.git', GENERATED_FILE)
+
+
+def generated_files(local_dir):
+    """
+    Tracked files of the checkout rewritten by the deployer: digests of
+    the content it left by path, by the key of the writer (e.g. a step)
+    """
+    try:
+        with open(_generated_path(local_dir), mode='r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def record_generated(local_dir, key, before):
+    """
+    Records tracked files changed since the 'before' modified_files()
+    snapshot as the ones written by 'key', together with files it wrote
+    before which still have the same content
+    """
+    with _generated_lock:
+        generated = generated_files(local_dir)
+        previous = generated.get(key, {})
+        generated[key] = {
+            path: digest
+            for path, digest in modified_files(local_dir).items()
+            if before.get(path) != digest or previous.get(path) == digest
+        }
+        tmp_path = _generated_path(local_dir) + '.tmp'
+        with open(tmp_path, mode='w') as f:
+            json.dump(generated, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, _generated_path(local_dir))
+
+
+def stale_generated(local_dir, key):
+    """
+    Files written by 'key' which don't have the content it left anymore,
+    e.g. reset by the synchronization
+    """
+    return sorted(
+        path for path, digest in generated_files(local_dir).get(
+            key, {}).items()
+        if _file_digest(os.path.join(local_dir, path)) != digest)
+
+
+def intact_generated(local_dir):
+    """ Files which still have the content the deployer left in them """
+    return {
+        path
+        for files in generated_files(local_dir).values()
+        for path, digest in files.items()
+        if _file_digest(os.path.join(local_dir, path)) == digest
+    }
+
+
+def local_changes(local_dir):
+    """
+    Tracked files of the checkout changed not by the deployer, or edited
+    after it wrote them
+    """
+    generated = {}
+    for files in generated_files(local_dir).values():
+        generated.update(files)
+    return sorted(
+        path for path, digest in modified_files(local_dir).items()
+        if generated.get(path) != digest)
+
+
+def sync_repository(component_name, repo_settings):
+    """
+    Clones the repository or, if the checkout already exists, brings it
+    up to date with the remote branch.
+    """
+    local_dir = repo_settings['local_dir']
+
+    with span(str.format('sync {}', component_name)):
+        if os.path.isdir(os.path.join(local_dir, '.git')):
+            _update(repo_settings)
+            action = 'updated'
+        elif os.path.isdir(local_dir) and os.listdir(local_dir):
+            raise IOError(str.format(
+                "'{}' is not empty and is not a git repository.", local_dir))
+        else:
+            os.makedirs(local_dir, exist_ok=True, mode=0o777)
+            _clone(component_name, repo_settings)
+            action = 'cloned'
+
+    cprint.purple(str.format(
+        '{} successfully {} from branch {}.',
+        repo_settings['url'],
+        action,
+        repo_settings['branch']
+    ))
+
+
+@traced('sync_repositories')
+def sync_repositories(names=None):
+    """
+    Synchronizes repositories from GIT_REPOSITORIES concurrently, all of
+    them or the ones with keys from 'names'
+    """
+    with ThreadPoolExecutor(max_workers=GIT_SYNC.get('WORKERS')) as executor:
+        futures = {
+            component_name: executor.submit(
+                sync_repository, component_name, repo_settings)
+            for component_name, repo_settings in GIT_REPOSITORIES.items()
+            if names is None or component_name in names
+        }
+
+    errors = []
+    for component_name, future in futures.items():
+        try:
+            future.result()
+        except Exception as e:
+            cprint.red(str.format(
+                "Synchronization of '{}' failed: {}", component_name, e))
+            errors.append(component_name)
+
+    if errors:
+        raise IOError(str.format(
+            'Repositories were not synchronized: {}', ', '.join(errors)))
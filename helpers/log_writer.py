@@ -0,0 +1,164 @@
+import atexit
+import codecs
+import collections
+import os
+import sys
+import threading
+import time
+from helpers.color_print import ColorPrint
+
+
+class StepLog(object):
+    """
+    Output of one step of a component. Bytes are decoded incrementally,
+    so characters split between chunks are kept, and only complete lines
+    are passed to the writer. The last lines are kept for failure reports.
+    """
+
+    def __init__(self, writer, component, step, color, tail_lines):
+        self.writer = writer
+        self.component = component
+        self.step = step
+        self.color = color
+        self.lines = collections.deque(maxlen=tail_lines)
+        self._decoder = codecs.getincrementaldecoder('utf-8')(
+            errors='replace')
+        self._partial = ''
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        with self._lock:
+            if isinstance(data, bytes):
+                data = self._decoder.decode(data)
+            text = self._partial + data
+            *lines, self._partial = text.split('\n')
+            self._add(lines)
+
+    def close(self):
+        with self._lock:
+            text = self._partial + self._decoder.decode(b'', final=True)
+            self._partial = ''
+            if text:
+                self._add([text])
+
+    def _add(self, lines):
+        # progress bars rewrite the line with '\r', only its last state counts
+        lines = [line.rstrip('\r').rsplit('\r', 1)[-1] for line in lines]
+        self.lines.extend(lines)
+        self.writer.emit(self.component, lines, self.color)
+
+    def tail(self):
+        return list(self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class LogWriter(object):
+    """
+    Multiplexes output of concurrently deployed components. Every line is
+    prefixed with the container name and written to the component log
+    file; the terminal gets lines in batches at most every 'interval'
+    seconds and not more than 'max_lines' per batch, skipped lines are
+    counted and left to the log files.
+    """
+
+    def __init__(self, logs_dir, interval=0.2, max_lines=200, tail_lines=30,
+                 stream=None):
+        self.logs_dir = logs_dir
+        self.interval = interval
+        self.max_lines = max_lines
+        self.tail_lines = tail_lines
+        self.stream = stream or sys.stdout
+        self._pending = []  # (component, color, line)
+        self._files = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+
+    def log_path(self, component):
+        return os.path.join(self.logs_dir, str.format('{}.log', component))
+
+    def _file(self, component):
+        if component not in self._files:
+            os.makedirs(self.logs_dir, exist_ok=True)
+            self._files[component] = open(
+                self.log_path(component), mode='a', encoding='utf-8')
+        return self._files[component]
+
+    def _start_flusher(self):
+        if self._flusher is None:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically, name='log-writer',
+                daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def step(self, component, step, cmd=None, color=ColorPrint.YELLOW):
+        """ StepLog for output of a step, marks its start in the log file """
+        with self._lock:
+            self._file(component).write(str.format(
+                '==== {} {}: {}\n', time.strftime('%Y-%m-%d %H:%M:%S'),
+                step, cmd or ''))
+        return StepLog(self, component, step, color, self.tail_lines)
+
+    def message(self, component, text, color=ColorPrint.ORANGE):
+        """ Status message which keeps its order with the output lines """
+        self.emit(component, text.splitlines(), color)
+
+    def emit(self, component, lines, color):
+        if not lines:
+            return
+        with self._lock:
+            log_file = self._file(component)
+            for line in lines:
+                log_file.write(line + '\n')
+                self._pending.append((component, color, line))
+            self._start_flusher()
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            for log_file in self._files.values():
+                log_file.flush()
+        if not pending:
+            return
+
+        skipped = collections.Counter()
+        if len(pending) > self.max_lines:
+            # the newest lines are shown, the skipped ones are counted
+            for component, _, _ in pending[:-self.max_lines]:
+                skipped[component] += 1
+            pending = pending[-self.max_lines:]
+
+        out = []
+        for component, count in sorted(skipped.items()):
+            out.append(str.format(
+                '{}[{}] ... {} lines skipped, see {}{}',
+                ColorPrint.DARKGREY, component, count,
+                self.log_path(component), ColorPrint.ENDC))
+        for component, color, line in pending:
+            out.append(str.format(
+                '{}[{}]{} {}{}{}', ColorPrint.DARKGREY, component,
+                ColorPrint.ENDC, color, line, ColorPrint.ENDC))
+        self.stream.write('\n'.join(out) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            for log_file in self._files.values():
+                log_file.close()
+            self._files = {}
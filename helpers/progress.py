@@ -0,0 +1,121 @@
+import codecs
+import json
+import sys
+import threading
+import time
+from helpers.color_print import ColorPrint
+
+cprint = ColorPrint()
+
+
+def iter_json_objects(chunks):
+    """
+    Yields JSON objects from a stream of byte chunks. A chunk may hold
+    several objects or only a part of one.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    buffer = ''
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = text_decoder.decode(chunk)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            try:
+                obj, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break  # incomplete object, wait for the next chunk
+            buffer = buffer[end:]
+            yield obj
+
+
+def _megabytes(value):
+    return value / (1024.0 * 1024.0)
+
+
+class PullProgress(object):
+    """
+    Combined progress view of concurrent image pulls. Events of all layers
+    are aggregated and the view is redrawn not more often than 'interval'.
+    """
+
+    def __init__(self, interval=0.5, stream=None):
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.is_tty = self.stream.isatty()
+        self.images = {}  # image -> {layer_id: [status, current, total]}
+        self.messages = {}  # image -> last message without layer
+        self._lock = threading.Lock()
+        self._last_render = 0
+        self._rendered_lines = 0
+
+    def add_image(self, image_name):
+        with self._lock:
+            self.images.setdefault(image_name, {})
+            self.messages[image_name] = 'Waiting'
+
+    def update(self, image_name, event):
+        if 'error' in event:
+            raise IOError(str.format(
+                "Pull of '{}' failed: {}", image_name, event['error']))
+
+        with self._lock:
+            layer_id = event.get('id')
+            status = event.get('status', '')
+            if layer_id and 'progressDetail' in event:
+                detail = event['progressDetail'] or {}
+                layer = self.images[image_name].setdefault(
+                    layer_id, [status, 0, 0])
+                layer[0] = status
+                if 'current' in detail:
+                    layer[1] = detail['current']
+                if 'total' in detail:
+                    layer[2] = detail['total']
+            else:
+                self.messages[image_name] = status
+
+        self.render()
+
+    def finish(self, image_name, message):
+        with self._lock:
+            self.messages[image_name] = message
+        self.render(force=True)
+        if not self.is_tty:
+            cprint.green(str.format('[{}] {}', image_name, message))
+
+    def _image_line(self, image_name):
+        layers = self.images[image_name]
+        done = sum(
+            1 for status, _, _ in layers.values()
+            if status in ('Pull complete', 'Already exists'))
+        current = sum(layer[1] for layer in layers.values())
+        total = sum(layer[2] for layer in layers.values())
+        line = str.format('[{}] {}', image_name, self.messages[image_name])
+        if layers:
+            line += str.format(
+                ' - layers: {}/{}, downloaded: {:.1f}/{:.1f} MB',
+                done, len(layers), _megabytes(current), _megabytes(total))
+        return line
+
+    def render(self, force=False):
+        """ Redraws the view in place (only for terminals) """
+        if not self.is_tty:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_render < self.interval:
+                return
+            self._last_render = now
+
+            lines = [self._image_line(i) for i in sorted(self.images)]
+            if self._rendered_lines:
+                self.stream.write(
+                    str.format('\033[{}F', self._rendered_lines))
+            for line in lines:
+                self.stream.write(str.format('\033[2K{}\n', line))
+            self.stream.flush()
+            self._rendered_lines = len(lines)
@@ -0,0 +1,122 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from helpers.color_print import ColorPrint
+
+cprint = ColorPrint()
+
+
+class Tracer(object):
+    """
+    Records nested spans with wall time. Spans are kept per thread, so
+    concurrently deployed components get their own tracks.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, category='deploy', **args):
+        stack = self._stack()
+        span = {
+            'name': name,
+            'cat': category,
+            'tid': threading.get_ident(),
+            'thread': threading.current_thread().name,
+            'depth': len(stack),
+            'parent': stack[-1]['name'] if stack else None,
+            'args': args,
+            'start': time.perf_counter() - self._origin,
+        }
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span['args']['error'] = str(e)
+            raise
+        finally:
+            stack.pop()
+            span['duration'] = (
+                time.perf_counter() - self._origin - span['start'])
+            with self._lock:
+                self.spans.append(span)
+
+    def traced(self, name=None, category='deploy'):
+        """ Decorator which wraps every call of a function into a span """
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, category):
+                    return func(*args, **kwargs)
+            wrapper.__traced__ = True
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.spans = []
+            self._origin = time.perf_counter()
+
+    def chrome_trace(self):
+        """ Spans in Chrome trace-event format (chrome://tracing) """
+        with self._lock:
+            spans = list(self.spans)
+
+        events = []
+        threads = {}
+        for span in spans:
+            threads[span['tid']] = span['thread']
+            events.append({
+                'name': span['name'],
+                'cat': span['cat'],
+                'ph': 'X',
+                'pid': os.getpid(),
+                'tid': span['tid'],
+                'ts': round(span['start'] * 1e6),
+                'dur': round(span['duration'] * 1e6),
+                'args': span['args'],
+            })
+        for tid, thread_name in threads.items():
+            events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+                'tid': tid, 'args': {'name': thread_name}
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, mode='w') as trace_file:
+            json.dump(self.chrome_trace(), trace_file, default=str)
+        return path
+
+    def summary(self, limit=15):
+        """ Table of the slowest spans """
+        with self._lock:
+            spans = sorted(
+                self.spans, key=lambda s: s['duration'], reverse=True)
+
+        lines = [str.format('{:>10}  {:<5}  {}', 'seconds', 'depth', 'span')]
+        for span in spans[:limit]:
+            lines.append(str.format(
+                '{:>10.2f}  {:<5}  {}{}',
+                span['duration'], span['depth'], '  ' * span['depth'],
+                span['name']))
+        return '\n'.join(lines)
+
+
+tracer = Tracer()
+span = tracer.span
+traced = tracer.traced
@@ -1,5 +1,5 @@
-from components.deploy_operations import run_deployment
+from components.cli import main
 
 
 if __name__ == '__main__':
-    run_deployment()
+    main()
@@ -0,0 +1,8 @@
+import sys
+
+# tests don't need a local config.py, the default settings are used
+try:
+    import config  # noqa
+except ImportError:
+    import config_default
+    sys.modules['config'] = config_default
@@ -0,0 +1,178 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from components import change_planner
+from components.change_planner import (
+    CHANGED, FULL, UNCHANGED, DeployedState, plan_changes
+)
+from components.steps import Pipeline, Step
+
+SETTINGS = {
+    'DB': {'CONTAINER_NAME': 'test_db', 'IMAGE_NAME': 'mysql:5.7'},
+    'APP': {'CONTAINER_NAME': 'test_app', 'IMAGE_NAME': 'custom'}
+}
+REPOSITORIES = {'app': {'local_dir': '/nonexistent/app'}}
+
+
+class Component(object):
+    """ The part of DeploymentComponent the planner uses """
+
+    def __init__(self, config_key, depends_on=(), repository=None,
+                 setup_manifests=(), build_context=None):
+        self.config_key = config_key
+        self.container_name = SETTINGS[config_key]['CONTAINER_NAME']
+        self.depends_on = depends_on
+        self.repository = repository
+        self.setup_manifests = setup_manifests
+        self.build_context = build_context
+
+    def build_context_dir(self):
+        return self.build_context
+
+    def pipeline(self):
+        if self.repository is None:
+            return None
+        return Pipeline([
+            Step('prepare', ['uncomment config'], inputs=('setup.py',),
+                 concurrent=False, modifies_checkout=True),
+            Step('migrate', ['migrate'], requires=('prepare',),
+                 inputs=('*/migrations/*.py',)),
+            Step('static', ['collectstatic'], requires=('prepare',),
+                 inputs=('*/static/*',))
+        ])
+
+
+class PlanChangesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.state = DeployedState(
+            os.path.join(self.dir.name, 'deployed.json'))
+        self.db = Component('DB')
+        self.app = Component(
+            'APP', depends_on=('DB',), repository='app',
+            setup_manifests=('requirements*.txt',))
+
+        # the checkout and running containers
+        self.head = 'c2'
+        self.paths = []
+        self.intact = set()
+        self.stale = []
+        self.running = {'test_db': 'db-1', 'test_app': 'app-1'}
+
+        patches = [
+            mock.patch.dict(change_planner.CONTAINERS, SETTINGS),
+            mock.patch.dict(change_planner.GIT_REPOSITORIES, REPOSITORIES),
+            mock.patch.multiple(
+                change_planner,
+                head_commit=lambda local_dir: self.head,
+                changed_paths=lambda local_dir, since: self.paths,
+                intact_generated=lambda local_dir: self.intact,
+                stale_generated=lambda local_dir, key: self.stale,
+                _running_id=lambda name: self.running.get(name))
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def deploy(self):
+        """ Records both components as deployed at commit 'c1' """
+        self.state.record(self.db, None)
+        self.state.record(self.app, 'c1')
+
+    def plan(self, force=False):
+        return plan_changes([self.app, self.db], force, self.state)
+
+    def test_first_deployment_is_full(self):
+        plans = self.plan()
+        self.assertEqual(plans['DB'].mode, FULL)
+        self.assertEqual(plans['APP'].mode, FULL)
+
+    def test_forced_deployment_is_full(self):
+        self.deploy()
+        self.assertEqual(self.plan(force=True)['APP'].mode, FULL)
+
+    def test_not_changed(self):
+        self.deploy()
+        plans = self.plan()
+        self.assertEqual(plans['DB'].mode, UNCHANGED)
+        self.assertEqual(plans['APP'].mode, UNCHANGED)
+
+    def test_changed_paths_select_steps(self):
+        self.deploy()
+        self.paths = ['app/migrations/0002_user.py']
+        plan = self.plan()['APP']
+        self.assertEqual(plan.mode, CHANGED)
+        self.assertEqual(plan.paths, self.paths)
+        self.assertEqual(plan.steps, ['migrate'])
+        self.assertEqual(plan.commit, 'c2')
+
+    def test_changed_setup_manifest_is_full(self):
+        self.deploy()
+        self.paths = ['requirements.txt']
+        self.assertEqual(self.plan()['APP'].mode, FULL)
+
+    def test_changed_build_context_is_full(self):
+        self.deploy()
+        self.app.build_context = '/nonexistent/app'
+        self.paths = ['app/static/app.css']
+        self.assertEqual(self.plan()['APP'].mode, FULL)
+
+    def test_recreated_container_is_full(self):
+        self.deploy()
+        self.running['test_app'] = 'app-2'
+        self.assertEqual(self.plan()['APP'].mode, FULL)
+
+    def test_stopped_container_is_full(self):
+        self.deploy()
+        del self.running['test_app']
+        self.assertEqual(self.plan()['APP'].mode, FULL)
+
+    def test_recreated_dependency_is_full(self):
+        self.deploy()
+        self.running['test_db'] = 'db-2'
+        plans = self.plan()
+        self.assertEqual(plans['DB'].mode, FULL)
+        self.assertEqual(plans['APP'].mode, FULL)
+
+    def test_changed_settings_are_full(self):
+        self.deploy()
+        with mock.patch.dict(change_planner.CONTAINERS, {
+                'APP': dict(SETTINGS['APP'], IMAGE_NAME='other')}):
+            self.assertEqual(self.plan()['APP'].mode, FULL)
+
+    def test_unknown_deployed_commit_is_full(self):
+        self.deploy()
+        self.paths = None
+        self.assertEqual(self.plan()['APP'].mode, FULL)
+
+    def test_files_written_by_the_deployer_are_not_changes(self):
+        self.deploy()
+        self.paths = ['app/settings.py']
+        self.intact = {'app/settings.py'}
+        self.assertEqual(self.plan()['APP'].mode, UNCHANGED)
+
+    def test_reset_files_of_the_deployer_are_written_again(self):
+        self.deploy()
+        self.stale = ['app/settings.py']
+        plan = self.plan()['APP']
+        self.assertEqual(plan.mode, CHANGED)
+        self.assertEqual(plan.paths, [])
+        self.assertEqual(plan.steps, ['prepare'])
+
+        self.paths = ['app/static/app.css']
+        self.assertEqual(self.plan()['APP'].steps, ['static', 'prepare'])
+
+    def test_state_is_persisted(self):
+        self.deploy()
+        state = DeployedState(self.state.path)
+        self.assertEqual(state.get('APP')['commit'], 'c1')
+        self.assertEqual(state.get('APP')['container_id'], 'app-1')
+        self.assertEqual(state.get('APP')['dependencies'], {'DB': 'db-1'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from components import deploy_components
+from components.change_planner import CHANGED, ChangePlan
+from components.deploy_components import DeploymentComponent
+from components.journal import StepFailedError, StepJournal
+from components.steps import Pipeline, Step
+
+
+class App(DeploymentComponent):
+    config_key = 'APP'
+    repository = 'app'
+
+    def create(self):
+        pass
+
+
+class DatabaseApp(App):
+    databases = ('app',)
+    database_inputs = ('migrations/*.py',)
+
+    def pipeline(self):
+        return Pipeline([
+            Step('databases', action=lambda: self.run_database_steps([
+                ('db', ['cd /app;', 'migrate;', 'makeunit;', 'migrate;'])
+            ]), inputs=self.database_inputs),
+            Step('static', ['collectstatic;'], inputs=('static/*',))
+        ])
+
+
+class ComponentTestCase(unittest.TestCase):
+    """ Component whose commands are recorded instead of executed """
+
+    component_class = App
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.local_dir = os.path.join(self.dir.name, 'app')
+        os.makedirs(self.local_dir)
+
+        patches = [
+            mock.patch.dict(deploy_components.GIT_REPOSITORIES, {
+                'app': {'local_dir': self.local_dir}}),
+            mock.patch.object(
+                deploy_components, 'log_writer', mock.MagicMock()),
+            # not autospecced: the lazy client would connect
+            mock.patch.object(deploy_components, 'client', mock.MagicMock())
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        deploy_components.client.api.inspect_container.return_value = {
+            'Id': 'container-1', 'State': {'StartedAt': 'boot-1'}}
+
+        self.executed = []
+        self.failing = set()
+        self.component = self.component_class('test_app', 'custom', 80, 8080)
+        self.component._journal = StepJournal(
+            os.path.join(self.dir.name, 'journal.json'))
+        self.component.journal.bind('container-1', 'boot-1')
+        self.component._exec = self.execute
+
+    def execute(self, container_name, cmd, log):
+        self.executed.append(cmd)
+        return 1 if cmd in self.failing else 0
+
+    def write(self, path, content):
+        full_path = os.path.join(self.local_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, mode='w') as f:
+            f.write(content)
+
+
+class RunStepsTest(ComponentTestCase):
+    def test_repeated_command_is_run_every_time(self):
+        self.component.run_steps('db', [
+            'cd /app;', 'migrate;', 'makeunit;', 'migrate;'])
+        self.assertEqual(self.executed, [
+            'cd /app; migrate;', 'cd /app; makeunit;', 'cd /app; migrate;'])
+
+    def test_rerun_resumes_from_the_failed_step(self):
+        commands = ['migrate;', 'makeunit;', 'migrate;']
+        self.failing = {'makeunit;'}
+        with self.assertRaises(StepFailedError):
+            self.component.run_steps('db', commands)
+
+        self.failing = set()
+        self.executed = []
+        self.component.run_steps('db', commands)
+        self.assertEqual(self.executed, ['makeunit;', 'migrate;'])
+
+        self.executed = []
+        self.component.run_steps('db', commands)
+        self.assertEqual(self.executed, [])
+
+
+class ApplyChangesTest(ComponentTestCase):
+    component_class = DatabaseApp
+
+    def setUp(self):
+        super(ApplyChangesTest, self).setUp()
+        patches = [
+            mock.patch.dict(
+                deploy_components.DB_SNAPSHOTS, {'ENABLED': True}),
+            mock.patch.multiple(
+                deploy_components.db_snapshots,
+                snapshot_path=lambda name, key: os.path.join(
+                    self.dir.name, key + '.sql.gz'),
+                dump_databases=mock.DEFAULT,
+                restore_databases=mock.DEFAULT)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.write('migrations/0001_initial.py', 'initial')
+        self.write('static/app.css', 'body {}')
+
+    def apply_changes(self, *paths):
+        pipeline = self.component.pipeline()
+        self.executed = []
+        self.component.apply_changes(ChangePlan(
+            self.component, None, CHANGED, 'repository changed',
+            paths=paths, steps=pipeline.affected(paths)))
+
+    def test_changed_migration_is_applied(self):
+        self.component.run_pipeline(self.component.pipeline())
+        self.assertIn('cd /app; migrate;', self.executed)
+
+        self.write('migrations/0002_user.py', 'user')
+        self.apply_changes('migrations/0002_user.py')
+        self.assertEqual(self.executed, [
+            'cd /app; migrate;', 'cd /app; makeunit;', 'cd /app; migrate;'])
+
+    def test_snapshot_is_dumped_after_changed_migration_is_applied(self):
+        def dump(client, databases, path):
+            self.executed.append(os.path.basename(path))
+
+        deploy_components.db_snapshots.dump_databases.side_effect = dump
+        self.component.run_pipeline(self.component.pipeline())
+        first_dump = self.executed[-1]
+
+        self.write('migrations/0002_user.py', 'user')
+        self.apply_changes('migrations/0002_user.py')
+        self.assertEqual(self.executed[:3], [
+            'cd /app; migrate;', 'cd /app; makeunit;', 'cd /app; migrate;'])
+        self.assertEqual(len(self.executed), 4)
+        self.assertNotEqual(self.executed[3], first_dump)
+
+    def test_snapshot_is_not_dumped_from_steps_of_another_key(self):
+        self.component.run_pipeline(self.component.pipeline())
+        dump = deploy_components.db_snapshots.dump_databases
+        dump.reset_mock()
+
+        self.write('migrations/0002_user.py', 'user')
+        # steps of the group were skipped, e.g. done under the old key
+        with mock.patch.object(self.component, 'run_steps'):
+            self.component.run_steps.return_value = ['step']
+            self.apply_changes('migrations/0002_user.py')
+        dump.assert_not_called()
+
+    def test_failed_migration_is_not_dumped(self):
+        self.component.run_pipeline(self.component.pipeline())
+        dump = deploy_components.db_snapshots.dump_databases
+        dump.reset_mock()
+
+        self.write('migrations/0002_user.py', 'user')
+        self.failing = {'cd /app; makeunit;'}
+        with self.assertRaises(StepFailedError):
+            self.apply_changes('migrations/0002_user.py')
+        dump.assert_not_called()
+
+    def test_not_affected_steps_are_not_run(self):
+        self.component.run_pipeline(self.component.pipeline())
+
+        self.write('static/app.css', 'body { color: red }')
+        self.apply_changes('static/app.css')
+        self.assertEqual(self.executed, ['collectstatic'])
+
+
+if __name__ == '__main__':
+    unittest.main()
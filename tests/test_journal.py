@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+from components.journal import StepJournal
+
+
+class StepJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'journal', 'app.json')
+        self.journal = StepJournal(self.path)
+        self.journal.bind('container-1', 'boot-1')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_succeeded_step_is_done(self):
+        self.journal.record('step:a', 'a', 'cmd', 'succeeded')
+        self.assertTrue(self.journal.is_done('step:a'))
+        self.assertFalse(self.journal.is_done('step:b'))
+
+    def test_failed_step_is_not_done(self):
+        self.journal.record('step:a', 'a', 'cmd', 'failed', exit_code=1)
+        self.assertFalse(self.journal.is_done('step:a'))
+
+    def test_records_are_dropped_for_a_new_container(self):
+        self.journal.record('step:a', 'a', 'cmd', 'succeeded')
+        self.journal.bind('container-1', 'boot-2')
+        self.assertTrue(self.journal.is_done('step:a'))
+
+        self.journal.bind('container-2', 'boot-3')
+        self.assertFalse(self.journal.is_done('step:a'))
+        self.assertEqual(StepJournal(self.path).steps, {})
+
+    def test_per_boot_step_is_done_until_restart(self):
+        self.journal.record('step:server', 'server', 'cmd', 'started',
+                            per_boot=True)
+        self.assertTrue(self.journal.is_done('step:server'))
+
+        self.journal.bind('container-1', 'boot-2')
+        self.assertFalse(self.journal.is_done('step:server'))
+
+    def test_cache_key_must_match(self):
+        self.journal.record('step:a', 'a', 'cmd', 'succeeded',
+                            cache_key='key-1')
+        self.assertTrue(self.journal.is_done('step:a', cache_key='key-1'))
+        self.assertFalse(self.journal.is_done('step:a', cache_key='key-2'))
+        # without a cache key any successful run counts
+        self.assertTrue(self.journal.is_done('step:a'))
+
+    def test_journal_is_persisted(self):
+        self.journal.record('step:a', 'a', 'cmd', 'succeeded',
+                            cache_key='key-1')
+        journal = StepJournal(self.path)
+        self.assertEqual(journal.container_id, 'container-1')
+        self.assertTrue(journal.is_done('step:a', cache_key='key-1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import threading
+import unittest
+from components.scheduler import DependencyError, DependencyScheduler
+
+
+class DependencySchedulerTest(unittest.TestCase):
+    def test_stages(self):
+        scheduler = DependencyScheduler()
+        scheduler.add_task('mysql', lambda: None)
+        scheduler.add_task('rabbitmq', lambda: None)
+        scheduler.add_task('sso', lambda: None, depends_on=('mysql',))
+        scheduler.add_task(
+            'feedback', lambda: None, depends_on=('sso', 'rabbitmq'))
+        self.assertEqual(
+            scheduler.stages(), [['mysql', 'rabbitmq'], ['sso'], ['feedback']])
+
+    def test_task_is_registered_once(self):
+        scheduler = DependencyScheduler()
+        scheduler.add_task('a', lambda: None)
+        with self.assertRaises(DependencyError):
+            scheduler.add_task('a', lambda: None)
+
+    def test_unknown_dependency(self):
+        scheduler = DependencyScheduler()
+        scheduler.add_task('a', lambda: None, depends_on=('b',))
+        with self.assertRaises(DependencyError):
+            scheduler.validate()
+
+    def test_cycle(self):
+        scheduler = DependencyScheduler()
+        scheduler.add_task('a', lambda: None, depends_on=('c',))
+        scheduler.add_task('b', lambda: None, depends_on=('a',))
+        scheduler.add_task('c', lambda: None, depends_on=('b',))
+        with self.assertRaises(DependencyError):
+            scheduler.run()
+
+    def test_tasks_run_after_their_dependencies(self):
+        finished, lock = [], threading.Lock()
+
+        def task(name):
+            def run():
+                with lock:
+                    finished.append(name)
+                return name
+            return run
+
+        scheduler = DependencyScheduler(max_workers=4)
+        scheduler.add_task('a', task('a'))
+        scheduler.add_task('b', task('b'), depends_on=('a',))
+        scheduler.add_task('c', task('c'), depends_on=('a',))
+        scheduler.add_task('d', task('d'), depends_on=('b', 'c'))
+
+        results = scheduler.run()
+        self.assertEqual(results, {name: name for name in 'abcd'})
+        self.assertEqual(finished[0], 'a')
+        self.assertEqual(finished[-1], 'd')
+
+    def test_failure_stops_scheduling(self):
+        started = []
+
+        def fail():
+            raise ValueError('failed')
+
+        scheduler = DependencyScheduler()
+        scheduler.add_task('a', fail)
+        scheduler.add_task(
+            'b', lambda: started.append('b'), depends_on=('a',))
+        with self.assertRaises(ValueError):
+            scheduler.run()
+        self.assertEqual(started, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
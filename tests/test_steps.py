@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+from components.steps import BOOT_SCOPE, Pipeline, PipelineError, Step
+
+
+def make_pipeline():
+    return Pipeline([
+        Step('prepare', ['setup.py develop'], inputs=('setup.py',),
+             concurrent=False),
+        Step('migrate', ['migrate'], requires=('prepare',),
+             inputs=('*/migrations/*.py',)),
+        Step('static', ['collectstatic'], requires=('prepare',),
+             inputs=('*/static/*',)),
+        Step('fixtures', ['loaddata'], requires=('migrate',)),
+        Step('server', ['uwsgi'], requires=('fixtures', 'static'),
+             scope=BOOT_SCOPE)
+    ])
+
+
+class PipelineTest(unittest.TestCase):
+    def test_required_step_must_be_declared_before(self):
+        with self.assertRaises(PipelineError):
+            Pipeline([Step('b', ['b'], requires=('a',)), Step('a', ['a'])])
+
+    def test_step_is_declared_once(self):
+        with self.assertRaises(PipelineError):
+            Pipeline([Step('a', ['a']), Step('a', ['b'])])
+
+    def test_step_needs_commands_or_action(self):
+        with self.assertRaises(PipelineError):
+            Step('a')
+        with self.assertRaises(PipelineError):
+            Step('a', ['a'], action=lambda: None)
+
+    def test_dependencies(self):
+        self.assertEqual(make_pipeline().dependencies(), {
+            'prepare': [],
+            'migrate': ['prepare'],
+            'static': ['prepare'],
+            'fixtures': ['migrate', 'prepare'],
+            'server': ['fixtures', 'static', 'prepare']
+        })
+
+    def test_not_concurrent_step_waits_for_all_declared_before(self):
+        pipeline = Pipeline([
+            Step('a', ['a']), Step('b', ['b']),
+            Step('c', ['c'], concurrent=False), Step('d', ['d'])
+        ])
+        dependencies = pipeline.dependencies()
+        self.assertEqual(dependencies['c'], ['a', 'b'])
+        self.assertEqual(dependencies['d'], ['c'])
+
+    def test_affected_by_inputs_and_required_steps(self):
+        pipeline = make_pipeline()
+        self.assertEqual(
+            pipeline.affected(['app/migrations/0002_user.py']),
+            ['migrate', 'fixtures'])
+        self.assertEqual(
+            pipeline.affected(['app/static/app.css']), ['static'])
+        self.assertEqual(
+            pipeline.affected(['setup.py']),
+            ['prepare', 'migrate', 'static', 'fixtures'])
+        self.assertEqual(pipeline.affected(['README.md']), [])
+
+
+class CacheKeysTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.write('setup.py', 'setup()')
+        self.write('app/migrations/0001_initial.py', 'initial')
+        self.write('app/static/app.css', 'body {}')
+
+    def tearDown(self):
+        self.root.cleanup()
+
+    def write(self, path, content):
+        full_path = os.path.join(self.root.name, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, mode='w') as f:
+            f.write(content)
+
+    def test_keys_are_stable(self):
+        self.assertEqual(
+            make_pipeline().cache_keys(self.root.name),
+            make_pipeline().cache_keys(self.root.name))
+
+    def test_changed_input_changes_step_and_requiring_steps(self):
+        before = make_pipeline().cache_keys(self.root.name)
+        self.write('app/migrations/0002_user.py', 'user')
+        after = make_pipeline().cache_keys(self.root.name)
+
+        changed = {name for name in before if before[name] != after[name]}
+        self.assertEqual(changed, {'migrate', 'fixtures'})
+
+    def test_boot_step_key_does_not_follow_required_steps(self):
+        before = make_pipeline().cache_keys(self.root.name)
+        self.write('app/static/app.css', 'body { color: red }')
+        after = make_pipeline().cache_keys(self.root.name)
+
+        self.assertNotEqual(before['static'], after['static'])
+        self.assertEqual(before['server'], after['server'])
+
+    def test_changed_command_changes_key(self):
+        before = make_pipeline().cache_keys(self.root.name)
+        pipeline = Pipeline([
+            Step('prepare', ['setup.py develop --user'],
+                 inputs=('setup.py',), concurrent=False)
+        ])
+        self.assertNotEqual(
+            before['prepare'], pipeline.cache_keys(self.root.name)['prepare'])
+
+
+if __name__ == '__main__':
+    unittest.main()